@@ -1,31 +1,96 @@
+import argparse
 import json
-import time
-import csv
 import os
-from collections import Counter
-from datetime import datetime
+import sys
+import threading
+import csv
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
 import requests
-from bs4 import BeautifulSoup
 
-# Selenium Imports
-from selenium import webdriver
-from selenium.webdriver.chrome.service import Service
-from selenium.webdriver.chrome.options import Options
-from webdriver_manager.chrome import ChromeDriverManager
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
+# Shared Chartink helpers live in the Django app but don't depend on Django
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'chartink_web'))
+from analyzer.chartink_client import (
+    DEFAULT_HEADERS, capture_scan_clause, clause_hash, copy_driver_cookies,
+    decode_scan_clause, fetch_csrf_token, fetch_scan_clause, post_scan_clause,
+)
+from analyzer.browser_pool import BrowserPool
+from analyzer.http_engine import AsyncScanEngine, ProcessRequest
+from analyzer.ranking import IncidenceMatrix
+
+class ClauseFileCache:
+    """
+    JSON-file counterpart of the web app's ScreenerClauseCache table:
+    url -> scan_clause, its hash, when it was captured and a TTL.
+    """
+    DEFAULT_TTL_SECONDS = 7 * 24 * 3600
+
+    def __init__(self, path='scan_clause_cache.json', ttl_seconds=DEFAULT_TTL_SECONDS):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        try:
+            with open(self.path, 'r') as f:
+                self.entries = json.load(f)
+        except (IOError, ValueError):
+            self.entries = {}
+
+    def get(self, url):
+        entry = self.entries.get(url)
+        if not entry:
+            return None
+        captured_at = datetime.fromisoformat(entry['captured_at'])
+        if datetime.now() >= captured_at + timedelta(seconds=entry.get('ttl_seconds', self.ttl_seconds)):
+            return None
+        return entry
+
+    def store(self, url, scan_clause):
+        with self._lock:
+            self.entries[url] = {
+                'scan_clause': scan_clause,
+                'clause_hash': clause_hash(scan_clause),
+                'captured_at': datetime.now().isoformat(),
+                'ttl_seconds': self.ttl_seconds,
+            }
+            try:
+                with open(self.path, 'w') as f:
+                    json.dump(self.entries, f, indent=2)
+            except IOError as e:
+                print(f"Error saving clause cache: {e}")
 
 class ChartinkAnalyzer:
-    def __init__(self, config_file='screener_config.json'):
+    def __init__(self, config_file='screener_config.json', concurrency=1, max_in_flight=8):
         self.config_file = config_file
-        self.stock_counts = Counter()
+        self.concurrency = max(1, concurrency)
+        self.max_in_flight = max(1, max_in_flight)
+        self.hits = [] # (symbol, screener url) per result row
         self.results = []
-        self.session = requests.Session()
-        self.requests_headers = {
-            'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-             'X-Requested-With': 'XMLHttpRequest',
-        }
+        self.requests_headers = DEFAULT_HEADERS.copy()
+        self.clause_cache = ClauseFileCache()
+        self.browser_pool = BrowserPool(max_size=self.concurrency)
+        self._local = threading.local()
+
+    def _thread_state(self):
+        # One session (and CSRF token) per worker thread: a token is only
+        # valid together with the cookies it was issued with.
+        state = self._local
+        if not hasattr(state, 'session'):
+            state.session = requests.Session()
+            state.csrf_token = None
+        return state
+
+    @property
+    def session(self):
+        return self._thread_state().session
+
+    @property
+    def csrf_token(self):
+        return self._thread_state().csrf_token
+
+    @csrf_token.setter
+    def csrf_token(self, value):
+        self._thread_state().csrf_token = value
+
     def load_config(self):
         try:
             with open(self.config_file, 'r') as f:
@@ -35,155 +100,94 @@ class ChartinkAnalyzer:
             return {'screeners': []}
 
     def close(self):
-        pass # Driver is closed per-request now
+        stats = self.browser_pool.stats()
+        if stats['hits'] or stats['misses']:
+            print(f"Browser pool: {stats['hits']} hits, {stats['misses']} misses, {stats['recycled']} recycled.")
+        self.browser_pool.close()
 
-    def process_screener(self, url):
+    def post_cached_clauses(self, urls):
         """
-        Process a single screener URL with a fresh driver instance.
+        POST every unexpired cached scan_clause concurrently through the
+        async engine. Returns {url: stocks} for the ones that worked.
         """
-        print(f"Processing: {url}")
-        driver = None
-        try:
-            # Setup Headless Chrome for this specific request
-            chrome_options = Options()
-            chrome_options.add_argument("--headless=new") 
-            chrome_options.add_argument("--no-sandbox")
-            chrome_options.add_argument("--disable-dev-shm-usage")
-            chrome_options.add_argument("--page-load-strategy=eager") # Don't wait for full load (images/css)
-            chrome_options.add_argument("user-agent=Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36")
-            
-            driver = webdriver.Chrome(service=Service(ChromeDriverManager().install()), options=chrome_options)
-            driver.set_page_load_timeout(60) # Increased timeout
+        cached = {url: self.clause_cache.get(url) for url in urls}
+        cached = {url: entry for url, entry in cached.items() if entry}
+        if not cached:
+            return {}
 
-            print(f"  [.] Navigating to {url}...")
-            
-            # 1. Enable interception BEFORE navigation using CDP
-            interceptor_script = """
-            window._captured_scan_clause = null;
-            const oldOpen = XMLHttpRequest.prototype.open;
-            const oldSend = XMLHttpRequest.prototype.send;
-            
-            XMLHttpRequest.prototype.open = function(method, url) {
-                this._method = method;
-                this._url = url;
-                return oldOpen.apply(this, arguments);
-            };
-            
-            XMLHttpRequest.prototype.send = function(body) {
-                if (this._method === 'POST' && this._url.includes('/screener/process')) {
-                    window._captured_scan_clause = body;
-                }
-                return oldSend.apply(this, arguments);
-            };
-            """
-            
-            driver.execute_cdp_cmd('Page.addScriptToEvaluateOnNewDocument', {
-                'source': interceptor_script
-            })
+        try:
+            csrf_token = fetch_csrf_token(self.session, next(iter(cached)), self.requests_headers)
+        except Exception as e:
+            print(f"[!] Could not fetch CSRF token for cached clauses: {e}")
+            return {}
 
-            # 2. Navigate
-            driver.get(url)
+        cookies = self.session.cookies.get_dict()
+        engine = AsyncScanEngine(max_in_flight=self.max_in_flight, headers=self.requests_headers)
+        results = engine.run([
+            ProcessRequest(url, entry['scan_clause'], csrf_token, cookies)
+            for url, entry in cached.items()
+        ])
 
-            # 3. Wait for capture (Auto-run)
-            scan_clause_raw = None
-            csrf_token = None
-            
-            for i in range(10): 
-                scan_clause_raw = driver.execute_script("return window._captured_scan_clause;")
-                if scan_clause_raw:
-                    print("  [.] Captured scan_clause from auto-run.")
-                    break
-                time.sleep(0.5)
-
-            # 4. Fallback: Find and Click 'Run Scan'
-            if not scan_clause_raw:
-                print("  [.] Auto-run not detected, attempting to click 'Run Scan'...")
-                try:
-                    run_button = None
-                    xpath_locators = [
-                        "//button[contains(text(), 'Run Scan')]",
-                        "//button[contains(text(), 'Run Scan')]", 
-                        "//input[@value='Run Scan']",
-                        "//button[contains(@class, 'btn-primary')]",
-                        "//button[contains(., 'Run Scan')]"
-                    ]
-                    
-                    for xpath in xpath_locators:
-                        try:
-                            element = driver.find_element(By.XPATH, xpath)
-                            if element.is_displayed():
-                                run_button = element
-                                break
-                        except:
-                            continue
-
-                    if run_button:
-                        driver.execute_script("arguments[0].scrollIntoView(true);", run_button)
-                        time.sleep(0.5)
-                        try:
-                            run_button.click()
-                        except:
-                            driver.execute_script("arguments[0].click();", run_button)
-                        print("  [.] Clicked 'Run Scan' button.")
-                        
-                        for i in range(10):
-                            scan_clause_raw = driver.execute_script("return window._captured_scan_clause;")
-                            if scan_clause_raw:
-                                print("  [.] Captured scan_clause after click.")
-                                break
-                            time.sleep(0.5)
-                    else:
-                        print("  [!] Could not locate 'Run Scan' button.")
-                        
-                except Exception as e:
-                    print(f"  [!] Error interacting with page: {e}")
+        served = {}
+        for url, result in results.items():
+            if isinstance(result, Exception):
+                print(f"  [!] Cached scan_clause failed for {url} ({result}), re-extracting.")
+            else:
+                print(f"Processing: {url}")
+                print(f"  [+] Found {len(result)} stocks (cached scan_clause).")
+                served[url] = result
+        return served
 
-            # 5. Get CSRF Token
+    def process_screener(self, url, use_cache=True):
+        """
+        Process a single screener URL. A cached scan_clause is POSTed directly;
+        otherwise tier 1 reads the clause from the page HTML and tier 2
+        (the browser) only runs when that fails.
+        """
+        print(f"Processing: {url}")
+        cached = self.clause_cache.get(url) if use_cache else None
+        if cached:
             try:
-                csrf_element = driver.find_element(By.CSS_SELECTOR, "meta[name='csrf-token']")
-                csrf_token = csrf_element.get_attribute("content")
-            except:
-                print("  [!] CSRF token not found.")
+                if not self.csrf_token:
+                    self.csrf_token = fetch_csrf_token(self.session, url, self.requests_headers)
+                stocks = post_scan_clause(self.session, cached['scan_clause'], self.csrf_token, self.requests_headers)
+                print(f"  [+] Found {len(stocks)} stocks (cached scan_clause).")
+                return stocks
+            except Exception as e:
+                print(f"  [!] Cached scan_clause failed ({e}), re-extracting.")
+                self.csrf_token = None
+
+        try:
+            scan_clause, csrf_token = fetch_scan_clause(self.session, url, self.requests_headers)
+            if scan_clause and csrf_token:
+                self.csrf_token = csrf_token
+                stocks = post_scan_clause(self.session, scan_clause, csrf_token, self.requests_headers)
+                self.clause_cache.store(url, scan_clause)
+                print(f"  [+] Found {len(stocks)} stocks (tier 1: HTTP).")
+                return stocks
+            print("  [.] Tier 1 (HTTP) found no scan_clause, falling back to browser.")
+        except Exception as e:
+            print(f"  [!] Tier 1 (HTTP) failed ({e}), falling back to browser.")
+            self.csrf_token = None
+
+        try:
+            with self.browser_pool.checkout() as driver:
+                print(f"  [.] Navigating to {url}...")
+                scan_clause_raw, csrf_token = capture_scan_clause(driver, url, log=print)
+                if scan_clause_raw and csrf_token:
+                    # Fetch data using requests
+                    # We need cookies from driver
+                    copy_driver_cookies(driver, self.session)
+                    self.csrf_token = csrf_token
 
-            # 6. Process captured data
             stocks = []
             if scan_clause_raw and csrf_token:
-                import urllib.parse
-                decoded = urllib.parse.unquote(scan_clause_raw)
-                
-                final_scan_clause = None
-                # Try parsing as JSON first
-                try:
-                    json_data = json.loads(decoded)
-                    if isinstance(json_data, dict) and 'scan_clause' in json_data:
-                        final_scan_clause = json_data['scan_clause']
-                except json.JSONDecodeError:
-                    pass
-                
-                # Fallback to string manipulation if not JSON or parsing failed
-                if not final_scan_clause:
-                    if decoded.startswith('scan_clause='):
-                        final_scan_clause = decoded.replace('scan_clause=', '', 1)
-                    else:
-                        final_scan_clause = decoded
-
-                # Fetch data using requests
-                # We need cookies from driver
-                selenium_cookies = driver.get_cookies()
-                for cookie in selenium_cookies:
-                    self.session.cookies.set(cookie['name'], cookie['value'])
-
-                payload = {'scan_clause': final_scan_clause}
-                post_headers = self.requests_headers.copy()
-                post_headers.update({'X-Csrf-Token': csrf_token})
+                final_scan_clause = decode_scan_clause(scan_clause_raw)
 
                 try:
-                    process_url = 'https://chartink.com/screener/process'
-                    r = self.session.post(process_url, data=payload, headers=post_headers)
-                    r.raise_for_status()
-                    data = r.json()
-                    stocks = data.get('data', [])
-                    print(f"  [+] Found {len(stocks)} stocks.")
+                    stocks = post_scan_clause(self.session, final_scan_clause, csrf_token, self.requests_headers)
+                    self.clause_cache.store(url, final_scan_clause)
+                    print(f"  [+] Found {len(stocks)} stocks (tier 2: browser).")
                     
                     if not stocks:
                         print(f"  [.] No stocks found in response.")
@@ -198,9 +202,6 @@ class ChartinkAnalyzer:
         except Exception as e:
             print(f"  [!] Error processing {url}: {e}")
             return []
-        finally:
-            if driver:
-                driver.quit()
 
     def run(self):
         config = self.load_config()
@@ -212,14 +213,25 @@ class ChartinkAnalyzer:
 
         all_stocks_data = []
 
-        print(f"Starting analysis of {len(screeners)} screeners...")
+        print(f"Starting analysis of {len(screeners)} screeners with {self.concurrency} worker(s)...")
         print("-" * 50)
 
-        for url in screeners:
-            stocks = self.process_screener(url)
-            
+        # Known clauses go out together; only the rest need extraction
+        prefetched = self.post_cached_clauses(screeners)
+        remaining = [url for url in screeners if url not in prefetched]
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            fetched = dict(zip(remaining, executor.map(lambda url: self.process_screener(url, use_cache=False), remaining)))
+
+        # Config order, so the CSV matches a serial run
+        screener_stocks = [prefetched[url] if url in prefetched else fetched[url] for url in screeners]
+
+        for url, stocks in zip(screeners, screener_stocks):
             for stock in stocks:
-                symbol = stock.get('nsecode', stock.get('bsecode', 'Unknown'))
+                # Rows may carry "nsecode": null; skip those with neither code, as the web scanner does
+                symbol = stock.get('nsecode') or stock.get('bsecode')
+                if not symbol:
+                    continue
                 name = stock.get('name', '')
                 close = stock.get('close', 0)
                 volume = stock.get('volume', 0)
@@ -233,13 +245,11 @@ class ChartinkAnalyzer:
                     'scraped_at': datetime.now().isoformat()
                 })
                 
-                self.stock_counts[symbol] += 1
-            
-            time.sleep(2) # Wait between screeners
+                self.hits.append((symbol, url))
 
         self.save_to_csv(all_stocks_data)
         self.print_top_conviction()
-        # No self.close() needed as we close per request
+        self.close()
 
     def save_to_csv(self, data):
         filename = 'screener_results.csv'
@@ -263,16 +273,22 @@ class ChartinkAnalyzer:
         print("(Stocks appearing in multiple screeners)")
         print("="*50)
         
-        top_10 = self.stock_counts.most_common(10)
+        ranking = IncidenceMatrix.from_pairs(self.hits).ranking()
         
         print(f"{'Count':<8} {'Symbol':<15}")
         print("-" * 25)
         
-        for symbol, count in top_10:
+        for symbol, count in zip(ranking.labels[:10].tolist(), ranking.counts[:10].tolist()):
             print(f"{str(count):<8} {symbol:<15}")
 
 if __name__ == "__main__":
-    app = ChartinkAnalyzer()
+    parser = argparse.ArgumentParser(description="Rank stocks across multiple Chartink screeners.")
+    parser.add_argument('--config', default='screener_config.json', help="Screener config file")
+    parser.add_argument('--concurrency', type=int, default=1, help="Screeners processed in parallel")
+    parser.add_argument('--max-in-flight', type=int, default=8, help="Maximum concurrent /screener/process requests")
+    args = parser.parse_args()
+
+    app = ChartinkAnalyzer(config_file=args.config, concurrency=args.concurrency, max_in_flight=args.max_in_flight)
     try:
         app.run()
     except KeyboardInterrupt:
@@ -1,8 +1,15 @@
 from django.contrib import admin
-from .models import Screener, ScanJob, StockResult, GlobalSettings, ScanReport
+from .models import Screener, ScanJob, StockResult, GlobalSettings, ScanReport, ScreenerClauseCache, ScanLogEntry, JobSymbolSummary, Instrument, ScreenerBitmap, SymbolPersistence, ScanTask
 
 admin.site.register(Screener)
 admin.site.register(ScanJob)
 admin.site.register(StockResult)
 admin.site.register(GlobalSettings)
 admin.site.register(ScanReport)
+admin.site.register(ScreenerClauseCache)
+admin.site.register(ScanLogEntry)
+admin.site.register(JobSymbolSummary)
+admin.site.register(Instrument)
+admin.site.register(ScreenerBitmap)
+admin.site.register(SymbolPersistence)
+admin.site.register(ScanTask)
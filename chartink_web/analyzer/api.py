@@ -0,0 +1,289 @@
+"""
+Read-only JSON API, version 1, under /analyzer/api/v1/:
+
+    jobs/                                  scan jobs, newest first (?status=)
+    jobs/<id>/                             one job with its per-screener counts
+    jobs/<id>/rankings/                    the job's symbols in rank order
+    jobs/<id>/screeners/<screener_id>/     the symbols one screener returned
+    diffs/                                 symbols added, dropped or retained
+                                           between two jobs (?section=)
+
+Every list is one page of rows plus a `next` cursor to pass back as
+?after= (see analyzer.pagination); ?limit= sets the page size. ?fields=
+picks the keys of each row and ?min_count= / ?max_count= filter on
+screener count. Responses of completed jobs are cached per settings
+version and carry an ETag, so a client polling with If-None-Match gets
+304 Not Modified without any SQL.
+
+Rankings asking only for symbol, rank, screener_count and
+is_high_conviction are answered from summary_job_rank_cover_idx alone.
+"""
+import hashlib
+
+from django.db.models import Q
+from django.http import JsonResponse
+from django.shortcuts import get_object_or_404
+from django.utils.cache import get_conditional_response
+from django.views.decorators.http import condition, require_GET
+
+from .caching import completed_job, job_context, job_etag, query_variant, settings_version
+from .diff import diff_jobs, jobs_to_compare
+from .models import JobSymbolSummary, ScanJob, ScreenerBitmap, StockResult
+from .pagination import decode_cursor, encode_cursor, keyset_page, page_size
+
+API_VERSION = 1
+
+JOB_FIELDS = ['id', 'status', 'progress', 'started_at', 'completed_at']
+
+RANKING_FIELDS = [
+    'symbol', 'rank', 'screener_count', 'is_high_conviction', 'conviction_score', 'name', 'nse_code', 'bse_code',
+    'close_price', 'volume', 'streak', 'longest_streak', 'first_seen_at',
+]
+
+# Key in the response: StockResult field
+SCREENER_RESULT_FIELDS = {
+    'symbol': 'instrument__symbol',
+    'name': 'instrument__name',
+    'nse_code': 'instrument__nse_code',
+    'bse_code': 'instrument__bse_code',
+    'close_price': 'close_price',
+    'volume': 'volume',
+}
+
+DIFF_FIELDS = [
+    'symbol', 'name', 'nse_code', 'bse_code', 'new_count', 'old_count', 'count_delta', 'new_score', 'old_score',
+    'score_delta', 'new_rank', 'old_rank', 'close_price', 'volume', 'is_high_conviction', 'streak', 'longest_streak',
+    'first_seen_at',
+]
+
+DIFF_SECTIONS = ['added', 'dropped', 'retained']
+
+
+def _error(message, status=400):
+    return JsonResponse({'status': 'error', 'api_version': API_VERSION, 'message': message}, status=status)
+
+
+def _success(payload):
+    return JsonResponse({'status': 'success', 'api_version': API_VERSION, **payload})
+
+
+def _fields(request, allowed, default=None):
+    """
+    Keys from a comma-separated ?fields= value. Raises ValueError.
+    """
+    value = request.GET.get('fields')
+    if not value:
+        return list(default or allowed)
+    fields = [field.strip() for field in value.split(',') if field.strip()]
+    unknown = [field for field in fields if field not in allowed]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}. Choose from: {', '.join(allowed)}.")
+    return fields
+
+
+def _int_param(request, name, minimum=None):
+    """
+    ?<name>= as an int, None when absent. Raises ValueError with a
+    message fit for the client.
+    """
+    value = request.GET.get(name)
+    if not value:
+        return None
+    try:
+        number = int(value)
+    except ValueError:
+        raise ValueError(f"{name} must be an integer.")
+    if minimum is not None and number < minimum:
+        raise ValueError(f"{name} must be {minimum} or more.")
+    return number
+
+
+def _count_filter(request, field='screener_count'):
+    """
+    Q() for ?min_count= and ?max_count=. Raises ValueError.
+    """
+    condition = Q()
+    min_count, max_count = _int_param(request, 'min_count'), _int_param(request, 'max_count')
+    if min_count is not None:
+        condition &= Q(**{f'{field}__gte': min_count})
+    if max_count is not None:
+        condition &= Q(**{f'{field}__lte': max_count})
+    return condition
+
+
+def _page(rows, order, fields, request, sources=None):
+    """
+    One page of a values() queryset as rows holding only `fields`, read
+    from the values named in `sources` (the fields themselves by default).
+    keyset_page() needs the ordering fields among the values even when
+    they aren't asked for.
+    """
+    sources = sources or {field: field for field in fields}
+    page, next_cursor = keyset_page(rows, order, after=request.GET.get('after'), limit=page_size(request.GET.get('limit')))
+    return [{field: row[sources[field]] for field in fields} for row in page], next_cursor
+
+
+def _job_api_etag(name):
+    def etag(request, job_id, **kwargs):
+        return job_etag(f'api-{name}-{query_variant(request)}', job_id)
+    return etag
+
+
+def _cached_job_payload(name, request, job_id, build):
+    """
+    build(job)'s payload as a response, cached per query string once the
+    job has completed. build() raises ValueError for bad parameters.
+    """
+    job = completed_job(job_id) or get_object_or_404(ScanJob, id=job_id)
+    try:
+        payload = job_context(f'api-{name}-{query_variant(request)}', job, lambda: build(job))
+    except ValueError as e:
+        return _error(str(e))
+    return _success(payload)
+
+
+@require_GET
+def jobs(request):
+    """
+    Scan jobs, newest first: ?status=, ?fields=, ?after=, ?limit=.
+    """
+    try:
+        fields = _fields(request, JOB_FIELDS)
+        rows = ScanJob.objects.all()
+        status = request.GET.get('status')
+        if status:
+            if status not in dict(ScanJob.STATUS_CHOICES):
+                raise ValueError(f"Unknown status '{status}'.")
+            rows = rows.filter(status=status)
+        page, next_cursor = _page(rows.values(*{'id', *fields}), [('id', True)], fields, request)
+    except ValueError as e:
+        return _error(str(e))
+
+    # Running jobs change from one poll to the next, so the ETag is the content's
+    response = _success({'rows': page, 'next': next_cursor})
+    response['ETag'] = f'"api-jobs-{hashlib.md5(response.content).hexdigest()[:16]}"'
+    return get_conditional_response(request, etag=response['ETag'], response=response)
+
+
+def _job_detail(job):
+    screeners = ScreenerBitmap.objects.filter(job=job).order_by('screener__name').values(
+        'screener_id', 'screener__name', 'cardinality',
+    )
+    summaries = JobSymbolSummary.objects.filter(job=job)
+    return {
+        'job': {field: getattr(job, field) for field in JOB_FIELDS},
+        'total_symbols': summaries.count(),
+        'high_conviction_symbols': summaries.filter(is_high_conviction=True).count(),
+        'screeners': [
+            {'id': row['screener_id'], 'name': row['screener__name'], 'count': row['cardinality']} for row in screeners
+        ],
+    }
+
+
+@require_GET
+@condition(etag_func=_job_api_etag('job'))
+def job_detail(request, job_id):
+    """
+    One job, its symbol counts and how many symbols each screener returned.
+    """
+    return _cached_job_payload('job', request, job_id, _job_detail)
+
+
+@require_GET
+@condition(etag_func=_job_api_etag('rankings'))
+def rankings(request, job_id):
+    """
+    A job's symbols in rank order: ?fields=, ?min_count=, ?max_count=,
+    ?high_conviction=1, ?after=, ?limit=.
+    """
+    def build(job):
+        fields = _fields(request, RANKING_FIELDS)
+        rows = JobSymbolSummary.objects.filter(Q(job=job) & _count_filter(request))
+        if request.GET.get('high_conviction') == '1':
+            rows = rows.filter(is_high_conviction=True)
+        # symbol is unique within a job, so it settles ties
+        page, next_cursor = _page(rows.values(*{'rank', 'symbol', *fields}), [('rank', False), ('symbol', False)], fields, request)
+        return {'job_id': job.id, 'rows': page, 'next': next_cursor}
+
+    return _cached_job_payload('rankings', request, job_id, build)
+
+
+@require_GET
+@condition(etag_func=_job_api_etag('screener'))
+def screener_results(request, job_id, screener_id):
+    """
+    The symbols one screener returned in a job, in the order it returned
+    them: ?fields=, ?min_count=, ?max_count=, ?after=, ?limit=.
+    """
+    def build(job):
+        fields = _fields(request, list(SCREENER_RESULT_FIELDS))
+        rows = StockResult.objects.filter(job=job, screener_id=screener_id)
+        count_filter = _count_filter(request)
+        if count_filter:
+            counted = JobSymbolSummary.objects.filter(Q(job=job) & count_filter).values('symbol')
+            rows = rows.filter(instrument__symbol__in=counted)
+        page, next_cursor = _page(
+            rows.values('id', *[SCREENER_RESULT_FIELDS[field] for field in fields]), [('id', False)], fields, request,
+            sources=SCREENER_RESULT_FIELDS,
+        )
+        return {'job_id': job.id, 'screener_id': screener_id, 'rows': page, 'next': next_cursor}
+
+    return _cached_job_payload('screener', request, job_id, build)
+
+
+def _diff_etag(request):
+    new_id, old_id = request.GET.get('new'), request.GET.get('old')
+    if not (new_id and old_id and new_id.isdigit() and old_id.isdigit()):
+        return None # Jobs picked by date move on as scans complete
+    if completed_job(new_id) is None or completed_job(old_id) is None:
+        return None
+    return f'"api-diff-{new_id}-{old_id}-{query_variant(request)}-{settings_version()}"'
+
+
+@require_GET
+@condition(etag_func=_diff_etag)
+def diffs(request):
+    """
+    One section (?section=added|dropped|retained) of the diff between
+    ?new= and ?old= (or the latest completed job and the one ?days=
+    before it), in diff order: ?fields=, ?min_count=, ?max_count=
+    (on the new job's count; the old one's for dropped), ?after=, ?limit=.
+    """
+    try:
+        _int_param(request, 'days', minimum=1) # The HTML view falls back to the default instead
+    except ValueError as e:
+        return _error(str(e))
+    new_job, old_job, error = jobs_to_compare(request.GET)
+    if error:
+        return _error(error, status=404)
+    section = request.GET.get('section', 'added')
+    if section not in DIFF_SECTIONS:
+        return _error(f"Unknown section '{section}'. Choose from: {', '.join(DIFF_SECTIONS)}.")
+    try:
+        fields = _fields(request, DIFF_FIELDS)
+        count_field = 'old_count' if section == 'dropped' else 'new_count'
+        min_count, max_count = _int_param(request, 'min_count'), _int_param(request, 'max_count')
+        limit = page_size(request.GET.get('limit'))
+        # The memoized diff is fixed for a settings version, so a position in it is a stable cursor
+        after = request.GET.get('after')
+        position = decode_cursor(after) if after else [0]
+        if len(position) != 1 or type(position[0]) is not int or position[0] < 0:
+            raise ValueError("Invalid cursor.")
+        start = position[0]
+    except ValueError as e:
+        return _error(str(e))
+
+    diff = diff_jobs(new_job, old_job)
+    entries = [
+        entry for entry in diff[section]
+        if (min_count is None or entry[count_field] >= min_count) and (max_count is None or entry[count_field] <= max_count)
+    ]
+    page = entries[start:start + limit]
+    return _success({
+        'new_job': {'id': new_job.id, 'completed_at': new_job.completed_at},
+        'old_job': {'id': old_job.id, 'completed_at': old_job.completed_at},
+        'section': section,
+        'totals': {name: len(diff[name]) for name in DIFF_SECTIONS},
+        'rows': [{field: entry[field] for field in fields} for entry in page],
+        'next': encode_cursor([start + limit]) if start + limit < len(entries) else None,
+    })
@@ -0,0 +1,266 @@
+"""
+Bitmap index of screener membership.
+
+Every finished job stores one ScreenerBitmap per screener: a bitset over
+Instrument ids. Questions such as "in A and B but not C over the last 10
+scans" become a few integer AND/OR/NOT operations per job instead of
+queries over StockResult.
+
+Expressions combine screeners, named by id, URL slug or quoted name:
+
+    26-week-high-new-breakouts & (12 | "Volume Shockers") & ~15
+
+`&`/`and`, `|`/`or`, `~`/`not` and parentheses are supported. NOT is
+taken relative to everything the job returned.
+"""
+import re
+import threading
+import time
+from collections import Counter, OrderedDict
+
+import numpy as np
+from django.db import transaction
+
+from .models import Instrument, ScanJob, Screener, ScreenerBitmap
+from .ranking import IncidenceMatrix
+
+TOKEN_PATTERN = re.compile(r'\s*(?:"([^"]*)"|(\(|\)|&|\||~|!)|([\w.\-]+))')
+
+OPERATORS = {'and': '&', 'or': '|', 'not': '~', '!': '~'}
+
+MODES = ('any', 'all')
+
+# Decoded bitmaps of finished jobs, which never change: job id -> {screener id: int}
+_job_cache = OrderedDict()
+_job_cache_lock = threading.Lock()
+JOB_CACHE_SIZE = 512
+
+
+def to_bytes(bits):
+    return bits.to_bytes((bits.bit_length() + 7) // 8, 'little')
+
+
+def from_bytes(data):
+    return int.from_bytes(bytes(data), 'little')
+
+
+def members(bits):
+    """
+    Instrument ids whose bit is set, ascending.
+    """
+    if not bits:
+        return []
+    flags = np.unpackbits(np.frombuffer(to_bytes(bits), dtype=np.uint8), bitorder='little')
+    return np.flatnonzero(flags).tolist()
+
+
+def build_screener_bitmaps(job_id, incidence=None):
+    """
+    (Re)write a job's ScreenerBitmap rows from its results. Pass the job's
+    IncidenceMatrix if it is already built. Returns the number of bitmaps.
+    """
+    if incidence is None:
+        incidence = IncidenceMatrix.from_job(job_id)
+    bitmaps = []
+    if len(incidence):
+        columns = incidence.matrix.tocsc()
+        size = int(incidence.keys.max()) + 1
+        for column, screener_id in enumerate(incidence.screeners.tolist()):
+            instrument_ids = incidence.keys[columns.indices[columns.indptr[column]:columns.indptr[column + 1]]]
+            flags = np.zeros(size, dtype=bool)
+            flags[instrument_ids] = True
+            bitmaps.append(ScreenerBitmap(
+                job_id=job_id,
+                screener_id=screener_id,
+                bits=np.packbits(flags, bitorder='little').tobytes(),
+                cardinality=len(instrument_ids),
+            ))
+
+    with transaction.atomic():
+        ScreenerBitmap.objects.filter(job_id=job_id).delete()
+        ScreenerBitmap.objects.bulk_create(bitmaps)
+    with _job_cache_lock:
+        _job_cache.pop(job_id, None)
+    return len(bitmaps)
+
+
+def _tokenize(expression):
+    tokens = []
+    position = 0
+    expression = expression.strip()
+    while position < len(expression):
+        match = TOKEN_PATTERN.match(expression, position)
+        if not match or match.end() == position:
+            raise ValueError(f"Unexpected input at position {position}: {expression[position:position + 10]!r}")
+        quoted, operator, word = match.groups()
+        if quoted is not None:
+            tokens.append(('name', quoted))
+        elif operator:
+            tokens.append(('op', OPERATORS.get(operator, operator)))
+        elif word.lower() in OPERATORS:
+            tokens.append(('op', OPERATORS[word.lower()]))
+        else:
+            tokens.append(('name', word))
+        position = match.end()
+    return tokens
+
+
+class _Parser:
+    # expr := term ('|' term)* ; term := factor ('&' factor)* ; factor := '~' factor | '(' expr ')' | name
+    def __init__(self, tokens, resolve):
+        self.tokens = tokens
+        self.position = 0
+        self.resolve = resolve
+
+    def parse(self):
+        if not self.tokens:
+            raise ValueError("Empty expression.")
+        node = self.expr()
+        if self.position < len(self.tokens):
+            raise ValueError(f"Unexpected {self.tokens[self.position][1]!r}.")
+        return node
+
+    def peek(self):
+        return self.tokens[self.position] if self.position < len(self.tokens) else (None, None)
+
+    def take(self):
+        token = self.peek()
+        self.position += 1
+        return token
+
+    def expr(self):
+        node = self.term()
+        while self.peek() == ('op', '|'):
+            self.take()
+            node = ('or', node, self.term())
+        return node
+
+    def term(self):
+        node = self.factor()
+        while self.peek() == ('op', '&'):
+            self.take()
+            node = ('and', node, self.factor())
+        return node
+
+    def factor(self):
+        kind, value = self.take()
+        if (kind, value) == ('op', '~'):
+            return ('not', self.factor())
+        if (kind, value) == ('op', '('):
+            node = self.expr()
+            if self.take() != ('op', ')'):
+                raise ValueError("Missing closing parenthesis.")
+            return node
+        if kind == 'name':
+            return ('screener', self.resolve(value))
+        raise ValueError("Expression ends unexpectedly." if kind is None else f"Unexpected {value!r}.")
+
+
+def _screener_resolver():
+    lookup = {}
+    for screener_id, url, name in Screener.objects.values_list('id', 'url', 'name'):
+        lookup[str(screener_id)] = screener_id
+        lookup[url.rstrip('/').split('/')[-1].lower()] = screener_id
+        if name:
+            lookup.setdefault(name.lower(), screener_id)
+
+    def resolve(token):
+        try:
+            return lookup[token.lower()]
+        except KeyError:
+            raise ValueError(f"Unknown screener: {token!r}.")
+    return resolve
+
+
+def parse_expression(expression):
+    """
+    Parse an expression into a tree of ('and'|'or', left, right),
+    ('not', operand) and ('screener', id) nodes. Raises ValueError.
+    """
+    return _Parser(_tokenize(expression), _screener_resolver()).parse()
+
+
+def evaluate(node, bitmaps, universe):
+    """
+    Bitset matched by a parsed expression in one job; `bitmaps` maps
+    screener id -> bitset, `universe` is the union of them all.
+    """
+    kind = node[0]
+    if kind == 'screener':
+        return bitmaps.get(node[1], 0)
+    if kind == 'not':
+        return universe & ~evaluate(node[1], bitmaps, universe)
+    left = evaluate(node[1], bitmaps, universe)
+    right = evaluate(node[2], bitmaps, universe)
+    return left & right if kind == 'and' else left | right
+
+
+def load_job_bitmaps(job_ids):
+    """
+    {job id: {screener id: bitset}}, decoded once per process and job.
+    """
+    with _job_cache_lock:
+        loaded = {job_id: _job_cache[job_id] for job_id in job_ids if job_id in _job_cache}
+    missing = [job_id for job_id in job_ids if job_id not in loaded]
+    if missing:
+        fetched = {job_id: {} for job_id in missing}
+        for job_id, screener_id, bits in ScreenerBitmap.objects.filter(job_id__in=missing).values_list('job_id', 'screener_id', 'bits'):
+            fetched[job_id][screener_id] = from_bytes(bits)
+        loaded.update(fetched)
+        with _job_cache_lock:
+            _job_cache.update(fetched)
+            while len(_job_cache) > JOB_CACHE_SIZE:
+                _job_cache.popitem(last=False)
+    return loaded
+
+
+def run_query(expression, last=10, job_ids=None, mode='any'):
+    """
+    Evaluate `expression` in each of the last `last` completed jobs (or
+    the given ones) and combine the per-job matches: 'any' keeps symbols
+    matched in at least one job, 'all' those matched in every job.
+    Returns the jobs, the matched symbols with the number of jobs they
+    matched in, and the evaluation time in microseconds.
+    """
+    if mode not in MODES:
+        raise ValueError(f"Mode must be one of {', '.join(MODES)}.")
+    node = parse_expression(expression)
+
+    jobs = ScanJob.objects.filter(status='COMPLETED')
+    if job_ids:
+        jobs = jobs.filter(id__in=job_ids)
+    jobs = list(jobs.order_by('-completed_at').values_list('id', flat=True)[:None if job_ids else last])
+    job_bitmaps = load_job_bitmaps(jobs)
+
+    started = time.perf_counter()
+    per_job = []
+    for job_id in jobs:
+        bitmaps = job_bitmaps[job_id]
+        universe = 0
+        for bits in bitmaps.values():
+            universe |= bits
+        per_job.append(evaluate(node, bitmaps, universe))
+    combined = 0
+    if per_job:
+        combined = per_job[0]
+        for bits in per_job[1:]:
+            combined = combined | bits if mode == 'any' else combined & bits
+    elapsed_us = (time.perf_counter() - started) * 1e6
+
+    hits = Counter()
+    matched = members(combined)
+    for bits in per_job:
+        hits.update(members(bits & combined))
+    instruments = Instrument.objects.in_bulk(matched)
+    matches = sorted(
+        ({'symbol': instruments[instrument_id].symbol, 'name': instruments[instrument_id].name, 'jobs': hits[instrument_id]}
+         for instrument_id in matched if instrument_id in instruments),
+        key=lambda match: (-match['jobs'], match['symbol']),
+    )
+    return {
+        'expression': expression,
+        'mode': mode,
+        'jobs': jobs,
+        'matches': matches,
+        'elapsed_us': round(elapsed_us, 1),
+    }
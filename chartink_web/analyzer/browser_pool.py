@@ -0,0 +1,171 @@
+"""
+Bounded pool of warm headless Chrome instances.
+
+Scans check a driver out, use it for one screener page and hand it back.
+Between uses the pool clears cookies and the interceptor global; drivers
+are recycled after `max_pages` pages or once their JS heap grows past
+`max_memory_mb`. The hit/miss/recycled counters are cumulative for the
+life of the pool and shared by everything using it; to measure one batch
+while others run, pass the same Counter to each of its checkouts.
+Django-free so the CLI can use it as well.
+"""
+import atexit
+import queue
+import threading
+from contextlib import contextmanager
+
+from .chartink_client import create_driver
+
+
+class _PooledDriver:
+    def __init__(self, driver):
+        self.driver = driver
+        self.pages = 0
+
+
+class BrowserPool:
+    def __init__(self, max_size=2, max_pages=25, max_memory_mb=512, driver_factory=create_driver):
+        self.max_size = max_size
+        self.max_pages = max_pages
+        self.max_memory_mb = max_memory_mb
+        self.driver_factory = driver_factory
+        self._idle = queue.LifoQueue() # Most recently used first, it is the warmest
+        self._in_use = 0
+        self._slots = threading.Condition()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.recycled = 0
+
+    @contextmanager
+    def checkout(self, stats=None):
+        """
+        Borrow a driver for the duration of the with-block. Blocks while
+        `max_size` drivers are already checked out. The hit, miss and
+        recycle this checkout causes are also counted in `stats` (a
+        collections.Counter), if given.
+        """
+        with self._slots:
+            self._slots.wait_for(lambda: self._in_use < self.max_size)
+            self._in_use += 1
+        try:
+            try:
+                entry = self._idle.get_nowait()
+                self._count('hits', stats)
+            except queue.Empty:
+                entry = _PooledDriver(self._launch())
+                self._count('misses', stats)
+
+            healthy = False
+            try:
+                yield entry.driver
+                healthy = True
+            finally:
+                entry.pages += 1
+                self._checkin(entry, healthy, stats)
+        finally:
+            with self._slots:
+                self._in_use -= 1
+                self._slots.notify()
+
+    def resize(self, max_size):
+        """
+        Allow `max_size` drivers out at once. Drivers checked out beyond a
+        smaller size finish their page first; idle ones beyond it are quit.
+        """
+        with self._slots:
+            self.max_size = max_size
+            self._slots.notify_all()
+        idle = self._drain() # Warmest first
+        for entry in reversed(idle[:max_size]):
+            self._idle.put(entry)
+        for entry in idle[max_size:]:
+            self._quit(entry.driver)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'recycled': self.recycled,
+                'idle': self._idle.qsize(),
+            }
+
+    def close(self):
+        for entry in self._drain():
+            self._quit(entry.driver)
+
+    def _drain(self):
+        entries = []
+        while True:
+            try:
+                entries.append(self._idle.get_nowait())
+            except queue.Empty:
+                return entries
+
+    def _launch(self):
+        driver = self.driver_factory()
+        try:
+            driver.execute_cdp_cmd('Performance.enable', {})
+        except Exception:
+            pass
+        return driver
+
+    def _count(self, name, stats=None):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+            if stats is not None:
+                stats[name] += 1
+
+    def _checkin(self, entry, healthy, stats=None):
+        if healthy and entry.pages < self.max_pages and self._memory_mb(entry.driver) < self.max_memory_mb:
+            try:
+                self._reset(entry.driver)
+                self._idle.put(entry)
+                return
+            except Exception:
+                pass
+        self._count('recycled', stats)
+        self._quit(entry.driver)
+
+    def _reset(self, driver):
+        driver.execute_script("window._captured_scan_clause = null;")
+        # delete_all_cookies() only covers the current domain
+        driver.execute_cdp_cmd('Network.clearBrowserCookies', {})
+        driver.get('about:blank')
+
+    def _memory_mb(self, driver):
+        try:
+            metrics = driver.execute_cdp_cmd('Performance.getMetrics', {})['metrics']
+        except Exception:
+            return 0
+        for metric in metrics:
+            if metric['name'] == 'JSHeapTotalSize':
+                return metric['value'] / (1024 * 1024)
+        return 0
+
+    def _quit(self, driver):
+        try:
+            driver.quit()
+        except Exception:
+            pass
+
+
+_shared_pool = None
+_shared_pool_lock = threading.Lock()
+
+
+def get_pool(max_size=None, **kwargs):
+    """
+    Process-wide pool, created on first use with `kwargs` and closed at
+    exit. Passing max_size resizes it, so a changed scan_concurrency
+    applies from the next scan on.
+    """
+    global _shared_pool
+    with _shared_pool_lock:
+        if _shared_pool is None:
+            _shared_pool = BrowserPool(**kwargs, **({'max_size': max_size} if max_size else {}))
+            atexit.register(_shared_pool.close)
+        elif max_size and max_size != _shared_pool.max_size:
+            _shared_pool.resize(max_size)
+        return _shared_pool
@@ -0,0 +1,111 @@
+"""
+Caching of finished scans.
+
+A COMPLETED job only changes when past jobs are re-ranked, which bumps
+GlobalSettings.ranking_version. So whatever a page derives from such a
+job is cached under the job id and that version, and the same pair makes
+its ETag: a repeat view is served from the cache with no SQL, or answered
+with 304 Not Modified. Re-ranking (including after a threshold change)
+bumps the version and clears the cached settings, which invalidates
+everything at once; jobs that aren't finished are never cached.
+
+Uses the default cache, which must be shared (file, memcached, redis) so
+that re-ranking from another process, e.g. the rerank_jobs command,
+reaches the web server immediately; the analyzer.W001 check warns when
+it is local memory.
+"""
+import hashlib
+
+from django.core.cache import cache
+
+from .models import GlobalSettings, ScanJob
+
+FINISHED_JOB_KEY = 'analyzer:finished-job:{}'
+LATEST_JOB_KEY = 'analyzer:latest-job'
+CONTEXT_KEY = 'analyzer:context:{}:{}:{}'
+CACHE_TIMEOUT = 24 * 3600
+
+NO_JOB = 0 # Cached "no completed job yet"
+
+
+def settings_version():
+    return GlobalSettings.get_setting().ranking_version
+
+
+def completed_job(job_id):
+    """
+    The job if it has COMPLETED, else None. Completed jobs are cached.
+    """
+    key = FINISHED_JOB_KEY.format(job_id)
+    job = cache.get(key)
+    if job is None:
+        job = ScanJob.objects.filter(id=job_id, status='COMPLETED').first()
+        if job is not None:
+            cache.set(key, job, CACHE_TIMEOUT)
+    return job
+
+
+def latest_completed_job():
+    """
+    The most recently completed job, or None. Cached until a job finishes.
+    """
+    job_id = cache.get(LATEST_JOB_KEY)
+    if job_id is None:
+        job = ScanJob.objects.filter(status='COMPLETED').order_by('-completed_at').first()
+        cache.set(LATEST_JOB_KEY, job.id if job else NO_JOB, CACHE_TIMEOUT)
+        if job:
+            cache.set(FINISHED_JOB_KEY.format(job.id), job, CACHE_TIMEOUT)
+        return job
+    return completed_job(job_id) if job_id != NO_JOB else None
+
+
+def job_finished(job_id):
+    """
+    Forget what changes when a job reaches a terminal state.
+    """
+    cache.delete_many([LATEST_JOB_KEY, FINISHED_JOB_KEY.format(job_id)])
+
+
+def job_context(name, job, build):
+    """
+    build()'s result for a view of `job`, cached per job and settings
+    version once the job has completed. It must be picklable: lists and
+    model instances, not querysets.
+    """
+    if job is None or job.status != 'COMPLETED':
+        return build()
+    key = CONTEXT_KEY.format(name, job.id, settings_version())
+    context = cache.get(key)
+    if context is None:
+        context = build()
+        cache.set(key, context, CACHE_TIMEOUT)
+    return context
+
+
+def job_etag(name, job_id):
+    """
+    ETag of a view of a completed job (None while it isn't completed).
+    """
+    if completed_job(job_id) is None:
+        return None
+    return f'"{name}-{job_id}-{settings_version()}"'
+
+
+def query_variant(request):
+    """
+    Short digest of a request's query string, for views whose ETag and
+    cached context depend on their parameters.
+    """
+    return hashlib.md5(request.GET.urlencode().encode()).hexdigest()[:12]
+
+
+def job_last_modified(job_id):
+    """
+    When a view of a completed job last changed: its completion or the
+    last re-rank, whichever is later.
+    """
+    job = completed_job(job_id)
+    if job is None or job.completed_at is None:
+        return None
+    ranked_at = GlobalSettings.get_setting().ranked_at
+    return max(job.completed_at, ranked_at) if ranked_at else job.completed_at
@@ -0,0 +1,278 @@
+"""
+Django-free helpers for talking to Chartink.
+
+Shared by the web scanner (analyzer.services) and the standalone CLI
+(chartink_analyzer.py), so the Selenium capture and the /screener/process
+request live in one place.
+"""
+import functools
+import hashlib
+import json
+import re
+import time
+import urllib.parse
+
+from bs4 import BeautifulSoup
+
+# Selenium Imports
+from selenium import webdriver
+from selenium.webdriver.chrome.service import Service
+from selenium.webdriver.chrome.options import Options
+from webdriver_manager.chrome import ChromeDriverManager
+from selenium.webdriver.common.by import By
+
+USER_AGENT = 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
+PROCESS_URL = 'https://chartink.com/screener/process'
+
+DEFAULT_HEADERS = {
+    'User-Agent': USER_AGENT,
+    'X-Requested-With': 'XMLHttpRequest',
+}
+
+# Records the body of the page's own /screener/process XHR in a window global
+INTERCEPTOR_SCRIPT = """
+window._captured_scan_clause = null;
+const oldOpen = XMLHttpRequest.prototype.open;
+const oldSend = XMLHttpRequest.prototype.send;
+
+XMLHttpRequest.prototype.open = function(method, url) {
+    this._method = method;
+    this._url = url;
+    return oldOpen.apply(this, arguments);
+};
+
+XMLHttpRequest.prototype.send = function(body) {
+    if (this._method === 'POST' && this._url.includes('/screener/process')) {
+        window._captured_scan_clause = body;
+    }
+    return oldSend.apply(this, arguments);
+};
+"""
+
+RUN_BUTTON_XPATHS = [
+    "//button[contains(text(), 'Run Scan')]",
+    "//input[@value='Run Scan']",
+    "//button[contains(@class, 'btn-primary')]",
+    "//button[contains(., 'Run Scan')]",
+]
+
+# Inline-script forms of the clause: JS assignment (scan_clause = "...";) and JSON ("scan_clause": "...")
+SCAN_CLAUSE_PATTERNS = [
+    re.compile(r'scan_clause\s*=\s*"(.*?)(?<!\\)";', re.DOTALL),
+    re.compile(r"scan_clause\s*=\s*'(.*?)(?<!\\)';", re.DOTALL),
+    re.compile(r'["\']scan_clause["\']\s*:\s*"(.*?)(?<!\\)"', re.DOTALL),
+]
+
+
+def _noop(message):
+    pass
+
+
+@functools.lru_cache(maxsize=None)
+def resolve_driver_path():
+    """
+    Resolve (and download if needed) the chromedriver binary once per process.
+    """
+    return ChromeDriverManager().install()
+
+
+def create_driver():
+    """
+    Start a headless Chrome with the interceptor script installed.
+    """
+    chrome_options = Options()
+    chrome_options.add_argument("--headless=new")
+    chrome_options.add_argument("--no-sandbox")
+    chrome_options.add_argument("--disable-dev-shm-usage")
+    chrome_options.add_argument("--page-load-strategy=eager") # Don't wait for full load (images/css)
+    chrome_options.add_argument(f"user-agent={USER_AGENT}")
+
+    driver = webdriver.Chrome(service=Service(resolve_driver_path()), options=chrome_options)
+    driver.set_page_load_timeout(60)
+
+    # Enable interception BEFORE navigation using CDP
+    driver.execute_cdp_cmd('Page.addScriptToEvaluateOnNewDocument', {
+        'source': INTERCEPTOR_SCRIPT
+    })
+    return driver
+
+
+def _wait_for_clause(driver, attempts=10):
+    for i in range(attempts):
+        try:
+            scan_clause_raw = driver.execute_script("return window._captured_scan_clause;")
+            if scan_clause_raw:
+                return scan_clause_raw
+        except:
+            pass
+        time.sleep(0.5)
+    return None
+
+
+def capture_scan_clause(driver, url, log=_noop):
+    """
+    Load a screener page in the browser and intercept its scan_clause.
+    Returns (scan_clause_raw, csrf_token); either may be None.
+    """
+    driver.get(url)
+
+    # Wait for capture (Auto-run)
+    scan_clause_raw = _wait_for_clause(driver)
+    if scan_clause_raw:
+        log("  [.] Captured scan_clause from auto-run.")
+
+    # Fallback: Find and Click 'Run Scan'
+    if not scan_clause_raw:
+        log("  [.] Auto-run not detected, attempting to click 'Run Scan'...")
+        try:
+            run_button = None
+            for xpath in RUN_BUTTON_XPATHS:
+                try:
+                    element = driver.find_element(By.XPATH, xpath)
+                    if element.is_displayed():
+                        run_button = element
+                        break
+                except:
+                    continue
+
+            if run_button:
+                driver.execute_script("arguments[0].scrollIntoView(true);", run_button)
+                time.sleep(0.5)
+                try:
+                    run_button.click()
+                except:
+                    driver.execute_script("arguments[0].click();", run_button)
+                log("  [.] Clicked 'Run Scan' button.")
+
+                scan_clause_raw = _wait_for_clause(driver)
+                if scan_clause_raw:
+                    log("  [.] Captured scan_clause after click.")
+            else:
+                log("  [!] Could not locate 'Run Scan' button.")
+        except Exception as e:
+            log(f"  [!] Error interacting with page: {e}")
+
+    # Get CSRF Token
+    csrf_token = None
+    try:
+        csrf_element = driver.find_element(By.CSS_SELECTOR, "meta[name='csrf-token']")
+        csrf_token = csrf_element.get_attribute("content")
+    except:
+        log("  [!] CSRF token not found.")
+
+    return scan_clause_raw, csrf_token
+
+
+def copy_driver_cookies(driver, session):
+    """
+    Copy the browser's cookies into a requests session so the POST
+    is made with the same Chartink session as the CSRF token.
+    """
+    for cookie in driver.get_cookies():
+        session.cookies.set(cookie['name'], cookie['value'])
+
+
+def decode_scan_clause(scan_clause_raw):
+    """
+    Turn the intercepted XHR body into the bare scan_clause string.
+    """
+    decoded = urllib.parse.unquote(scan_clause_raw)
+
+    # Try parsing as JSON first
+    try:
+        json_data = json.loads(decoded)
+        if isinstance(json_data, dict) and 'scan_clause' in json_data:
+            return json_data['scan_clause']
+    except json.JSONDecodeError:
+        pass
+
+    # Fallback to string manipulation if not JSON or parsing failed
+    if decoded.startswith('scan_clause='):
+        return decoded.replace('scan_clause=', '', 1)
+    return decoded
+
+
+def clause_hash(scan_clause):
+    return hashlib.sha256(scan_clause.encode('utf-8')).hexdigest()
+
+
+def _get_page(session, url, headers):
+    get_headers = {'User-Agent': headers.get('User-Agent', USER_AGENT), 'Referer': url}
+    r = session.get(url, headers=get_headers, timeout=30)
+    r.raise_for_status()
+    return BeautifulSoup(r.content, 'html.parser')
+
+
+def _csrf_from_soup(soup):
+    meta = soup.find('meta', {'name': 'csrf-token'})
+    return meta.get('content') if meta else None
+
+
+def extract_scan_clause(soup):
+    """
+    Pull the scan_clause out of a parsed screener page without running it:
+    a scan_clause form field or an inline <script> assignment/JSON value.
+    """
+    field = soup.find(['textarea', 'input'], {'name': 'scan_clause'})
+    if field:
+        value = field.get('value') if field.name == 'input' else field.get_text()
+        if value and value.strip():
+            return value.strip()
+
+    for script in soup.find_all('script'):
+        text = script.string
+        if not text or 'scan_clause' not in text:
+            continue
+        for pattern in SCAN_CLAUSE_PATTERNS:
+            match = pattern.search(text)
+            if match and match.group(1).strip():
+                try:
+                    # Undo JS/JSON string escaping (\", \n, \u003e ...)
+                    return json.loads('"' + match.group(1).replace("\\'", "'") + '"')
+                except json.JSONDecodeError:
+                    return match.group(1)
+    return None
+
+
+def fetch_scan_clause(session, url, headers=DEFAULT_HEADERS):
+    """
+    Browserless extraction: plain GET of the screener page.
+    Returns (scan_clause, csrf_token); scan_clause is None when the page
+    only builds it in JavaScript. The session keeps the token's cookies.
+    """
+    soup = _get_page(session, url, headers)
+    return extract_scan_clause(soup), _csrf_from_soup(soup)
+
+
+def fetch_csrf_token(session, url, headers=DEFAULT_HEADERS):
+    """
+    Plain GET of a Chartink page; returns the csrf-token meta value.
+    The session keeps the cookies the token is bound to.
+    """
+    csrf_token = _csrf_from_soup(_get_page(session, url, headers))
+    if not csrf_token:
+        raise ValueError("CSRF token not found in page.")
+    return csrf_token
+
+
+def post_scan_clause(session, scan_clause, csrf_token, headers=DEFAULT_HEADERS):
+    """
+    Run a scan_clause against /screener/process and return the stock rows.
+    Raises if the request fails or Chartink rejects the clause.
+    """
+    payload = {'scan_clause': scan_clause}
+    post_headers = dict(headers)
+    post_headers.update({'X-Csrf-Token': csrf_token})
+
+    r = session.post(PROCESS_URL, data=payload, headers=post_headers, timeout=60)
+    r.raise_for_status()
+    return parse_process_response(r.json())
+
+
+def parse_process_response(data):
+    """
+    Stock rows from a decoded /screener/process response.
+    """
+    if 'data' not in data or data.get('scan_error'):
+        raise ValueError(f"Chartink rejected scan_clause: {data.get('scan_error', 'no data in response')}")
+    return data['data']
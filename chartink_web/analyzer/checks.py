@@ -0,0 +1,31 @@
+"""
+System checks for settings the scan workers depend on.
+"""
+from django.conf import settings
+from django.core.checks import Warning, register
+
+# Backends whose entries live in one process only
+PROCESS_LOCAL_CACHES = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+@register()
+def check_shared_cache(app_configs, **kwargs):
+    """
+    Cached settings, finished-scan pages and live job state are written by
+    run_worker processes and read by the web server, so the caches that
+    hold them must be shared between processes.
+    """
+    aliases = {'default', getattr(settings, 'ANALYZER_JOB_STATE_CACHE', None)} - {None}
+    return [
+        Warning(
+            f"The '{alias}' cache ({settings.CACHES[alias]['BACKEND']}) is not shared between processes.",
+            hint="Scans finished, re-ranks and settings saved by a worker or command won't reach the web server "
+                 "until its entries expire. Use a shared backend such as the file, memcached or redis cache.",
+            id='analyzer.W001',
+        )
+        for alias in sorted(aliases)
+        if alias in settings.CACHES and settings.CACHES[alias]['BACKEND'] in PROCESS_LOCAL_CACHES
+    ]
@@ -0,0 +1,152 @@
+"""
+Differences between two scan jobs.
+
+diff_jobs() classifies every symbol of either job as added, dropped or
+retained, with screener-count and conviction-score deltas, in a single
+GROUP BY over the two jobs' JobSymbolSummary rows. Finished jobs don't
+change except through re-ranking, so diffs of finished jobs are memoized
+in the Django cache under the current GlobalSettings.ranking_version.
+jobs_to_compare() picks the two jobs from a view's query parameters.
+"""
+from datetime import timedelta
+
+from django.core.cache import cache
+from django.db.models import Count, Max, Q
+from django.utils import timezone
+
+from .models import GlobalSettings, JobSymbolSummary, ScanJob
+
+CACHE_KEY = 'analyzer:diff:{}:{}:{}'
+CACHE_TIMEOUT = 24 * 3600
+
+FINISHED_STATUSES = ('COMPLETED', 'FAILED')
+
+
+def comparison_job(job, days):
+    """
+    Latest completed job that finished at least `days` days before `job`.
+    """
+    cutoff = (job.completed_at or job.started_at or timezone.now()) - timedelta(days=days)
+    return ScanJob.objects.filter(status='COMPLETED', completed_at__lte=cutoff).order_by('-completed_at').first()
+
+
+def _job(job_id):
+    return ScanJob.objects.filter(id=int(job_id)).first() if job_id.isdigit() else None
+
+
+def jobs_to_compare(params):
+    """
+    (new_job, old_job, error) from the query parameters new=<id>&old=<id>,
+    or days=<n> for the latest completed job at least n days before the
+    new one. The new job defaults to the latest completed job, days to 6.
+    error is a message for the user when either job can't be found.
+    """
+    new_id = params.get('new')
+    if new_id:
+        new_job = _job(new_id)
+        if not new_job:
+            return None, None, f"No scan job with id '{new_id}'."
+    else:
+        new_job = ScanJob.objects.filter(status='COMPLETED').order_by('-completed_at').first()
+        if not new_job:
+            return None, None, 'No completed scans found. Please run a scan first.'
+
+    old_id = params.get('old')
+    if old_id:
+        old_job = _job(old_id)
+        if not old_job:
+            return new_job, None, f"No scan job with id '{old_id}'."
+        return new_job, old_job, None
+    try:
+        days = int(params.get('days') or 6)
+    except ValueError:
+        days = 6
+    old_job = comparison_job(new_job, days)
+    if not old_job:
+        return new_job, None, f'No scan from {days}+ days before this one found.'
+    return new_job, old_job, None
+
+
+def _per_job(field, job_id):
+    return Max(field, filter=Q(job_id=job_id))
+
+
+def _compute_diff(new_job_id, old_job_id):
+    rows = JobSymbolSummary.objects.filter(job_id__in=[new_job_id, old_job_id]).values('symbol').annotate(
+        in_new=Count('id', filter=Q(job_id=new_job_id)),
+        in_old=Count('id', filter=Q(job_id=old_job_id)),
+        symbol_name=Max('name'),
+        symbol_nse_code=Max('nse_code'),
+        symbol_bse_code=Max('bse_code'),
+        new_count=_per_job('screener_count', new_job_id),
+        old_count=_per_job('screener_count', old_job_id),
+        new_score=_per_job('conviction_score', new_job_id),
+        old_score=_per_job('conviction_score', old_job_id),
+        new_rank=_per_job('rank', new_job_id),
+        old_rank=_per_job('rank', old_job_id),
+        new_close_price=_per_job('close_price', new_job_id),
+        new_volume=_per_job('volume', new_job_id),
+        new_high_conviction=_per_job('is_high_conviction', new_job_id),
+        new_streak=_per_job('streak', new_job_id),
+        new_longest_streak=_per_job('longest_streak', new_job_id),
+        new_first_seen_at=_per_job('first_seen_at', new_job_id),
+    ).order_by()
+
+    added, dropped, retained = [], [], []
+    for row in rows:
+        entry = {
+            'symbol': row['symbol'],
+            'name': row['symbol_name'],
+            'nse_code': row['symbol_nse_code'],
+            'bse_code': row['symbol_bse_code'],
+            'new_count': row['new_count'] or 0,
+            'old_count': row['old_count'] or 0,
+            'count_delta': (row['new_count'] or 0) - (row['old_count'] or 0),
+            'new_score': row['new_score'] or 0.0,
+            'old_score': row['old_score'] or 0.0,
+            'score_delta': (row['new_score'] or 0.0) - (row['old_score'] or 0.0),
+            'new_rank': row['new_rank'],
+            'old_rank': row['old_rank'],
+            'close_price': row['new_close_price'],
+            'volume': row['new_volume'],
+            'is_high_conviction': bool(row['new_high_conviction']),
+            'streak': row['new_streak'] or 0,
+            'longest_streak': row['new_longest_streak'] or 0,
+            'first_seen_at': row['new_first_seen_at'],
+        }
+        if row['in_new'] and row['in_old']:
+            retained.append(entry)
+        elif row['in_new']:
+            added.append(entry)
+        else:
+            dropped.append(entry)
+
+    added.sort(key=lambda entry: (entry['new_rank'], entry['symbol']))
+    dropped.sort(key=lambda entry: (entry['old_rank'], entry['symbol']))
+    retained.sort(key=lambda entry: (-entry['score_delta'], entry['new_rank'], entry['symbol']))
+    return {
+        'new_job_id': new_job_id,
+        'old_job_id': old_job_id,
+        'added': added,
+        'dropped': dropped,
+        'retained': retained,
+        'new_total': len(added) + len(retained),
+        'old_total': len(dropped) + len(retained),
+    }
+
+
+def diff_jobs(new_job, old_job):
+    """
+    Symbols added in `new_job`, dropped since `old_job` and retained by
+    both, each with name, screener counts, scores, ranks and deltas.
+    """
+    if new_job.status not in FINISHED_STATUSES or old_job.status not in FINISHED_STATUSES:
+        return _compute_diff(new_job.id, old_job.id) # Still being written
+
+    version = GlobalSettings.get_setting().ranking_version
+    key = CACHE_KEY.format(new_job.id, old_job.id, version)
+    diff = cache.get(key)
+    if diff is None:
+        diff = _compute_diff(new_job.id, old_job.id)
+        cache.set(key, diff, CACHE_TIMEOUT)
+    return diff
@@ -0,0 +1,213 @@
+"""
+Exports of a job's symbol summary, generated on demand from the database.
+
+Rows are read with iterator() and encoded one chunk at a time, so a
+response streams in constant memory however large the job is:
+
+    csv      - the same columns and headers as the scan_reports/ files
+    ndjson   - one JSON object per line, keyed by column name
+    parquet  - row groups of EXPORT_CHUNK_SIZE rows (needs pyarrow)
+
+Any format can be gzipped on the fly. Columns are chosen by key from
+EXPORT_COLUMNS.
+"""
+import csv
+import json
+import zlib
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .models import JobSymbolSummary
+
+# key: (JobSymbolSummary field, CSV header)
+EXPORT_COLUMNS = {
+    'symbol': ('symbol', 'Symbol'),
+    'name': ('name', 'Name'),
+    'nse_code': ('nse_code', 'NSE Code'),
+    'bse_code': ('bse_code', 'BSE Code'),
+    'close_price': ('close_price', 'Close Price'),
+    'volume': ('volume', 'Volume'),
+    'screener_count': ('screener_count', 'Screener Count'),
+    'conviction_score': ('conviction_score', 'Conviction Score'),
+    'is_high_conviction': ('is_high_conviction', 'High Conviction'),
+    'streak': ('streak', 'Streak'),
+    'longest_streak': ('longest_streak', 'Longest Streak'),
+    'first_seen_at': ('first_seen_at', 'First Seen'),
+    'rank': ('rank', 'Rank'),
+}
+
+# What the scan_reports/ CSV files have always held; the other columns are asked for with ?columns=
+DEFAULT_COLUMNS = ['symbol', 'name', 'nse_code', 'bse_code', 'close_price', 'volume', 'screener_count', 'is_high_conviction']
+
+EXPORT_FORMATS = {
+    'csv': ('text/csv', 'csv'),
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+}
+
+EXPORT_CHUNK_SIZE = 2000
+
+
+class ExportUnavailable(Exception):
+    """
+    The requested format needs an optional dependency that isn't installed.
+    """
+
+
+def parse_columns(value):
+    """
+    Column keys from a comma-separated ?columns= value (all default
+    columns when empty). Raises ValueError on unknown keys.
+    """
+    if not value:
+        return list(DEFAULT_COLUMNS)
+    columns = [column.strip() for column in value.split(',') if column.strip()]
+    unknown = [column for column in columns if column not in EXPORT_COLUMNS]
+    if unknown:
+        raise ValueError(f"Unknown columns: {', '.join(unknown)}. Choose from: {', '.join(EXPORT_COLUMNS)}.")
+    return columns
+
+
+def summary_rows(job_id, columns):
+    """
+    Tuples of the chosen columns for every symbol of a job, in rank order.
+    """
+    fields = [EXPORT_COLUMNS[column][0] for column in columns]
+    return JobSymbolSummary.objects.filter(job_id=job_id).order_by('rank', 'symbol').values_list(*fields).iterator(
+        chunk_size=EXPORT_CHUNK_SIZE,
+    )
+
+
+def csv_values(columns, row):
+    """
+    A summary row formatted like the scan_reports/ files.
+    """
+    values = []
+    for column, value in zip(columns, row):
+        if column == 'is_high_conviction':
+            value = 'Yes' if value else 'No'
+        elif column == 'conviction_score':
+            value = round(value, 4)
+        elif column == 'first_seen_at':
+            value = value.strftime('%Y-%m-%d %H:%M') if value else ''
+        elif value is None:
+            value = ''
+        values.append(value)
+    return values
+
+
+class _Echo:
+    # csv.writer target that hands back each encoded line
+    def write(self, value):
+        return value
+
+
+def _csv_chunks(job_id, columns):
+    writer = csv.writer(_Echo())
+    yield writer.writerow([EXPORT_COLUMNS[column][1] for column in columns]).encode()
+    lines = []
+    for row in summary_rows(job_id, columns):
+        lines.append(writer.writerow(csv_values(columns, row)))
+        if len(lines) >= EXPORT_CHUNK_SIZE:
+            yield ''.join(lines).encode()
+            lines = []
+    if lines:
+        yield ''.join(lines).encode()
+
+
+def _ndjson_chunks(job_id, columns):
+    lines = []
+    for row in summary_rows(job_id, columns):
+        lines.append(json.dumps(dict(zip(columns, row)), cls=DjangoJSONEncoder) + '\n')
+        if len(lines) >= EXPORT_CHUNK_SIZE:
+            yield ''.join(lines).encode()
+            lines = []
+    if lines:
+        yield ''.join(lines).encode()
+
+
+class _ChunkSink:
+    # Write-only file for pyarrow that keeps what was written until taken
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def take(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def _parquet_chunks(job_id, columns):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    field_types = {
+        'symbol': pa.string(), 'name': pa.string(), 'nse_code': pa.string(), 'bse_code': pa.string(),
+        'close_price': pa.float64(), 'volume': pa.int64(), 'screener_count': pa.int32(),
+        'conviction_score': pa.float64(), 'is_high_conviction': pa.bool_(), 'streak': pa.int32(),
+        'longest_streak': pa.int32(), 'first_seen_at': pa.timestamp('us', tz='UTC'), 'rank': pa.int32(),
+    }
+    schema = pa.schema([(column, field_types[column]) for column in columns])
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(pa.PythonFile(sink, mode='w'), schema)
+
+    def row_group(rows):
+        writer.write_table(pa.Table.from_pylist([dict(zip(columns, row)) for row in rows], schema=schema))
+        return sink.take()
+
+    rows = []
+    for row in summary_rows(job_id, columns):
+        rows.append(row)
+        if len(rows) >= EXPORT_CHUNK_SIZE:
+            yield row_group(rows)
+            rows = []
+    if rows:
+        yield row_group(rows)
+    writer.close()
+    yield sink.take() # Footer
+
+
+def _gzipped(chunks):
+    compressor = zlib.compressobj(wbits=31) # 31: gzip container
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def export_chunks(job_id, export_format='csv', columns=None, gzip=False):
+    """
+    Byte chunks of a job's export. Raises ValueError for an unknown format
+    and ExportUnavailable when Parquet is asked for without pyarrow.
+    """
+    columns = columns or list(DEFAULT_COLUMNS)
+    if export_format == 'csv':
+        chunks = _csv_chunks(job_id, columns)
+    elif export_format == 'ndjson':
+        chunks = _ndjson_chunks(job_id, columns)
+    elif export_format == 'parquet':
+        try:
+            import pyarrow.parquet # noqa: F401
+        except ImportError:
+            raise ExportUnavailable("Parquet export needs pyarrow (pip install pyarrow).")
+        chunks = _parquet_chunks(job_id, columns)
+    else:
+        raise ValueError(f"Unknown format '{export_format}'. Choose from: {', '.join(EXPORT_FORMATS)}.")
+    return _gzipped(chunks) if gzip else chunks
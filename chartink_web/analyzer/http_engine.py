@@ -0,0 +1,76 @@
+"""
+Asyncio engine for /screener/process requests.
+
+Issues every known-clause POST concurrently over one keep-alive
+connection pool, capped at `max_in_flight` requests. Responses are
+decoded transparently (gzip/deflate, and brotli when the `brotli`
+package is installed). `run()` is a synchronous wrapper for thread-based
+callers such as the scanner started by the `start_scan` view.
+Django-free so the CLI can use it as well.
+"""
+import asyncio
+from collections import namedtuple
+
+import aiohttp
+
+from .chartink_client import DEFAULT_HEADERS, PROCESS_URL, parse_process_response
+
+try:
+    import brotli # noqa: F401 -- aiohttp decodes br responses when this is importable
+    ACCEPT_ENCODING = 'gzip, deflate, br'
+except ImportError:
+    ACCEPT_ENCODING = 'gzip, deflate'
+
+# key identifies the request in the results (e.g. a screener id or URL);
+# cookies must be the ones the csrf_token was issued with.
+ProcessRequest = namedtuple('ProcessRequest', ['key', 'scan_clause', 'csrf_token', 'cookies'])
+
+
+class AsyncScanEngine:
+    def __init__(self, max_in_flight=8, timeout=60, headers=DEFAULT_HEADERS, url=PROCESS_URL):
+        self.url = url
+        self.max_in_flight = max(1, max_in_flight)
+        self.timeout = timeout
+        self.headers = dict(headers)
+        self.headers['Accept-Encoding'] = ACCEPT_ENCODING
+
+    async def fetch_all(self, requests):
+        """
+        POST all requests concurrently. Returns {key: stocks or Exception};
+        one failing request never affects the others.
+        """
+        connector = aiohttp.TCPConnector(limit=self.max_in_flight, keepalive_timeout=30)
+        async with aiohttp.ClientSession(
+            connector=connector,
+            headers=self.headers,
+            timeout=aiohttp.ClientTimeout(total=self.timeout),
+            # Only the per-request cookies are sent; screeners captured in
+            # different browser sessions must not share a jar.
+            cookie_jar=aiohttp.DummyCookieJar(),
+        ) as session:
+            semaphore = asyncio.Semaphore(self.max_in_flight)
+            results = await asyncio.gather(
+                *(self._fetch(session, semaphore, request) for request in requests),
+                return_exceptions=True,
+            )
+        return {request.key: result for request, result in zip(requests, results)}
+
+    async def _fetch(self, session, semaphore, request):
+        async with semaphore:
+            async with session.post(
+                self.url,
+                data={'scan_clause': request.scan_clause},
+                headers={'X-Csrf-Token': request.csrf_token},
+                cookies=request.cookies,
+            ) as r:
+                r.raise_for_status()
+                data = await r.json(content_type=None)
+        return parse_process_response(data)
+
+    def run(self, requests):
+        """
+        Synchronous wrapper around fetch_all() for callers without an event loop.
+        """
+        if not requests:
+            return {}
+        return asyncio.run(self.fetch_all(list(requests)))
@@ -0,0 +1,41 @@
+"""
+Symbol -> Instrument lookups for scan ingestion.
+
+Every result row references an Instrument, so ingestion keeps the ones it
+has seen in memory and only goes to the database for symbols it has not
+met yet: one query to find them and one batched INSERT for new ones per
+screener, instead of a query per row.
+"""
+from .models import Instrument
+
+# Rows per INSERT; keeps well under SQLite's 32766 bound-parameter limit
+INSTRUMENT_BATCH_SIZE = 500
+
+
+class InstrumentCache:
+    def __init__(self):
+        self._by_symbol = {}
+
+    def resolve(self, listings):
+        """
+        {symbol: Instrument} for `listings`, a {symbol: (name, nse_code,
+        bse_code)} dict, creating the instruments that don't exist yet.
+        """
+        missing = [symbol for symbol in listings if symbol not in self._by_symbol]
+        if missing:
+            self._load(missing)
+            new = [symbol for symbol in missing if symbol not in self._by_symbol]
+            if new:
+                # ignore_conflicts: another scan may insert the same symbol meanwhile
+                Instrument.objects.bulk_create([
+                    Instrument(symbol=symbol, name=listings[symbol][0] or '', nse_code=listings[symbol][1], bse_code=listings[symbol][2])
+                    for symbol in new
+                ], batch_size=INSTRUMENT_BATCH_SIZE, ignore_conflicts=True)
+                self._load(new)
+        return {symbol: self._by_symbol[symbol] for symbol in listings}
+
+    def _load(self, symbols):
+        for start in range(0, len(symbols), INSTRUMENT_BATCH_SIZE):
+            chunk = symbols[start:start + INSTRUMENT_BATCH_SIZE]
+            for instrument in Instrument.objects.filter(symbol__in=chunk):
+                self._by_symbol[instrument.symbol] = instrument
@@ -0,0 +1,469 @@
+"""
+Durable queue of scan jobs, kept in the database.
+
+The web tier only enqueues: enqueue_scan() creates a PENDING job, or
+returns the one already pending or running, since every scan covers the
+same screeners (the unique_active_scan_job constraint settles two
+requests racing). Worker processes started with the run_worker command,
+on one machine or several sharing the database, then take a job through
+three steps:
+
+    plan      one worker claims the PENDING job and splits it into one
+              ScanTask per active screener; the job stays RUNNING
+    scan      any worker leases a batch of PENDING tasks of a job and
+              scans those screeners; each task's rows and its DONE mark
+              are written in one transaction
+    finalize  once none of the job's tasks is pending or running, one
+              worker claims the job again and ranks, summarizes and
+              exports it, exactly as a single-process scan ends
+
+Every claim is a compare-and-set UPDATE on the rows involved, so two
+workers never hold the same task or job, and no broker is needed; SQLite
+and Postgres behave the same. Claims are leases renewed by heartbeats.
+When a worker dies its leases run out and the next worker to poll puts
+the work back: a task to PENDING (its rows are redone), a half-planned
+job to PENDING, a half-finalized job up for finalizing again. Work is
+given up after MAX_ATTEMPTS claims.
+"""
+import os
+import socket
+import threading
+import time
+import traceback
+from contextlib import contextmanager, suppress
+from datetime import timedelta
+
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Exists, F, OuterRef, Q
+from django.utils import timezone
+
+from .browser_pool import get_pool
+from .job_state import discard_job_state
+from .models import (
+    SCAN_DEDUP_KEY, GlobalSettings, JobSymbolSummary, ScanJob, ScanReport, ScanTask, Screener, ScreenerBitmap, StockResult,
+)
+from .rerank import claim_rerank, request_rerank, rerank_jobs
+from .services import ChartinkScanner
+
+LEASE_SECONDS = 60
+HEARTBEAT_INTERVAL = 15
+POLL_INTERVAL = 2.0
+MAX_ATTEMPTS = 3
+
+ACTIVE_STATUSES = ('PENDING', 'RUNNING')
+FINISHED_TASK_STATUSES = ('DONE', 'FAILED')
+
+
+class LeaseLost(Exception):
+    """
+    The worker's lease ran out and the work was handed to another worker.
+    """
+
+
+def enqueue_scan(dedup_key=SCAN_DEDUP_KEY):
+    """
+    (job, created): a new PENDING job, or the job with the same key that
+    is already pending or running.
+    """
+    while True:
+        existing = ScanJob.objects.filter(dedup_key=dedup_key, status__in=ACTIVE_STATUSES).first()
+        if existing:
+            return existing, False
+        try:
+            with transaction.atomic():
+                return ScanJob.objects.create(dedup_key=dedup_key), True
+        except IntegrityError:
+            continue # Another request enqueued one first
+
+
+def worker_name(slot=0):
+    return f'{socket.gethostname()}:{os.getpid()}:{slot}'
+
+
+def _lease(worker, lease_seconds):
+    now = timezone.now()
+    return {'worker': worker, 'heartbeat_at': now, 'lease_expires_at': now + timedelta(seconds=lease_seconds)}
+
+
+def claim_job(worker, lease_seconds=LEASE_SECONDS):
+    """
+    Lease the oldest PENDING job to `worker` for planning. Returns the
+    job, or None if nothing is pending.
+    """
+    while True:
+        job_id = ScanJob.objects.filter(status='PENDING').order_by('id').values_list('id', flat=True).first()
+        if job_id is None:
+            return None
+        claimed = ScanJob.objects.filter(id=job_id, status='PENDING').update(
+            status='RUNNING', attempts=F('attempts') + 1, **_lease(worker, lease_seconds),
+        )
+        if claimed:
+            return ScanJob.objects.get(id=job_id)
+        # Another worker got there first; try the next one
+
+
+def claim_tasks(worker, limit=1, lease_seconds=LEASE_SECONDS):
+    """
+    Lease up to `limit` of the oldest PENDING tasks, all of one job, to
+    `worker`. Returns them with their screeners, or [] if none is pending.
+    """
+    while True:
+        job_id = ScanTask.objects.filter(status='PENDING').order_by('id').values_list('job_id', flat=True).first()
+        if job_id is None:
+            return []
+        task_ids = list(ScanTask.objects.filter(job_id=job_id, status='PENDING').order_by('id').values_list('id', flat=True)[:limit])
+        ScanTask.objects.filter(id__in=task_ids, status='PENDING').update(
+            status='RUNNING', attempts=F('attempts') + 1, **_lease(worker, lease_seconds),
+        )
+        # Whatever another worker took in between is no longer ours
+        tasks = list(ScanTask.objects.filter(id__in=task_ids, status='RUNNING', worker=worker).select_related('screener').order_by('id'))
+        if tasks:
+            return tasks
+
+
+def _finalizable_jobs():
+    # RUNNING jobs that have tasks, none of them unfinished, and nobody finalizing them
+    return ScanJob.objects.filter(
+        Exists(ScanTask.objects.filter(job=OuterRef('pk'))), status='RUNNING', lease_expires_at__isnull=True,
+    ).exclude(Exists(ScanTask.objects.filter(job=OuterRef('pk'), status__in=ACTIVE_STATUSES)))
+
+
+def claim_finalization(worker, lease_seconds=LEASE_SECONDS):
+    """
+    Lease the finalizing of a job whose tasks have all finished. Returns
+    the job, or None if no job is ready.
+    """
+    while True:
+        job_id = _finalizable_jobs().order_by('id').values_list('id', flat=True).first()
+        if job_id is None:
+            return None
+        claimed = _finalizable_jobs().filter(id=job_id).update(
+            finalize_attempts=F('finalize_attempts') + 1, **_lease(worker, lease_seconds),
+        )
+        if claimed:
+            return ScanJob.objects.get(id=job_id)
+
+
+def heartbeat(job_id, worker, lease_seconds=LEASE_SECONDS):
+    """
+    Extend `worker`'s lease on a job it is planning or finalizing.
+    Returns False if the lease was lost.
+    """
+    now = timezone.now()
+    # A lease requeue_orphans() cleared is up for grabs, not to be renewed
+    return bool(ScanJob.objects.filter(id=job_id, status='RUNNING', worker=worker, lease_expires_at__isnull=False).update(
+        heartbeat_at=now, lease_expires_at=now + timedelta(seconds=lease_seconds),
+    ))
+
+
+def heartbeat_tasks(task_ids, worker, lease_seconds=LEASE_SECONDS):
+    """
+    Extend `worker`'s leases on running tasks. Returns how many it still holds.
+    """
+    now = timezone.now()
+    return ScanTask.objects.filter(id__in=task_ids, status='RUNNING', worker=worker).update(
+        heartbeat_at=now, lease_expires_at=now + timedelta(seconds=lease_seconds),
+    )
+
+
+def requeue_orphans(max_attempts=MAX_ATTEMPTS):
+    """
+    Put back work whose lease has expired:
+      - running tasks go back to PENDING
+      - a job being finalized is left for another worker to finalize
+      - a job without tasks (being planned, or run by an old in-process
+        thread that never had a lease) goes back to PENDING
+    Tasks and jobs already claimed max_attempts times (for finalizing,
+    when that is what ran out) are FAILED instead.
+    Returns (requeued, failed).
+    """
+    now = timezone.now()
+    expired = Q(lease_expires_at__lt=now)
+    has_tasks = Exists(ScanTask.objects.filter(job=OuterRef('pk')))
+
+    tasks = ScanTask.objects.filter(expired, status='RUNNING')
+    expired_jobs = ScanJob.objects.filter(expired, has_tasks, status='RUNNING')
+    orphans = ScanJob.objects.filter(expired | Q(lease_expires_at__isnull=True), status='RUNNING').exclude(has_tasks)
+    # Reads first: the UPDATEs take the write lock, which scans need far more
+    if not (tasks.exists() or expired_jobs.exists() or orphans.exists()):
+        return 0, 0
+
+    failed = tasks.filter(attempts__gte=max_attempts).update(
+        status='FAILED', error=f"Lease expired after {max_attempts} attempts.", finished_at=now, lease_expires_at=None,
+    )
+    requeued = tasks.update(status='PENDING', worker='', lease_expires_at=None)
+
+    given_up = list(expired_jobs.filter(finalize_attempts__gte=max_attempts).values_list('id', flat=True))
+    if given_up:
+        failed += ScanJob.objects.filter(id__in=given_up, status='RUNNING').update(
+            status='FAILED', completed_at=now, lease_expires_at=None,
+        )
+        for job_id in given_up:
+            discard_job_state(job_id, finished=True)
+    requeued += expired_jobs.update(lease_expires_at=None)
+
+    orphan_ids = list(orphans.values_list('id', flat=True))
+    if orphan_ids:
+        orphans = orphans.filter(id__in=orphan_ids)
+        failed += orphans.filter(attempts__gte=max_attempts).update(status='FAILED', completed_at=now, lease_expires_at=None)
+        requeued += orphans.update(status='PENDING', worker='', lease_expires_at=None)
+        for job_id in orphan_ids:
+            discard_job_state(job_id)
+    return requeued, failed
+
+
+def reset_job(job_id):
+    """
+    Delete what an interrupted attempt saved, so the retry starts clean.
+    SymbolPersistence is left alone; it is only advanced once per job.
+    """
+    with transaction.atomic():
+        for model in (ScanTask, StockResult, JobSymbolSummary, ScreenerBitmap, ScanReport):
+            model.objects.filter(job_id=job_id).delete()
+
+
+@contextmanager
+def _heartbeating(beat, interval):
+    """
+    Call beat() every `interval` seconds from a side thread while the
+    block runs, until it returns a falsy value (the lease is lost).
+    """
+    stopped = threading.Event()
+
+    def run():
+        try:
+            while not stopped.wait(interval):
+                if not beat():
+                    return
+        finally:
+            connection.close()
+
+    beater = threading.Thread(target=run, daemon=True)
+    beater.start()
+    try:
+        yield
+    finally:
+        stopped.set()
+        beater.join()
+
+
+def plan_job(job, worker, lease_seconds=LEASE_SECONDS, **kwargs):
+    """
+    Split a job claimed by `worker` into one PENDING task per active
+    screener and give up the job's lease; a job with no active screeners
+    completes straight away. Returns the number of tasks.
+    """
+    if job.attempts > 1:
+        reset_job(job.id)
+    scanner = ChartinkScanner(job.id, shared=True)
+    try:
+        scanner.state.set_status('RUNNING', started_at=timezone.now())
+        scanner.log("Starting scan job...")
+        screener_ids = list(Screener.objects.filter(is_active=True).order_by('id').values_list('id', flat=True))
+        if not screener_ids:
+            scanner.log("No active screeners found.")
+            ScanJob.objects.filter(id=job.id, worker=worker).update(lease_expires_at=None)
+            scanner.finish('COMPLETED')
+            return 0
+        with transaction.atomic():
+            ScanTask.objects.bulk_create([ScanTask(job_id=job.id, screener_id=screener_id) for screener_id in screener_ids])
+            ScanJob.objects.filter(id=job.id, worker=worker).update(lease_expires_at=None)
+        scanner.log(f"Found {len(screener_ids)} active screeners; queued one task each for the workers.")
+        return len(screener_ids)
+    finally:
+        scanner.state.close()
+
+
+def run_tasks(tasks, worker, concurrency=None, lease_seconds=LEASE_SECONDS, heartbeat_interval=HEARTBEAT_INTERVAL):
+    """
+    Scan the screeners of tasks leased to `worker`, all of one job,
+    `concurrency` at a time, heartbeating their leases meanwhile.
+    """
+    job_id = tasks[0].job_id
+    retried = [task.screener_id for task in tasks if task.attempts > 1]
+    if retried:
+        StockResult.objects.filter(job_id=job_id, screener_id__in=retried).delete() # Saved before the lease ran out
+    task_ids = {task.screener_id: task.id for task in tasks}
+    total = ScanTask.objects.filter(job_id=job_id).count()
+
+    scanner = ChartinkScanner(job_id, shared=True)
+
+    def on_result(screener, count, error):
+        # Inside the transaction that saved the rows, if there are any
+        finished = ScanTask.objects.filter(id=task_ids[screener.id], status='RUNNING', worker=worker).update(
+            status='FAILED' if error else 'DONE', result_count=count, error=str(error or ''), finished_at=timezone.now(),
+        )
+        if not finished and error is None:
+            raise LeaseLost(f"Task for {screener.name} was handed to another worker.") # Rolls the rows back
+        done = ScanTask.objects.filter(job_id=job_id, status__in=FINISHED_TASK_STATUSES).count()
+        scanner.update_progress(int(done / total * 90)) # 0 to 90% for scanning
+
+    global_settings = GlobalSettings.get_setting()
+    concurrency = max(1, concurrency or global_settings.scan_concurrency)
+    get_pool(max_size=concurrency)
+    with _heartbeating(lambda: heartbeat_tasks(list(task_ids.values()), worker, lease_seconds), heartbeat_interval):
+        try:
+            scanner.scan_screeners([task.screener for task in tasks], concurrency, global_settings, on_result=on_result)
+        finally:
+            scanner.state.close()
+
+
+def finalize_job(job, worker, lease_seconds=LEASE_SECONDS, heartbeat_interval=HEARTBEAT_INTERVAL, **kwargs):
+    """
+    Rank, summarize and export a job whose tasks have all finished, and
+    mark it COMPLETED (FAILED if that goes wrong). If the lease was lost
+    meanwhile, the job is left to the worker that holds it now.
+    """
+    scanner = ChartinkScanner(job.id, shared=True)
+    lost = threading.Event()
+
+    def beat():
+        if heartbeat(job.id, worker, lease_seconds):
+            return True
+        lost.set()
+        return False
+
+    def check_lease():
+        if lost.is_set() or not ScanJob.objects.filter(
+            id=job.id, status='RUNNING', worker=worker, lease_expires_at__isnull=False,
+        ).exists():
+            message = f"Finalizing was handed to another worker; {worker} leaves the job to it."
+            scanner.log(message)
+            scanner.state.close() # Keeps the lines and makes the finish() below a no-op
+            raise LeaseLost(message)
+
+    scanner.before_finish = check_lease
+    with _heartbeating(beat, heartbeat_interval):
+        try:
+            tasks = ScanTask.objects.filter(job=job)
+            scanner.log(f"All {tasks.count()} screener tasks finished ({tasks.filter(status='FAILED').count()} failed).")
+            scanner.complete(GlobalSettings.get_setting())
+        except LeaseLost:
+            pass
+        except Exception as e:
+            with suppress(LeaseLost):
+                scanner.fail(e)
+        finally:
+            # No-op unless finish() was never reached
+            scanner.state.finish('FAILED')
+            ScanJob.objects.filter(id=job.id, worker=worker).update(lease_expires_at=None)
+
+
+class Worker:
+    """
+    Claims and runs queued work in `concurrency` threads until stopped
+    (or, with once=True, until there is nothing left to claim). Each
+    thread takes up to `scan_concurrency` tasks at a time. Expired leases
+    are swept once every `sweep_interval` seconds (a lease period by
+    default) by whichever thread polls first.
+    """
+    def __init__(self, concurrency=1, scan_concurrency=None, poll_interval=POLL_INTERVAL, lease_seconds=LEASE_SECONDS,
+                 heartbeat_interval=HEARTBEAT_INTERVAL, sweep_interval=None, once=False, log=print,
+                 planner=plan_job, task_runner=run_tasks, finalizer=finalize_job):
+        self.concurrency = max(1, concurrency)
+        self.scan_concurrency = scan_concurrency
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        self.sweep_interval = lease_seconds if sweep_interval is None else sweep_interval
+        self._next_sweep = 0.0
+        self.heartbeat_interval = heartbeat_interval
+        self.once = once
+        self.log = log
+        self.planner = planner
+        self.task_runner = task_runner
+        self.finalizer = finalizer
+        self.stopping = threading.Event()
+        self.tasks_run = 0
+        self.jobs_finalized = 0
+        self._lock = threading.Lock()
+
+    def run(self):
+        """
+        Work in `concurrency` threads. They are daemon threads: if the
+        process is killed mid-scan, the leases run out and the next
+        worker to poll puts the work back.
+        """
+        threads = [threading.Thread(target=self.work, args=(slot,), daemon=True) for slot in range(self.concurrency)]
+        for thread in threads:
+            thread.start()
+        while any(thread.is_alive() for thread in threads):
+            for thread in threads:
+                thread.join(0.5) # Short joins keep the main thread responsive to Ctrl-C
+
+    def stop(self):
+        """
+        Claim nothing more; work already claimed finishes.
+        """
+        self.stopping.set()
+
+    def work(self, slot=0):
+        name = worker_name(slot)
+        try:
+            while not self.stopping.is_set():
+                try:
+                    if self._sweep_due():
+                        requeued, failed = requeue_orphans()
+                        if requeued or failed:
+                            self.log(f"{name}: requeued {requeued} and failed {failed} leases that expired.")
+                    if self.step(name):
+                        continue
+                    if self.once:
+                        return
+                except Exception:
+                    # E.g. "database is locked" under load: the thread keeps polling, and
+                    # whatever it had claimed is put back once the lease runs out
+                    self.log(f"{name}: error, polling again in {self.poll_interval}s.\n{traceback.format_exc()}")
+                self.stopping.wait(self.poll_interval)
+        finally:
+            if threading.current_thread() is not threading.main_thread():
+                connection.close()
+
+    def _sweep_due(self):
+        with self._lock:
+            now = time.monotonic()
+            if now < self._next_sweep:
+                return False
+            self._next_sweep = now + self.sweep_interval
+            return True
+
+    def step(self, name):
+        """
+        Claim and run one piece of work: tasks of a running job first,
+        then finalizing a job, then planning a new one, then re-ranking
+        past jobs after a settings change. Returns False if there was
+        nothing to claim.
+        """
+        options = {'lease_seconds': self.lease_seconds, 'heartbeat_interval': self.heartbeat_interval}
+        limit = max(1, self.scan_concurrency or GlobalSettings.get_setting().scan_concurrency)
+        tasks = claim_tasks(name, limit, self.lease_seconds)
+        if tasks:
+            self.log(f"{name}: scanning {len(tasks)} screener(s) of job {tasks[0].job_id}.")
+            self.task_runner(tasks, name, concurrency=self.scan_concurrency, **options)
+            with self._lock:
+                self.tasks_run += len(tasks)
+            return True
+
+        job = claim_finalization(name, self.lease_seconds)
+        if job:
+            self.log(f"{name}: finalizing job {job.id}.")
+            self.finalizer(job, name, **options)
+            with self._lock:
+                self.jobs_finalized += 1
+            return True
+
+        job = claim_job(name, self.lease_seconds)
+        if job:
+            self.log(f"{name}: planning job {job.id} (attempt {job.attempts}).")
+            self.planner(job, name, **options)
+            return True
+
+        if claim_rerank():
+            self.log(f"{name}: re-ranking past jobs under the new settings.")
+            try:
+                summary = rerank_jobs()
+            except Exception:
+                request_rerank() # For the next poll
+                raise
+            self.log(f"{name}: re-ranked {summary['jobs']} jobs in {summary['seconds']:.1f}s.")
+            return True
+        return False
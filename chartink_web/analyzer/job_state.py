@@ -0,0 +1,304 @@
+"""
+Registry of live scan job state.
+
+The scanner writes status, progress and log lines to a LiveJobState held
+in process memory, and status reads for a running job are served from it
+without touching the database. State is written behind to ScanJob and
+ScanLogEntry every `flush_interval` seconds (or once `max_buffered` lines
+are waiting) and immediately on status changes; a job only leaves the
+registry after everything has been persisted, so readers that fall back
+to the database never see less than the registry showed.
+
+The registry is process-local. Point the ANALYZER_JOB_STATE_CACHE setting
+at a cache alias with shared storage (file, memcached, redis) to publish
+live state to other processes as well. A published snapshot holds only the
+last SNAPSHOT_LINES lines, so publishing costs the same however long the
+log grows; a reader further behind than that reads the lines it missed
+from the database. Snapshots are written once the transaction that saved
+them commits, and a finished job is marked as such in the cache, so a
+snapshot written late can't make it look live again.
+
+When several processes log to one job (the per-screener tasks of
+analyzer.job_queue), each uses a shared=True state instead: lines get
+their sequence numbers from ScanJob.log_seq as they are written, so the
+numbers stay contiguous across writers. A shared state never enters the
+registry, as it only holds its own process's lines; it merges its lines
+into the job's published snapshot within the transaction that numbers
+them, so writers take turns, and readers still get status, progress and
+the log's tail without SQL.
+"""
+import threading
+from collections import namedtuple
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connection, transaction
+from django.db.models import F, Max
+from django.utils import timezone
+
+from .models import ScanJob, ScanLogEntry
+
+_registry = {}
+_registry_lock = threading.Lock()
+
+CACHE_KEY = 'analyzer:jobstate:{}'
+FINISHED_KEY = 'analyzer:jobstate:{}:finished'
+SNAPSHOT_TIMEOUT = 3600
+SNAPSHOT_LINES = 500
+
+# Log line as read back from a shared-cache snapshot
+LogLine = namedtuple('LogLine', ['seq', 'line', 'event', 'data'])
+
+TERMINAL_STATUSES = ('COMPLETED', 'FAILED')
+
+
+def _shared_cache():
+    alias = getattr(settings, 'ANALYZER_JOB_STATE_CACHE', None)
+    return caches[alias] if alias else None
+
+
+def _snapshot(status, progress, first_seq, lines):
+    dropped = max(0, len(lines) - SNAPSHOT_LINES)
+    return {'status': status, 'progress': progress, 'first_seq': first_seq + dropped, 'lines': lines[dropped:]}
+
+
+class LiveJobState:
+    def __init__(self, job, flush_interval=1.0, max_buffered=50, shared=False):
+        self.job_id = job.id
+        self.status = job.status
+        self.progress = job.progress
+        self.flush_interval = flush_interval
+        self.max_buffered = max_buffered
+        self.shared = shared
+
+        # Continue numbering if the job already has lines (e.g. a retried job)
+        self._first_seq = (ScanLogEntry.objects.filter(job_id=job.id).aggregate(last=Max('seq'))['last'] or 0) + 1 if not shared else None
+        self._entries = []
+        self._unsaved = []
+        self._saved_progress = job.progress
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._flusher = None
+        self._closed = False
+
+    def _activate(self):
+        # Registered and flushed from the first write on, so a state that
+        # never records anything costs no thread and no registry slot.
+        # Called with self._lock held.
+        if self._flusher is None and not self._closed:
+            if not self.shared: # A shared state only holds this process's lines
+                with _registry_lock:
+                    _registry[self.job_id] = self
+            if self.flush_interval:
+                self._flusher = threading.Thread(target=self._flush_periodically, daemon=True)
+                self._flusher.start()
+
+    def log(self, message, event='', data=None):
+        """
+        Record one log line, optionally tagged as an event with a JSON
+        payload; returns its sequence number (None for a shared state,
+        which numbers lines when it flushes them).
+        """
+        with self._lock:
+            self._activate()
+            entry = ScanLogEntry(
+                job_id=self.job_id, seq=None if self.shared else self._first_seq + len(self._entries),
+                created_at=timezone.now(), message=message, event=event, data=data,
+            )
+            self._entries.append(entry)
+            self._unsaved.append(entry)
+            full = len(self._unsaved) >= self.max_buffered
+        if full:
+            self.flush()
+        return entry.seq
+
+    def set_progress(self, progress):
+        with self._lock:
+            self._activate()
+            self.progress = progress
+
+    def set_status(self, status, **fields):
+        """
+        Change status; unlike progress this is persisted right away,
+        together with any extra ScanJob fields (e.g. started_at).
+        """
+        self.flush()
+        with self._lock:
+            self._activate()
+            self.status = status
+        with transaction.atomic(): # Holds the job row for a shared state's _publish()
+            ScanJob.objects.filter(id=self.job_id).update(status=status, **fields)
+            self._publish()
+
+    def entries_after(self, seq):
+        with self._lock:
+            # seq numbers are contiguous, so the position is arithmetic
+            return self._entries[max(0, seq - self._first_seq + 1):]
+
+    def flush(self):
+        # _flush_lock keeps batches in sequence order when the timer and a writer flush together
+        with self._flush_lock:
+            with self._lock:
+                entries, self._unsaved = self._unsaved, []
+                progress = self.progress
+            if self.shared:
+                if entries or progress != self._saved_progress:
+                    self._write_shared(entries, progress)
+                    self._saved_progress = progress
+                return
+            if entries:
+                ScanLogEntry.objects.bulk_create(entries)
+                # Keep the counter shared writers number from in step
+                ScanJob.objects.filter(id=self.job_id, log_seq__lt=entries[-1].seq).update(log_seq=entries[-1].seq)
+            if progress != self._saved_progress:
+                ScanJob.objects.filter(id=self.job_id).update(progress=progress)
+                self._saved_progress = progress
+        self._publish()
+
+    def _write_shared(self, entries, progress):
+        # The first UPDATE locks the job row until commit, so writers take
+        # turns: lines become visible in sequence order, never with gaps,
+        # and each writer publishes on top of the previous one's snapshot.
+        try:
+            with transaction.atomic():
+                if entries:
+                    ScanJob.objects.filter(id=self.job_id).update(log_seq=F('log_seq') + len(entries))
+                    last = ScanJob.objects.filter(id=self.job_id).values_list('log_seq', flat=True).get()
+                    for seq, entry in enumerate(entries, start=last - len(entries) + 1):
+                        entry.seq = seq
+                    ScanLogEntry.objects.bulk_create(entries)
+                if progress != self._saved_progress:
+                    ScanJob.objects.filter(id=self.job_id).update(progress=progress)
+                self._publish(entries)
+        except Exception:
+            discard_job_state(self.job_id) # It may show lines that were rolled back
+            raise
+
+    def finish(self, status):
+        """
+        Persist everything, move the job to a terminal state, store the
+        legacy ScanJob.log text and leave the registry. Safe to call twice.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        self._stopped.set()
+        if self._flusher:
+            self._flusher.join()
+
+        with self._lock:
+            if status == 'COMPLETED':
+                self.progress = 100
+        self.flush()
+        with self._lock:
+            self.status = status
+            entries = self._entries if not self.shared else ScanLogEntry.objects.filter(job_id=self.job_id).order_by('seq')
+            log = ''.join(f"{entry.line}\n" for entry in entries)
+        ScanJob.objects.filter(id=self.job_id).update(
+            status=status, completed_at=timezone.now(), progress=self.progress, log=log,
+        )
+
+        with _registry_lock:
+            if _registry.get(self.job_id) is self:
+                del _registry[self.job_id]
+        discard_job_state(self.job_id, finished=True)
+
+    def close(self):
+        """
+        Persist everything and stop, leaving the job's status alone: for a
+        shared state whose process is done with its part of the job.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        self._stopped.set()
+        if self._flusher:
+            self._flusher.join()
+        self.flush()
+
+    def _publish(self, entries=()):
+        cache = _shared_cache()
+        if not cache:
+            return
+        key = CACHE_KEY.format(self.job_id)
+        if self.shared:
+            snapshot = self._merged_snapshot(cache.get(key), entries)
+            if snapshot is None:
+                transaction.on_commit(lambda: cache.delete(key))
+                return
+        else:
+            with self._lock:
+                lines = [(entry.seq, entry.line, entry.event, entry.data) for entry in self._entries[-SNAPSHOT_LINES:]]
+            snapshot = _snapshot(self.status, self.progress, self._first_seq + len(self._entries) - len(lines), lines)
+        # Out of the write lock, and never showing lines that get rolled back
+        transaction.on_commit(lambda: cache.set(key, snapshot, timeout=SNAPSHOT_TIMEOUT))
+
+    def _merged_snapshot(self, snapshot, entries):
+        # Called with the job row locked: the status, progress and lines read
+        # here are the job's, whichever writer put them there. None once the
+        # job is terminal, so readers go to the database.
+        status, progress = ScanJob.objects.filter(id=self.job_id).values_list('status', 'progress').get()
+        if status in TERMINAL_STATUSES:
+            return None
+        if snapshot and (not entries or snapshot['first_seq'] + len(snapshot['lines']) == entries[0].seq):
+            first_seq, lines = snapshot['first_seq'], snapshot['lines']
+        else:
+            # No snapshot yet, or it missed a writer's lines: rebuild the tail from the rows
+            entries = ScanLogEntry.objects.filter(job_id=self.job_id).order_by('-seq')[:SNAPSHOT_LINES][::-1]
+            first_seq, lines = entries[0].seq if entries else 1, []
+        lines = lines + [(entry.seq, entry.line, entry.event, entry.data) for entry in entries]
+        return _snapshot(status, progress, first_seq, lines)
+
+    def _flush_periodically(self):
+        try:
+            while not self._stopped.wait(self.flush_interval):
+                self.flush()
+        finally:
+            connection.close()
+
+
+class _SharedJobState:
+    """
+    Read-only view of a LiveJobState published by another process.
+    """
+    def __init__(self, snapshot):
+        self.status = snapshot['status']
+        self.progress = snapshot['progress']
+        self._first_seq = snapshot['first_seq']
+        self._entries = [LogLine(*line) for line in snapshot['lines']]
+
+    def entries_after(self, seq):
+        if seq + 1 < self._first_seq:
+            return None # Behind the published tail
+        return self._entries[seq - self._first_seq + 1:]
+
+
+def get_job_state(job_id):
+    """
+    Live state of a running job, or None once it has finished (or if it
+    runs in another process and no shared cache is configured).
+    """
+    with _registry_lock:
+        state = _registry.get(job_id)
+    if state:
+        return state
+    cache = _shared_cache()
+    if cache:
+        key = CACHE_KEY.format(job_id)
+        found = cache.get_many([key, FINISHED_KEY.format(job_id)])
+        if list(found) == [key]:
+            return _SharedJobState(found[key])
+    return None
+
+
+def discard_job_state(job_id, finished=False):
+    """
+    Forget the published state of a job that finished or whose worker is
+    gone, so readers fall back to the database.
+    """
+    cache = _shared_cache()
+    if cache:
+        if finished:
+            cache.set(FINISHED_KEY.format(job_id), True, timeout=SNAPSHOT_TIMEOUT)
+        cache.delete(CACHE_KEY.format(job_id))
@@ -0,0 +1,90 @@
+"""
+Read side of the append-only job log.
+
+Scanners record lines through a LiveJobState (see job_state), which
+writes them behind to ScanLogEntry. Readers use read_job_status() to
+fetch only the lines after a sequence number (from memory while the job
+is live, from the database afterwards), or job_event_stream() to have
+them pushed as server-sent events.
+"""
+import json
+import time
+
+from .job_state import TERMINAL_STATUSES, get_job_state
+from .models import ScanJob, ScanLogEntry
+
+
+def read_log_entries(job_id, after_seq=0, limit=None):
+    """
+    Log lines of a job with seq > after_seq, oldest first.
+    """
+    entries = ScanLogEntry.objects.filter(job_id=job_id, seq__gt=after_seq).order_by('seq')
+    if limit:
+        entries = entries[:limit]
+    return list(entries)
+
+
+def read_job_status(job_id, after_seq=0):
+    """
+    (status, progress, log lines with seq > after_seq) for a job. Live
+    jobs are answered from the in-memory registry (or the shared cache)
+    without any SQL.
+    Raises ScanJob.DoesNotExist for unknown jobs.
+    """
+    state = get_job_state(job_id)
+    if state:
+        entries = state.entries_after(after_seq)
+        if entries is None: # Further behind than a published snapshot reaches
+            entries = read_log_entries(job_id, after_seq)
+        return state.status, state.progress, entries
+    # Status first: lines are persisted before a job turns terminal, so a
+    # terminal status read here means the read below sees every line.
+    status, progress = ScanJob.objects.filter(id=job_id).values_list('status', 'progress').get()
+    return status, progress, read_log_entries(job_id, after_seq)
+
+
+def _sse(event, data, event_id=None):
+    lines = [f"event: {event}"]
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"data: {json.dumps(data)}")
+    return '\n'.join(lines) + '\n\n'
+
+
+def job_event_stream(job_id, after_seq=0, poll_interval=1.0, max_duration=300, keepalive=15):
+    """
+    Server-sent events for a job: new log lines ('log'), per-screener
+    completions ('screener'), progress changes ('progress') and a final
+    'done'. Log events carry their seq as the SSE id, so a reconnecting
+    EventSource resumes via Last-Event-ID. The stream ends after
+    `max_duration` seconds and the browser reconnects on its own.
+    """
+    yield "retry: 2000\n\n"
+    started = last_sent = time.monotonic()
+    last_progress = None
+    while True:
+        status, progress, entries = read_job_status(job_id, after_seq)
+        for entry in entries:
+            payload = {'seq': entry.seq, 'line': entry.line}
+            if entry.event:
+                payload.update(entry.data or {})
+            yield _sse(entry.event or 'log', payload, event_id=entry.seq)
+            after_seq = entry.seq
+            last_sent = time.monotonic()
+
+        if progress != last_progress:
+            yield _sse('progress', {'status': status, 'progress': progress})
+            last_progress = progress
+            last_sent = time.monotonic()
+
+        if status in TERMINAL_STATUSES:
+            yield _sse('done', {'status': status, 'progress': progress})
+            return
+
+        now = time.monotonic()
+        if now - started >= max_duration:
+            return
+        if now - last_sent >= keepalive:
+            yield ": keep-alive\n\n"
+            last_sent = now
+        time.sleep(poll_interval)
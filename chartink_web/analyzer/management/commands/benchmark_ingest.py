@@ -0,0 +1,54 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from analyzer.models import Screener, ScanJob, Instrument
+from analyzer.services import ChartinkScanner
+
+
+class Command(BaseCommand):
+    help = "Compare StockResult ingestion speed: one save() per row vs batched bulk_create."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=20000, help="Synthetic stock rows per run")
+
+    def handle(self, *args, **options):
+        rows = options['rows']
+        stocks = [
+            {
+                'nsecode': f'BENCH{i}',
+                'bsecode': str(500000 + i),
+                'name': f'Benchmark Company {i} Limited',
+                'close': 100.0 + i,
+                'volume': 1000 * i,
+            }
+            for i in range(rows)
+        ]
+
+        screener = Screener.objects.create(url='https://chartink.com/screener/benchmark-ingest', name='Benchmark', is_active=False)
+        try:
+            per_row = self.measure(lambda scanner: self.save_per_row(scanner, screener, stocks))
+            batched = self.measure(lambda scanner: scanner.save_results(screener, stocks))
+        finally:
+            screener.delete() # Cascades to any leftover benchmark results
+            Instrument.objects.filter(symbol__startswith='BENCH', results__isnull=True).delete()
+
+        self.stdout.write(f"{'Method':<20} {'Seconds':>10} {'Rows/sec':>12}")
+        self.stdout.write("-" * 44)
+        for label, seconds in (('save() per row', per_row), ('bulk_create', batched)):
+            self.stdout.write(f"{label:<20} {seconds:>10.3f} {rows / seconds:>12.0f}")
+        self.stdout.write(f"Speed-up: {per_row / batched:.1f}x")
+
+    def measure(self, write):
+        job = ScanJob.objects.create(status='COMPLETED')
+        try:
+            start = time.perf_counter()
+            write(ChartinkScanner(job.id))
+            return time.perf_counter() - start
+        finally:
+            job.delete()
+
+    def save_per_row(self, scanner, screener, stocks):
+        # The pre-batching ingestion path: one INSERT (and transaction) per row
+        for result in scanner.build_results(screener, stocks):
+            result.save()
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from analyzer.bitmaps import MODES, run_query
+
+
+class Command(BaseCommand):
+    help = "Find stocks matching a boolean screener expression, e.g. '12 & (15 | 18) & ~7', across recent scans."
+
+    def add_arguments(self, parser):
+        parser.add_argument('expression', help="Screeners by id, URL slug or \"quoted name\" combined with & | ~ and parentheses")
+        parser.add_argument('--last', type=int, default=10, help="Number of most recent completed jobs to search")
+        parser.add_argument('--jobs', type=int, nargs='+', default=None, help="Search these jobs instead of the most recent ones")
+        parser.add_argument('--mode', choices=MODES, default='any', help="Match in any or in all of the jobs")
+
+    def handle(self, *args, **options):
+        try:
+            result = run_query(options['expression'], last=max(1, options['last']), job_ids=options['jobs'], mode=options['mode'])
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        for match in result['matches']:
+            self.stdout.write(f"{match['symbol']:<15} {match['jobs']:>3}  {match['name']}")
+        self.stdout.write(
+            f"{len(result['matches'])} stocks matched in {result['mode']} of {len(result['jobs'])} jobs "
+            f"(evaluated in {result['elapsed_us']:.0f}us)."
+        )
@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from analyzer.models import GlobalSettings
+from analyzer.rerank import rerank_jobs
+
+
+class Command(BaseCommand):
+    help = "Recompute conviction flags, scores and summaries of completed jobs under the current settings."
+
+    def add_arguments(self, parser):
+        parser.add_argument('job_ids', nargs='*', type=int, help="Jobs to re-rank (default: all completed jobs)")
+        parser.add_argument('--threshold', type=int, default=None, help="Set min_ranking_threshold before re-ranking")
+        parser.add_argument(
+            '--scoring', choices=[value for value, label in GlobalSettings.SCORING_CHOICES], default=None,
+            help="Set the scoring mode before re-ranking",
+        )
+        parser.add_argument('--chunk-size', type=int, default=25, help="Jobs per transaction")
+
+    def handle(self, *args, **options):
+        settings = GlobalSettings.get_setting()
+        if options['threshold'] is not None:
+            if options['threshold'] < 1:
+                raise CommandError("--threshold must be at least 1.")
+            settings.min_ranking_threshold = options['threshold']
+        if options['scoring']:
+            settings.scoring_mode = options['scoring']
+        settings.save()
+
+        def progress(done, total):
+            self.stdout.write(f"  {done}/{total} jobs re-ranked")
+
+        summary = rerank_jobs(options['job_ids'] or None, chunk_size=max(1, options['chunk_size']), progress=progress)
+        self.stdout.write(
+            f"Re-ranked {summary['jobs']} jobs in {summary['seconds']:.2f}s "
+            f"(threshold {settings.min_ranking_threshold}, {settings.get_scoring_mode_display().lower()} scoring): "
+            f"{summary['high_conviction']} high conviction symbols."
+        )
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from analyzer.job_queue import Worker, enqueue_scan
+from analyzer.models import Screener
+
+
+class Command(BaseCommand):
+    help = "Run a scan of all active screeners in the foreground."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--concurrency', type=int, default=None,
+            help="Screeners processed in parallel (defaults to GlobalSettings.scan_concurrency)",
+        )
+
+    def handle(self, *args, **options):
+        if not Screener.objects.filter(is_active=True).exists():
+            raise CommandError("No active screeners found.")
+
+        # Through the queue, so workers running meanwhile share the scan instead of starting another
+        job, created = enqueue_scan()
+        if not created:
+            raise CommandError(f"Scan job {job.id} is already {job.status.lower()}.")
+        Worker(scan_concurrency=options['concurrency'], once=True, log=self.stdout.write).work()
+        job.refresh_from_db()
+        self.stdout.write(f"Scan job {job.id} finished with status {job.status}.")
@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from analyzer.job_queue import HEARTBEAT_INTERVAL, LEASE_SECONDS, POLL_INTERVAL, Worker
+
+
+class Command(BaseCommand):
+    help = (
+        "Run queued scan jobs. The web server only enqueues them; start workers next to it, on this machine "
+        "or any other sharing the database: each scans its share of the screeners."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=1, help="Claims this worker runs at the same time")
+        parser.add_argument(
+            '--scan-concurrency', type=int, default=None,
+            help="Screeners claimed and processed in parallel per claim (defaults to GlobalSettings.scan_concurrency)",
+        )
+        parser.add_argument('--poll-interval', type=float, default=POLL_INTERVAL, help="Seconds between polls of an empty queue")
+        parser.add_argument('--lease', type=int, default=LEASE_SECONDS, help="Seconds a job or task stays leased without a heartbeat")
+        parser.add_argument('--once', action='store_true', help="Exit once nothing is pending instead of polling")
+
+    def handle(self, *args, **options):
+        if options['concurrency'] < 1:
+            raise CommandError("--concurrency must be at least 1.")
+        if options['lease'] <= HEARTBEAT_INTERVAL:
+            raise CommandError(f"--lease must be longer than the {HEARTBEAT_INTERVAL}s heartbeat interval.")
+
+        worker = Worker(
+            concurrency=options['concurrency'],
+            scan_concurrency=options['scan_concurrency'],
+            poll_interval=options['poll_interval'],
+            lease_seconds=options['lease'],
+            once=options['once'],
+            log=self.stdout.write,
+        )
+        self.stdout.write(f"Worker started with {worker.concurrency} slot(s). Press Ctrl-C to stop.")
+        try:
+            worker.run()
+        except KeyboardInterrupt:
+            worker.stop()
+            self.stdout.write("Stopped. Work still running is requeued once its lease expires.")
+            return
+        self.stdout.write(f"Scanned {worker.tasks_run} screener(s) and finalized {worker.jobs_finalized} job(s).")
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:23
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analyzer', '0003_scanreport'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ScreenerClauseCache',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('scan_clause', models.TextField()),
+                ('clause_hash', models.CharField(help_text='SHA-256 of the scan clause', max_length=64)),
+                ('captured_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('ttl_seconds', models.IntegerField(default=604800, help_text='Seconds before the clause is re-captured')),
+                ('screener', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='clause_cache', to='analyzer.screener')),
+            ],
+        ),
+    ]
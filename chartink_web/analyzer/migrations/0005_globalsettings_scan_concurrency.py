@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analyzer', '0004_screenerclausecache'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='globalsettings',
+            name='scan_concurrency',
+            field=models.IntegerField(default=4, help_text='Number of screeners processed in parallel'),
+        ),
+    ]
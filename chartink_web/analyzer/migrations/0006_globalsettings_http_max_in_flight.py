@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analyzer', '0005_globalsettings_scan_concurrency'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='globalsettings',
+            name='http_max_in_flight',
+            field=models.IntegerField(default=8, help_text='Maximum concurrent /screener/process requests'),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:29
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analyzer', '0006_globalsettings_http_max_in_flight'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='scanjob',
+            name='log',
+            field=models.TextField(blank=True, help_text='Full log text, written once the job finishes (see ScanLogEntry)'),
+        ),
+        migrations.CreateModel(
+            name='ScanLogEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('seq', models.PositiveIntegerField(help_text="Position of the line within the job's log, starting at 1")),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('message', models.TextField()),
+                ('job', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='log_entries', to='analyzer.scanjob')),
+            ],
+            options={
+                'ordering': ['job', 'seq'],
+                'constraints': [models.UniqueConstraint(fields=('job', 'seq'), name='unique_log_entry_seq')],
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analyzer', '0007_scanlogentry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='scanlogentry',
+            name='data',
+            field=models.JSONField(blank=True, help_text='Structured payload for events', null=True),
+        ),
+        migrations.AddField(
+            model_name='scanlogentry',
+            name='event',
+            field=models.CharField(blank=True, choices=[('', 'Log line'), ('screener', 'Screener finished')], default='', max_length=20),
+        ),
+    ]
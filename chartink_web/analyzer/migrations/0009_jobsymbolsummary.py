@@ -0,0 +1,72 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:33
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Max
+
+
+def backfill_symbol_summaries(apps, schema_editor):
+    # Same aggregation as services.build_symbol_summary, on the historical models
+    StockResult = apps.get_model('analyzer', 'StockResult')
+    JobSymbolSummary = apps.get_model('analyzer', 'JobSymbolSummary')
+    job_ids = StockResult.objects.values_list('job_id', flat=True).distinct()
+    for job_id in job_ids:
+        rows = StockResult.objects.filter(job_id=job_id).values('symbol').annotate(
+            screener_count=Count('screener'),
+            stock_name=Max('name'),
+            stock_nse_code=Max('nse_code'),
+            stock_bse_code=Max('bse_code'),
+            stock_close_price=Max('close_price'),
+            stock_volume=Max('volume'),
+            high_conviction=Max('is_high_conviction'),
+        ).order_by('-screener_count', 'symbol')
+        summaries = []
+        rank = 0
+        previous_count = None
+        for position, row in enumerate(rows, start=1):
+            if row['screener_count'] != previous_count:
+                rank, previous_count = position, row['screener_count']
+            summaries.append(JobSymbolSummary(
+                job_id=job_id,
+                symbol=row['symbol'],
+                name=row['stock_name'] or '',
+                nse_code=row['stock_nse_code'],
+                bse_code=row['stock_bse_code'],
+                screener_count=row['screener_count'],
+                close_price=row['stock_close_price'],
+                volume=row['stock_volume'],
+                is_high_conviction=bool(row['high_conviction']),
+                rank=rank,
+            ))
+        JobSymbolSummary.objects.bulk_create(summaries, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analyzer', '0008_scanlogentry_event'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='JobSymbolSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('symbol', models.CharField(max_length=50)),
+                ('name', models.CharField(blank=True, max_length=255)),
+                ('nse_code', models.CharField(blank=True, max_length=50, null=True)),
+                ('bse_code', models.CharField(blank=True, max_length=50, null=True)),
+                ('screener_count', models.IntegerField(default=0, help_text='Number of screeners that returned the symbol')),
+                ('close_price', models.FloatField(blank=True, null=True)),
+                ('volume', models.BigIntegerField(blank=True, null=True)),
+                ('is_high_conviction', models.BooleanField(default=False)),
+                ('rank', models.IntegerField(default=0, help_text='1 = most screeners; equal counts share a rank')),
+                ('job', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='symbol_summaries', to='analyzer.scanjob')),
+            ],
+            options={
+                'ordering': ['job', 'rank', 'symbol'],
+                'constraints': [models.UniqueConstraint(fields=('job', 'symbol'), name='unique_job_symbol_summary')],
+            },
+        ),
+        migrations.RunPython(backfill_symbol_summaries, migrations.RunPython.noop),
+    ]
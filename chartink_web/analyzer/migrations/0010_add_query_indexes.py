@@ -0,0 +1,37 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analyzer', '0009_jobsymbolsummary'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='jobsymbolsummary',
+            index=models.Index(fields=['job', 'rank'], name='summary_job_rank_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='scanjob',
+            index=models.Index(fields=['status', 'completed_at'], name='job_status_completed_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='scanreport',
+            index=models.Index(fields=['created_at'], name='report_created_at_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stockresult',
+            index=models.Index(fields=['job', 'symbol'], name='result_job_symbol_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stockresult',
+            index=models.Index(fields=['job', 'screener'], name='result_job_screener_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stockresult',
+            index=models.Index(fields=['symbol', 'job'], name='result_symbol_job_idx'),
+        ),
+    ]
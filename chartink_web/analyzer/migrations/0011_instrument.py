@@ -0,0 +1,63 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:36
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Max, OuterRef, Subquery
+
+
+def create_instruments(apps, schema_editor):
+    # One Instrument per distinct symbol, then point every result at it
+    StockResult = apps.get_model('analyzer', 'StockResult')
+    Instrument = apps.get_model('analyzer', 'Instrument')
+    rows = StockResult.objects.values('symbol').annotate(
+        instrument_name=Max('name'),
+        instrument_nse_code=Max('nse_code'),
+        instrument_bse_code=Max('bse_code'),
+    )
+    Instrument.objects.bulk_create([
+        Instrument(
+            symbol=row['symbol'],
+            name=row['instrument_name'] or '',
+            nse_code=row['instrument_nse_code'],
+            bse_code=row['instrument_bse_code'],
+        )
+        for row in rows
+    ], batch_size=500)
+    StockResult.objects.update(instrument=Subquery(
+        Instrument.objects.filter(symbol=OuterRef('symbol')).values('id')[:1]
+    ))
+
+
+def copy_instruments_back(apps, schema_editor):
+    StockResult = apps.get_model('analyzer', 'StockResult')
+    Instrument = apps.get_model('analyzer', 'Instrument')
+    for field in ('symbol', 'name', 'nse_code', 'bse_code'):
+        StockResult.objects.update(**{field: Subquery(
+            Instrument.objects.filter(id=OuterRef('instrument_id')).values(field)[:1]
+        )})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analyzer', '0010_add_query_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Instrument',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('symbol', models.CharField(max_length=50, unique=True)),
+                ('name', models.CharField(blank=True, max_length=255)),
+                ('nse_code', models.CharField(blank=True, max_length=50, null=True)),
+                ('bse_code', models.CharField(blank=True, max_length=50, null=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='stockresult',
+            name='instrument',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.PROTECT, related_name='results', to='analyzer.instrument'),
+        ),
+        migrations.RunPython(create_instruments, copy_instruments_back),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:38
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analyzer', '0011_instrument'),
+    ]
+
+    operations = [
+        # Gives the column a default so that unapplying can re-add it before 0011 copies the symbols back
+        migrations.AlterField(
+            model_name='stockresult',
+            name='symbol',
+            field=models.CharField(default='', max_length=50),
+        ),
+        migrations.RemoveIndex(
+            model_name='stockresult',
+            name='result_job_symbol_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='stockresult',
+            name='result_symbol_job_idx',
+        ),
+        migrations.RemoveField(
+            model_name='stockresult',
+            name='bse_code',
+        ),
+        migrations.RemoveField(
+            model_name='stockresult',
+            name='name',
+        ),
+        migrations.RemoveField(
+            model_name='stockresult',
+            name='nse_code',
+        ),
+        migrations.RemoveField(
+            model_name='stockresult',
+            name='symbol',
+        ),
+        migrations.AlterField(
+            model_name='stockresult',
+            name='instrument',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='results', to='analyzer.instrument'),
+        ),
+        migrations.AddIndex(
+            model_name='stockresult',
+            index=models.Index(fields=['job', 'instrument'], name='result_job_instrument_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stockresult',
+            index=models.Index(fields=['instrument', 'job'], name='result_instrument_job_idx'),
+        ),
+    ]
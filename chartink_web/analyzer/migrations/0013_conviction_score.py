@@ -0,0 +1,51 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:41
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def score_existing_summaries(apps, schema_editor):
+    # Existing summaries were ranked by plain screener count
+    JobSymbolSummary = apps.get_model('analyzer', 'JobSymbolSummary')
+    JobSymbolSummary.objects.update(conviction_score=F('screener_count'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analyzer', '0012_stockresult_instrument_only'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='globalsettings',
+            name='score_decay',
+            field=models.FloatField(default=0.5, help_text="Share of the previous scan's score carried over in decay scoring"),
+        ),
+        migrations.AddField(
+            model_name='globalsettings',
+            name='scoring_mode',
+            field=models.CharField(choices=[('count', 'Screener count'), ('weighted', 'Weighted sum'), ('decay', 'Recency-decayed')], default='count', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='jobsymbolsummary',
+            name='conviction_score',
+            field=models.FloatField(default=0, help_text='Score under the scoring mode in force when the summary was built'),
+        ),
+        migrations.AddField(
+            model_name='screener',
+            name='weight',
+            field=models.FloatField(default=1.0, help_text='Contribution to the conviction score in weighted and decay scoring'),
+        ),
+        migrations.AlterField(
+            model_name='globalsettings',
+            name='min_ranking_threshold',
+            field=models.IntegerField(default=2, help_text='Minimum conviction score (screener count by default) for high conviction'),
+        ),
+        migrations.AlterField(
+            model_name='jobsymbolsummary',
+            name='rank',
+            field=models.IntegerField(default=0, help_text='1 = highest conviction score; equal scores share a rank'),
+        ),
+        migrations.RunPython(score_existing_summaries, migrations.RunPython.noop),
+    ]
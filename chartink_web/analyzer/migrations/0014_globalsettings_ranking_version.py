@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analyzer', '0013_conviction_score'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='globalsettings',
+            name='ranking_version',
+            field=models.PositiveIntegerField(default=0, help_text='Bumped whenever past jobs are re-ranked; keys cached rankings'),
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:50
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def backfill_bitmaps(apps, schema_editor):
+    # Same bitsets as bitmaps.build_screener_bitmaps, on the historical models
+    StockResult = apps.get_model('analyzer', 'StockResult')
+    ScreenerBitmap = apps.get_model('analyzer', 'ScreenerBitmap')
+    job_ids = StockResult.objects.values_list('job_id', flat=True).distinct()
+    for job_id in job_ids:
+        bits = {}
+        for screener_id, instrument_id in StockResult.objects.filter(job_id=job_id).values_list('screener_id', 'instrument_id'):
+            bits[screener_id] = bits.get(screener_id, 0) | (1 << instrument_id)
+        ScreenerBitmap.objects.bulk_create([
+            ScreenerBitmap(
+                job_id=job_id,
+                screener_id=screener_id,
+                bits=value.to_bytes((value.bit_length() + 7) // 8, 'little'),
+                cardinality=bin(value).count('1'),
+            )
+            for screener_id, value in bits.items()
+        ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analyzer', '0014_globalsettings_ranking_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ScreenerBitmap',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bits', models.BinaryField(help_text='Little-endian bitset over Instrument ids')),
+                ('cardinality', models.IntegerField(default=0, help_text='Number of set bits')),
+                ('job', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='bitmaps', to='analyzer.scanjob')),
+                ('screener', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='bitmaps', to='analyzer.screener')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('job', 'screener'), name='unique_job_screener_bitmap')],
+            },
+        ),
+        migrations.RunPython(backfill_bitmaps, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,89 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:55
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def replay_history(apps, schema_editor):
+    # One pass over every completed job, oldest first, with the same rules as persistence.update_symbol_persistence
+    ScanJob = apps.get_model('analyzer', 'ScanJob')
+    StockResult = apps.get_model('analyzer', 'StockResult')
+    JobSymbolSummary = apps.get_model('analyzer', 'JobSymbolSummary')
+    SymbolPersistence = apps.get_model('analyzer', 'SymbolPersistence')
+
+    history = {}
+    previous_id = None
+    jobs = ScanJob.objects.filter(status='COMPLETED').order_by('completed_at', 'id').values_list('id', 'completed_at', 'started_at')
+    for job_id, completed_at, started_at in jobs:
+        completed_at = completed_at or started_at or timezone.now()
+        rows = StockResult.objects.filter(job_id=job_id).values_list('instrument_id', 'instrument__symbol').distinct()
+        by_streak = {}
+        for instrument_id, symbol in rows:
+            state = history.get(instrument_id)
+            if state is None:
+                state = history[instrument_id] = {
+                    'first_seen_job_id': job_id, 'first_seen_at': completed_at,
+                    'current_streak': 1, 'longest_streak': 1, 'appearances': 1,
+                }
+            else:
+                state['current_streak'] = state['current_streak'] + 1 if state['last_seen_job_id'] == previous_id else 1
+                state['longest_streak'] = max(state['longest_streak'], state['current_streak'])
+                state['appearances'] += 1
+            state['last_seen_job_id'] = job_id
+            state['last_seen_at'] = completed_at
+            by_streak.setdefault((state['current_streak'], state['longest_streak'], state['first_seen_at']), []).append(symbol)
+        for (streak, longest_streak, first_seen_at), symbols in by_streak.items():
+            for start in range(0, len(symbols), 500):
+                JobSymbolSummary.objects.filter(job_id=job_id, symbol__in=symbols[start:start + 500]).update(
+                    streak=streak, longest_streak=longest_streak, first_seen_at=first_seen_at,
+                )
+        previous_id = job_id
+
+    SymbolPersistence.objects.bulk_create(
+        [SymbolPersistence(instrument_id=instrument_id, **state) for instrument_id, state in history.items()],
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analyzer', '0015_screenerbitmap'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='jobsymbolsummary',
+            name='first_seen_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='jobsymbolsummary',
+            name='longest_streak',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='jobsymbolsummary',
+            name='streak',
+            field=models.PositiveIntegerField(default=0, help_text='Consecutive completed scans the symbol appeared in, ending with this one'),
+        ),
+        migrations.CreateModel(
+            name='SymbolPersistence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('first_seen_at', models.DateTimeField()),
+                ('last_seen_at', models.DateTimeField()),
+                ('current_streak', models.PositiveIntegerField(default=1, help_text='Consecutive completed scans ending with last_seen_job')),
+                ('longest_streak', models.PositiveIntegerField(default=1)),
+                ('appearances', models.PositiveIntegerField(default=1, help_text='Completed scans the symbol appeared in')),
+                ('first_seen_job', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='analyzer.scanjob')),
+                ('instrument', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='persistence', to='analyzer.instrument')),
+                ('last_seen_job', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='analyzer.scanjob')),
+            ],
+            options={
+                'verbose_name_plural': 'symbol persistence',
+            },
+        ),
+        migrations.RunPython(replay_history, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analyzer', '0016_symbolpersistence'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='globalsettings',
+            name='ranked_at',
+            field=models.DateTimeField(blank=True, help_text='When past jobs were last re-ranked', null=True),
+        ),
+    ]
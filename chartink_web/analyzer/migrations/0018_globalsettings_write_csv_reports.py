@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analyzer', '0017_globalsettings_ranked_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='globalsettings',
+            name='write_csv_reports',
+            field=models.BooleanField(default=True, help_text='Write a CSV file to scan_reports/ when a scan completes; downloads stream from the database either way'),
+        ),
+    ]
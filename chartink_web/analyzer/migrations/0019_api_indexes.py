@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analyzer', '0018_globalsettings_write_csv_reports'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='jobsymbolsummary',
+            name='summary_job_rank_idx',
+        ),
+        migrations.AddIndex(
+            model_name='jobsymbolsummary',
+            index=models.Index(fields=['job', 'rank', 'symbol', 'screener_count', 'is_high_conviction'], name='summary_job_rank_cover_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='scanjob',
+            index=models.Index(fields=['status', 'id'], name='job_status_id_idx'),
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:08
+
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def fail_overlapping_jobs(apps, schema_editor):
+    # Jobs whose daemon thread died with the web process stayed PENDING or RUNNING; keep the newest for the queue
+    ScanJob = apps.get_model('analyzer', 'ScanJob')
+    active = ScanJob.objects.filter(status__in=['PENDING', 'RUNNING']).order_by('-id')
+    newest = active.values_list('id', flat=True).first()
+    if newest is not None:
+        active.exclude(id=newest).update(status='FAILED', completed_at=timezone.now())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analyzer', '0019_api_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='scanjob',
+            name='attempts',
+            field=models.PositiveIntegerField(default=0, help_text='Times a worker has claimed the job'),
+        ),
+        migrations.AddField(
+            model_name='scanjob',
+            name='dedup_key',
+            field=models.CharField(default='scan', help_text="Jobs with the same key can't be pending or running at once", max_length=100),
+        ),
+        migrations.AddField(
+            model_name='scanjob',
+            name='heartbeat_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='scanjob',
+            name='lease_expires_at',
+            field=models.DateTimeField(blank=True, help_text='A running job whose lease has expired is requeued', null=True),
+        ),
+        migrations.AddField(
+            model_name='scanjob',
+            name='worker',
+            field=models.CharField(blank=True, help_text='Worker holding the lease while the job runs', max_length=255),
+        ),
+        migrations.RunPython(fail_overlapping_jobs, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='scanjob',
+            constraint=models.UniqueConstraint(condition=models.Q(('status__in', ['PENDING', 'RUNNING'])), fields=('dedup_key',), name='unique_active_scan_job'),
+        ),
+    ]
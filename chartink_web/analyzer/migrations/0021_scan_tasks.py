@@ -0,0 +1,49 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:13
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Max, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def backfill_log_seq(apps, schema_editor):
+    ScanJob = apps.get_model('analyzer', 'ScanJob')
+    ScanLogEntry = apps.get_model('analyzer', 'ScanLogEntry')
+    last = ScanLogEntry.objects.filter(job=OuterRef('pk')).order_by().values('job').annotate(last=Max('seq')).values('last')
+    ScanJob.objects.update(log_seq=Coalesce(Subquery(last), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analyzer', '0020_scan_job_queue'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='scanjob',
+            name='log_seq',
+            field=models.PositiveIntegerField(default=0, help_text='Last ScanLogEntry.seq handed out; numbers lines from several workers'),
+        ),
+        migrations.RunPython(backfill_log_seq, migrations.RunPython.noop),
+        migrations.CreateModel(
+            name='ScanTask',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('PENDING', 'Pending'), ('RUNNING', 'Running'), ('DONE', 'Done'), ('FAILED', 'Failed')], default='PENDING', max_length=20)),
+                ('worker', models.CharField(blank=True, help_text='Worker holding the lease while the task runs', max_length=255)),
+                ('heartbeat_at', models.DateTimeField(blank=True, null=True)),
+                ('lease_expires_at', models.DateTimeField(blank=True, null=True)),
+                ('attempts', models.PositiveIntegerField(default=0, help_text='Times a worker has claimed the task')),
+                ('result_count', models.IntegerField(default=0, help_text='Rows the screener returned')),
+                ('error', models.TextField(blank=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('job', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='tasks', to='analyzer.scanjob')),
+                ('screener', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='scan_tasks', to='analyzer.screener')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'id'], name='task_status_id_idx'), models.Index(fields=['job', 'status'], name='task_job_status_idx')],
+                'constraints': [models.UniqueConstraint(fields=('job', 'screener'), name='unique_job_screener_task')],
+            },
+        ),
+    ]
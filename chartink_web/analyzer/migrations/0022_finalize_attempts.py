@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analyzer', '0021_scan_tasks'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='scanjob',
+            name='finalize_attempts',
+            field=models.PositiveIntegerField(default=0, help_text='Times a worker has claimed finalizing the job'),
+        ),
+    ]
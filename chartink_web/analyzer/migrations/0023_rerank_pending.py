@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analyzer', '0022_finalize_attempts'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='globalsettings',
+            name='rerank_pending',
+            field=models.BooleanField(default=False, help_text='Ranking settings changed; a worker re-ranks all past jobs'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analyzer', '0023_rerank_pending'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='stockresult',
+            name='is_high_conviction',
+            field=models.BooleanField(default=False, help_text="True if the symbol's conviction score in this job, under the scoring mode it was ranked with, meets min_ranking_threshold"),
+        ),
+    ]
@@ -1,15 +1,46 @@
+from datetime import timedelta
+
+from django.core.cache import cache
 from django.db import models
 from django.utils import timezone
 
+SETTINGS_CACHE_KEY = 'analyzer:settings'
+# save() clears the copy in the shared cache at once (analyzer.checks warns about unshared caches); the
+# timeout only bounds how long it can outlive a change made without save(), e.g. a queryset update()
+SETTINGS_CACHE_TIMEOUT = 300
+
+# Every scan covers all active screeners, so they all overlap
+SCAN_DEDUP_KEY = 'scan'
+
 class Screener(models.Model):
     url = models.URLField(unique=True)
     name = models.CharField(max_length=255, blank=True, help_text="Friendly name for the screener")
     is_active = models.BooleanField(default=True)
+    weight = models.FloatField(default=1.0, help_text="Contribution to the conviction score in weighted and decay scoring")
     created_at = models.DateTimeField(auto_now_add=True)
 
     def __str__(self):
         return self.name or self.url
 
+class ScreenerClauseCache(models.Model):
+    """
+    Last scan_clause captured for a screener, so repeat scans can POST
+    straight to /screener/process without starting a browser.
+    """
+    DEFAULT_TTL_SECONDS = 7 * 24 * 3600
+
+    screener = models.OneToOneField(Screener, on_delete=models.CASCADE, related_name='clause_cache')
+    scan_clause = models.TextField()
+    clause_hash = models.CharField(max_length=64, help_text="SHA-256 of the scan clause")
+    captured_at = models.DateTimeField(default=timezone.now)
+    ttl_seconds = models.IntegerField(default=DEFAULT_TTL_SECONDS, help_text="Seconds before the clause is re-captured")
+
+    def __str__(self):
+        return f"Clause cache for {self.screener}"
+
+    def is_expired(self):
+        return timezone.now() >= self.captured_at + timedelta(seconds=self.ttl_seconds)
+
 class ScanJob(models.Model):
     STATUS_CHOICES = [
         ('PENDING', 'Pending'),
@@ -22,13 +53,113 @@ class ScanJob(models.Model):
     progress = models.IntegerField(default=0, help_text="Progress from 0 to 100")
     started_at = models.DateTimeField(null=True, blank=True)
     completed_at = models.DateTimeField(null=True, blank=True)
-    log = models.TextField(blank=True, help_text="Log output for debugging")
+    log = models.TextField(blank=True, help_text="Full log text, written once the job finishes (see ScanLogEntry)")
+    # Queue (see analyzer.job_queue)
+    dedup_key = models.CharField(max_length=100, default=SCAN_DEDUP_KEY, help_text="Jobs with the same key can't be pending or running at once")
+    worker = models.CharField(max_length=255, blank=True, help_text="Worker holding the lease while the job runs")
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    lease_expires_at = models.DateTimeField(null=True, blank=True, help_text="A running job whose lease has expired is requeued")
+    attempts = models.PositiveIntegerField(default=0, help_text="Times a worker has claimed the job")
+    finalize_attempts = models.PositiveIntegerField(default=0, help_text="Times a worker has claimed finalizing the job")
+    log_seq = models.PositiveIntegerField(default=0, help_text="Last ScanLogEntry.seq handed out; numbers lines from several workers")
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['dedup_key'], condition=models.Q(status__in=['PENDING', 'RUNNING']), name='unique_active_scan_job',
+            ),
+        ]
+        indexes = [
+            # "Most recent completed job" lookups
+            models.Index(fields=['status', 'completed_at'], name='job_status_completed_idx'),
+            models.Index(fields=['status', 'id'], name='job_status_id_idx'), # Job listings filtered by status
+        ]
 
     def __str__(self):
         return f"ScanJob {self.id} - {self.status}"
 
+class ScanTask(models.Model):
+    """
+    One screener of a job. Workers on any machine sharing the database
+    lease these independently; once none is left pending or running, one
+    worker finalizes the job (see analyzer.job_queue).
+    """
+    STATUS_CHOICES = [
+        ('PENDING', 'Pending'),
+        ('RUNNING', 'Running'),
+        ('DONE', 'Done'),
+        ('FAILED', 'Failed'),
+    ]
+
+    job = models.ForeignKey(ScanJob, on_delete=models.CASCADE, related_name='tasks')
+    screener = models.ForeignKey(Screener, on_delete=models.CASCADE, related_name='scan_tasks')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='PENDING')
+    worker = models.CharField(max_length=255, blank=True, help_text="Worker holding the lease while the task runs")
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    lease_expires_at = models.DateTimeField(null=True, blank=True)
+    attempts = models.PositiveIntegerField(default=0, help_text="Times a worker has claimed the task")
+    result_count = models.IntegerField(default=0, help_text="Rows the screener returned")
+    error = models.TextField(blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['job', 'screener'], name='unique_job_screener_task'),
+        ]
+        indexes = [
+            models.Index(fields=['status', 'id'], name='task_status_id_idx'), # Claiming the oldest pending tasks
+            models.Index(fields=['job', 'status'], name='task_job_status_idx'), # "Anything left?" per job
+        ]
+
+    def __str__(self):
+        return f"Job {self.job_id} / {self.screener_id}: {self.status}"
+
+class ScanLogEntry(models.Model):
+    """
+    One line of a job's log. Lines are only ever appended, so readers can
+    fetch everything after the last sequence number they have seen.
+    """
+    job = models.ForeignKey(ScanJob, on_delete=models.CASCADE, related_name='log_entries')
+    seq = models.PositiveIntegerField(help_text="Position of the line within the job's log, starting at 1")
+    EVENT_CHOICES = [
+        ('', 'Log line'),
+        ('screener', 'Screener finished'),
+    ]
+
+    created_at = models.DateTimeField(default=timezone.now)
+    message = models.TextField()
+    event = models.CharField(max_length=20, choices=EVENT_CHOICES, blank=True, default='')
+    data = models.JSONField(null=True, blank=True, help_text="Structured payload for events")
+
+    class Meta:
+        ordering = ['job', 'seq']
+        constraints = [
+            models.UniqueConstraint(fields=['job', 'seq'], name='unique_log_entry_seq'),
+        ]
+
+    def __str__(self):
+        return f"Job {self.job_id} #{self.seq}: {self.message[:50]}"
+
+    @property
+    def line(self):
+        return f"[{timezone.localtime(self.created_at).strftime('%H:%M:%S')}] {self.message}"
+
 class GlobalSettings(models.Model):
-    min_ranking_threshold = models.IntegerField(default=2, help_text="Minimum number of screeners for high conviction")
+    SCORING_CHOICES = [
+        ('count', 'Screener count'),
+        ('weighted', 'Weighted sum'),
+        ('decay', 'Recency-decayed'),
+    ]
+
+    min_ranking_threshold = models.IntegerField(default=2, help_text="Minimum conviction score (screener count by default) for high conviction")
+    scoring_mode = models.CharField(max_length=20, choices=SCORING_CHOICES, default='count')
+    score_decay = models.FloatField(default=0.5, help_text="Share of the previous scan's score carried over in decay scoring")
+    ranking_version = models.PositiveIntegerField(default=0, help_text="Bumped whenever past jobs are re-ranked; keys cached rankings")
+    ranked_at = models.DateTimeField(null=True, blank=True, help_text="When past jobs were last re-ranked")
+    rerank_pending = models.BooleanField(default=False, help_text="Ranking settings changed; a worker re-ranks all past jobs")
+    scan_concurrency = models.IntegerField(default=4, help_text="Number of screeners processed in parallel")
+    http_max_in_flight = models.IntegerField(default=8, help_text="Maximum concurrent /screener/process requests")
+    write_csv_reports = models.BooleanField(default=True, help_text="Write a CSV file to scan_reports/ when a scan completes; downloads stream from the database either way")
     
     class Meta:
         verbose_name_plural = "Global Settings"
@@ -36,24 +167,154 @@ class GlobalSettings(models.Model):
     def __str__(self):
         return "Global Settings"
 
+    def save(self, *args, **kwargs):
+        if self.pk and not self._state.adding:
+            # This copy may come from the cache; keep the version re-ranking has moved on to since
+            current = GlobalSettings.objects.filter(pk=self.pk).values('ranking_version', 'ranked_at', 'rerank_pending').first()
+            if current:
+                self.ranking_version, self.ranked_at = current['ranking_version'], current['ranked_at']
+                self.rerank_pending = current['rerank_pending']
+        super().save(*args, **kwargs)
+        self.clear_cache()
+
     @classmethod
     def get_setting(cls):
-        obj, created = cls.objects.get_or_create(id=1)
+        """
+        The settings row, cached so pages don't query it on every hit.
+        """
+        obj = cache.get(SETTINGS_CACHE_KEY)
+        if obj is None:
+            obj, created = cls.objects.get_or_create(id=1)
+            cache.set(SETTINGS_CACHE_KEY, obj, SETTINGS_CACHE_TIMEOUT)
         return obj
 
+    @classmethod
+    def clear_cache(cls):
+        cache.delete(SETTINGS_CACHE_KEY)
+
+class Instrument(models.Model):
+    """
+    A listed company, stored once and referenced by every result row.
+    `symbol` is the NSE code, or the BSE code for BSE-only listings.
+    """
+    symbol = models.CharField(max_length=50, unique=True)
+    name = models.CharField(max_length=255, blank=True)
+    nse_code = models.CharField(max_length=50, blank=True, null=True)
+    bse_code = models.CharField(max_length=50, blank=True, null=True)
+
+    def __str__(self):
+        return self.symbol
+
 class StockResult(models.Model):
     job = models.ForeignKey(ScanJob, on_delete=models.CASCADE, related_name='results')
     screener = models.ForeignKey(Screener, on_delete=models.CASCADE, related_name='results')
+    instrument = models.ForeignKey(Instrument, on_delete=models.PROTECT, related_name='results')
+    close_price = models.FloatField(null=True, blank=True)
+    volume = models.BigIntegerField(null=True, blank=True)
+    is_high_conviction = models.BooleanField(default=False, help_text="True if the symbol's conviction score in this job, under the scoring mode it was ranked with, meets min_ranking_threshold")
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['job', 'instrument'], name='result_job_instrument_idx'), # Per-job grouping by symbol
+            models.Index(fields=['job', 'screener'], name='result_job_screener_idx'), # Per-screener tabs
+            models.Index(fields=['instrument', 'job'], name='result_instrument_job_idx'), # History of one symbol
+        ]
+    
+    def __str__(self):
+        return f"{self.symbol} - {self.close_price}"
+
+    # Instrument fields, read through the FK (select_related('instrument') when listing)
+    @property
+    def symbol(self):
+        return self.instrument.symbol
+
+    @property
+    def name(self):
+        return self.instrument.name
+
+    @property
+    def nse_code(self):
+        return self.instrument.nse_code
+
+    @property
+    def bse_code(self):
+        return self.instrument.bse_code
+
+class JobSymbolSummary(models.Model):
+    """
+    One row per symbol of a finished job, written once at completion so
+    pages and exports read ready-made counts instead of aggregating
+    StockResult on every request.
+    """
+    job = models.ForeignKey(ScanJob, on_delete=models.CASCADE, related_name='symbol_summaries')
     symbol = models.CharField(max_length=50)
     name = models.CharField(max_length=255, blank=True)
     nse_code = models.CharField(max_length=50, blank=True, null=True)
     bse_code = models.CharField(max_length=50, blank=True, null=True)
+    screener_count = models.IntegerField(default=0, help_text="Number of screeners that returned the symbol")
+    conviction_score = models.FloatField(default=0, help_text="Score under the scoring mode in force when the summary was built")
     close_price = models.FloatField(null=True, blank=True)
     volume = models.BigIntegerField(null=True, blank=True)
-    is_high_conviction = models.BooleanField(default=False, help_text="True if found in multiple screeners in this job")
-    
+    is_high_conviction = models.BooleanField(default=False)
+    rank = models.IntegerField(default=0, help_text="1 = highest conviction score; equal scores share a rank")
+    # Copied from SymbolPersistence when the job completes, so they read as of this job
+    streak = models.PositiveIntegerField(default=0, help_text="Consecutive completed scans the symbol appeared in, ending with this one")
+    longest_streak = models.PositiveIntegerField(default=0)
+    first_seen_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['job', 'rank', 'symbol']
+        constraints = [
+            models.UniqueConstraint(fields=['job', 'symbol'], name='unique_job_symbol_summary'),
+        ]
+        indexes = [
+            # Covers rank-ordered pages filtered by count, so API clients asking for these fields never touch the table
+            models.Index(fields=['job', 'rank', 'symbol', 'screener_count', 'is_high_conviction'], name='summary_job_rank_cover_idx'),
+        ]
+
     def __str__(self):
-        return f"{self.symbol} - {self.close_price}"
+        return f"Job {self.job_id} #{self.rank}: {self.symbol} ({self.screener_count})"
+
+class ScreenerBitmap(models.Model):
+    """
+    The instruments one screener returned in one job, as a bitset over
+    Instrument ids: bit n is set when instrument n was returned. Written
+    at scan completion; see analyzer.bitmaps for the query API.
+    """
+    job = models.ForeignKey(ScanJob, on_delete=models.CASCADE, related_name='bitmaps')
+    screener = models.ForeignKey(Screener, on_delete=models.CASCADE, related_name='bitmaps')
+    bits = models.BinaryField(help_text="Little-endian bitset over Instrument ids")
+    cardinality = models.IntegerField(default=0, help_text="Number of set bits")
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['job', 'screener'], name='unique_job_screener_bitmap'),
+        ]
+
+    def __str__(self):
+        return f"Job {self.job_id} / {self.screener}: {self.cardinality} instruments"
+
+class SymbolPersistence(models.Model):
+    """
+    Running appearance history of one instrument across completed jobs,
+    advanced once per job for the symbols that job returned (see
+    analyzer.persistence). current_streak is only current while
+    last_seen_job is the latest completed job.
+    """
+    instrument = models.OneToOneField(Instrument, on_delete=models.CASCADE, related_name='persistence')
+    first_seen_job = models.ForeignKey(ScanJob, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    first_seen_at = models.DateTimeField()
+    last_seen_job = models.ForeignKey(ScanJob, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    last_seen_at = models.DateTimeField()
+    current_streak = models.PositiveIntegerField(default=1, help_text="Consecutive completed scans ending with last_seen_job")
+    longest_streak = models.PositiveIntegerField(default=1)
+    appearances = models.PositiveIntegerField(default=1, help_text="Completed scans the symbol appeared in")
+
+    class Meta:
+        verbose_name_plural = 'symbol persistence'
+
+    def __str__(self):
+        return f"{self.instrument}: streak {self.current_streak} (longest {self.longest_streak})"
 
 class ScanReport(models.Model):
     job = models.OneToOneField(ScanJob, on_delete=models.CASCADE, related_name='report')
@@ -64,6 +325,9 @@ class ScanReport(models.Model):
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['created_at'], name='report_created_at_idx'),
+        ]
     
     def __str__(self):
         return f"Report for Job {self.job.id} - {self.created_at.strftime('%Y-%m-%d %H:%M')}"
@@ -0,0 +1,131 @@
+"""
+Pairwise overlap between screeners over a window of jobs.
+
+Every (job, symbol) a screener returned is one row of a sparse binary
+matrix X with one column per screener, built from the jobs' bitmaps.
+X.T @ X counts, for every pair of screeners, the rows both returned; its
+diagonal is each screener's own hit count. From that:
+
+    jaccard[a, b]   = shared / (hits[a] + hits[b] - shared)
+    inclusion[a, b] = shared / hits[a]  (share of a's hits b also returned)
+
+A screener whose hits are almost all included in another's adds little
+to a scan but its cost. Membership of finished jobs never changes, so
+results are cached per window of job ids.
+"""
+import hashlib
+
+import numpy as np
+from django.core.cache import cache
+from scipy import sparse
+
+from .bitmaps import load_job_bitmaps, members
+from .models import ScanJob, Screener
+
+CACHE_KEY = 'analyzer:overlap:{}'
+CACHE_TIMEOUT = 24 * 3600
+
+# Pairs at or above either level are reported as redundant
+REDUNDANT_JACCARD = 0.8
+REDUNDANT_INCLUSION = 0.9
+
+
+def window_job_ids(last=20):
+    """
+    Ids of the last `last` completed jobs, newest first.
+    """
+    return list(ScanJob.objects.filter(status='COMPLETED').order_by('-completed_at').values_list('id', flat=True)[:last])
+
+
+def _compute_overlap(job_ids):
+    job_bitmaps = load_job_bitmaps(job_ids)
+    screener_ids = sorted({screener_id for bitmaps in job_bitmaps.values() for screener_id in bitmaps})
+    column_of = {screener_id: column for column, screener_id in enumerate(screener_ids)}
+
+    rows, columns = [], []
+    offset = 0 # Each job gets its own block of rows, one per instrument id
+    for job_id in job_ids:
+        bitmaps = job_bitmaps[job_id]
+        for screener_id, bits in bitmaps.items():
+            instrument_ids = np.array(members(bits), dtype=np.int64)
+            rows.append(instrument_ids + offset)
+            columns.append(np.full(len(instrument_ids), column_of[screener_id], dtype=np.int64))
+        offset += max((bits.bit_length() for bits in bitmaps.values()), default=0)
+
+    rows = np.concatenate(rows) if rows else np.array([], dtype=np.int64)
+    columns = np.concatenate(columns) if columns else np.array([], dtype=np.int64)
+    matrix = sparse.csr_matrix(
+        (np.ones(len(rows), dtype=np.int32), (rows, columns)),
+        shape=(offset, len(screener_ids)),
+    )
+    shared = (matrix.T @ matrix).toarray()
+    hits = np.diag(shared)
+    union = hits[:, None] + hits[None, :] - shared
+    jaccard = np.divide(shared, union, out=np.zeros(shared.shape), where=union > 0)
+    inclusion = np.divide(shared, hits[:, None], out=np.zeros(shared.shape), where=hits[:, None] > 0)
+
+    return {
+        'jobs': job_ids,
+        'screener_ids': screener_ids,
+        'hits': hits.tolist(),
+        'shared': shared.tolist(),
+        'jaccard': np.round(jaccard, 4).tolist(),
+        'inclusion': np.round(inclusion, 4).tolist(),
+    }
+
+
+def screener_overlap(last=20):
+    """
+    Overlap matrices of the screeners that returned anything in the last
+    `last` completed jobs, the pairs that share any hits (most similar
+    first, redundant ones flagged) and the active screeners that returned
+    nothing at all in the window.
+    """
+    job_ids = window_job_ids(last)
+    key = CACHE_KEY.format(hashlib.md5(','.join(map(str, job_ids)).encode()).hexdigest())
+    overlap = cache.get(key)
+    if overlap is None:
+        overlap = _compute_overlap(job_ids)
+        cache.set(key, overlap, CACHE_TIMEOUT)
+
+    screeners = Screener.objects.in_bulk()
+    ids = overlap['screener_ids']
+    pairs = []
+    for a in range(len(ids)):
+        for b in range(a + 1, len(ids)):
+            if not overlap['shared'][a][b]:
+                continue
+            pairs.append({
+                'a': ids[a],
+                'b': ids[b],
+                'a_name': screeners[ids[a]].name if ids[a] in screeners else '',
+                'b_name': screeners[ids[b]].name if ids[b] in screeners else '',
+                'shared': overlap['shared'][a][b],
+                'jaccard': overlap['jaccard'][a][b],
+                'a_in_b': overlap['inclusion'][a][b],
+                'b_in_a': overlap['inclusion'][b][a],
+                'redundant': (
+                    overlap['jaccard'][a][b] >= REDUNDANT_JACCARD
+                    or max(overlap['inclusion'][a][b], overlap['inclusion'][b][a]) >= REDUNDANT_INCLUSION
+                ),
+            })
+    pairs.sort(key=lambda pair: (-pair['jaccard'], -pair['shared']))
+    returned = set(ids)
+
+    return {
+        **overlap,
+        'screeners': [
+            {
+                'id': screener_id,
+                'name': screeners[screener_id].name if screener_id in screeners else '',
+                'url': screeners[screener_id].url if screener_id in screeners else '',
+                'hits': hits,
+            }
+            for screener_id, hits in zip(ids, overlap['hits'])
+        ],
+        'pairs': pairs,
+        'idle': [
+            {'id': screener.id, 'name': screener.name, 'url': screener.url}
+            for screener in screeners.values() if screener.is_active and screener.id not in returned
+        ],
+    }
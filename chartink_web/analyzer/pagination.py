@@ -0,0 +1,80 @@
+"""
+Keyset ("seek") pagination.
+
+Instead of OFFSET, each page ends with an opaque cursor holding the sort
+values of its last row; the next page is the rows that sort after those
+values. Every page costs the same however deep it is, and rows written
+between requests can't shift a page. The last ordering column must be
+unique within the queryset so the order is total.
+"""
+import base64
+import json
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+
+
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values, separators=(',', ':')).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """
+    Sort values from a cursor made by encode_cursor(). Raises ValueError.
+    """
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except (TypeError, ValueError): # binascii, JSON and Unicode errors are ValueErrors
+        raise ValueError("Invalid cursor.")
+    # Only scalars can be compared with a column; anything else is hand-made
+    if not isinstance(values, list) or not all(value is None or isinstance(value, (str, int, float)) for value in values):
+        raise ValueError("Invalid cursor.")
+    return values
+
+
+def page_size(value, default=DEFAULT_PAGE_SIZE):
+    """
+    A ?limit= value clamped to 1..MAX_PAGE_SIZE. Raises ValueError.
+    """
+    if value in (None, ''):
+        return default
+    try:
+        return min(max(1, int(value)), MAX_PAGE_SIZE)
+    except ValueError:
+        raise ValueError("limit must be an integer.")
+
+
+def _after(order, values):
+    # Rows after (v1, v2, ...): f1 past v1, or f1 = v1 and f2 past v2, ...
+    condition = Q()
+    for position, (field, descending) in enumerate(order):
+        step = Q(**{f"{field}__{'lt' if descending else 'gt'}": values[position]})
+        for earlier, (previous, _) in enumerate(order[:position]):
+            step &= Q(**{previous: values[earlier]})
+        condition |= step
+    return condition
+
+
+def keyset_page(queryset, order, after=None, limit=DEFAULT_PAGE_SIZE):
+    """
+    One page of a values() queryset ordered by `order`, a list of (field,
+    descending) pairs whose fields are among the values. Returns the rows
+    and the cursor of the next page (None on the last page).
+    """
+    if after:
+        values = decode_cursor(after)
+        if len(values) != len(order):
+            raise ValueError("Invalid cursor.")
+        try:
+            queryset = queryset.filter(_after(order, values))
+        except (TypeError, ValueError, ValidationError): # A value the column's type can't take
+            raise ValueError("Invalid cursor.")
+    queryset = queryset.order_by(*[f"-{field}" if descending else field for field, descending in order])
+    rows = list(queryset[:limit + 1])
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor([rows[-1][field] for field, _ in order])
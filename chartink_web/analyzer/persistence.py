@@ -0,0 +1,76 @@
+"""
+Streaks and first appearances of symbols across completed jobs.
+
+SymbolPersistence holds each instrument's running history. When a job
+completes, only the instruments it returned are touched: a streak grows
+if the instrument's last appearance was the previous completed job and
+restarts at 1 otherwise. Instruments the job didn't return are left
+alone; their streak is simply no longer current. The job's summary rows
+then get the values as of that job.
+"""
+from django.db import transaction
+from django.db.models import OuterRef, Subquery
+from django.utils import timezone
+
+from .models import JobSymbolSummary, ScanJob, SymbolPersistence
+from .ranking import IncidenceMatrix
+
+PERSISTENCE_BATCH_SIZE = 500
+
+PERSISTENCE_FIELDS = ['last_seen_job', 'last_seen_at', 'current_streak', 'longest_streak', 'appearances']
+
+
+def update_symbol_persistence(job_id, incidence=None):
+    """
+    Advance SymbolPersistence by one job and copy the streaks into the
+    job's JobSymbolSummary rows. Pass the job's IncidenceMatrix if it is
+    already built. Safe to call twice for the same job. Returns the number
+    of symbols whose streak continued.
+    """
+    if incidence is None:
+        incidence = IncidenceMatrix.from_job(job_id)
+    job = ScanJob.objects.get(id=job_id)
+    seen_at = job.completed_at or timezone.now()
+    previous_id = ScanJob.objects.filter(status='COMPLETED').exclude(id=job_id).order_by('-completed_at').values_list('id', flat=True).first()
+
+    instrument_ids = incidence.keys.tolist()
+    existing = {}
+    for start in range(0, len(instrument_ids), PERSISTENCE_BATCH_SIZE):
+        existing.update(SymbolPersistence.objects.in_bulk(instrument_ids[start:start + PERSISTENCE_BATCH_SIZE], field_name='instrument_id'))
+
+    created, updated = [], []
+    continued = 0
+    for instrument_id in instrument_ids:
+        persistence = existing.get(instrument_id)
+        if persistence is None:
+            created.append(SymbolPersistence(
+                instrument_id=instrument_id,
+                first_seen_job_id=job_id,
+                first_seen_at=seen_at,
+                last_seen_job_id=job_id,
+                last_seen_at=seen_at,
+            ))
+            continue
+        if persistence.last_seen_job_id == job_id:
+            continue # Already counted
+        if previous_id is not None and persistence.last_seen_job_id == previous_id:
+            persistence.current_streak += 1
+            continued += 1
+        else:
+            persistence.current_streak = 1
+        persistence.longest_streak = max(persistence.longest_streak, persistence.current_streak)
+        persistence.appearances += 1
+        persistence.last_seen_job_id = job_id
+        persistence.last_seen_at = seen_at
+        updated.append(persistence)
+
+    history = SymbolPersistence.objects.filter(instrument__symbol=OuterRef('symbol'))
+    with transaction.atomic():
+        SymbolPersistence.objects.bulk_create(created, batch_size=PERSISTENCE_BATCH_SIZE)
+        SymbolPersistence.objects.bulk_update(updated, PERSISTENCE_FIELDS, batch_size=PERSISTENCE_BATCH_SIZE)
+        JobSymbolSummary.objects.filter(job_id=job_id).update(
+            streak=Subquery(history.values('current_streak')[:1]),
+            longest_streak=Subquery(history.values('longest_streak')[:1]),
+            first_seen_at=Subquery(history.values('first_seen_at')[:1]),
+        )
+    return continued
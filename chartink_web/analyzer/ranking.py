@@ -0,0 +1,106 @@
+"""
+Conviction ranking on a symbol x screener incidence matrix.
+
+Row i, column j of the matrix counts how often screener j returned
+symbol i. Counts, weighted scores, ranks and threshold sets all come
+from that one sparse matrix with a few array operations, so the scanner,
+the symbol summary and the CLI rank stocks the same way. Django-free;
+IncidenceMatrix.from_job() imports the models when it is called.
+"""
+from collections import namedtuple
+
+import numpy as np
+from scipy import sparse
+
+# Parallel arrays in rank order: best first, equal scores ordered by label
+Ranking = namedtuple('Ranking', ['keys', 'labels', 'counts', 'scores', 'ranks'])
+
+
+class IncidenceMatrix:
+    def __init__(self, keys, labels, screeners, matrix):
+        self.keys = keys # Row identity (symbol, or instrument id for a job)
+        self.labels = labels # Row display name, breaks ties between equal scores
+        self.screeners = screeners # Column identity
+        self.matrix = matrix
+
+    @classmethod
+    def from_pairs(cls, pairs, labels=None):
+        """
+        Build from (row key, screener) pairs, one per result row. `labels`
+        maps row keys to names; by default the keys are their own names.
+        Pairs without a row key (a row with no symbol) are skipped.
+        """
+        pairs = [(key, screener) for key, screener in pairs if key is not None]
+        if not pairs:
+            return cls(np.array([]), np.array([], dtype=str), np.array([]), sparse.csr_matrix((0, 0), dtype=np.int32))
+
+        row_keys, screener_keys = zip(*pairs)
+        keys, rows = np.unique(np.array(row_keys), return_inverse=True)
+        screeners, cols = np.unique(np.array(screener_keys), return_inverse=True)
+        # Duplicate (row, column) entries are summed, so a screener listing a symbol twice counts twice
+        matrix = sparse.csr_matrix(
+            (np.ones(len(pairs), dtype=np.int32), (rows, cols)),
+            shape=(len(keys), len(screeners)),
+        )
+        if labels is None:
+            names = keys.astype(str)
+        else:
+            names = np.array([labels[key] for key in keys.tolist()], dtype=str)
+        return cls(keys, names, screeners, matrix)
+
+    @classmethod
+    def from_job(cls, job_id):
+        """
+        Matrix of a saved job: rows are instrument ids labelled by symbol,
+        columns are screener ids.
+        """
+        from .models import StockResult
+
+        rows = StockResult.objects.filter(job_id=job_id).values_list('instrument_id', 'instrument__symbol', 'screener_id')
+        labels = {}
+        pairs = []
+        for instrument_id, symbol, screener_id in rows.iterator(chunk_size=5000):
+            labels[instrument_id] = symbol
+            pairs.append((instrument_id, screener_id))
+        return cls.from_pairs(pairs, labels)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def counts(self):
+        """
+        Number of screener hits per row.
+        """
+        return np.asarray(self.matrix.sum(axis=1)).ravel()
+
+    def scores(self, weights=None):
+        """
+        Weighted hit count per row; `weights` maps screener -> weight
+        (missing screeners weigh 1). Without weights this is counts().
+        """
+        if not weights:
+            return self.counts().astype(float)
+        vector = np.array([weights.get(screener, 1.0) for screener in self.screeners.tolist()], dtype=float)
+        return self.matrix @ vector
+
+    def ranking(self, weights=None, scores=None):
+        """
+        Rows ordered by score (descending), then label. Equal scores share
+        a rank, so ranks run 1, 1, 3, ...
+        """
+        counts = self.counts()
+        if scores is None:
+            scores = self.scores(weights)
+        order = np.lexsort((self.labels, -scores))
+        ordered = scores[order]
+        # Position of the first row with the same score; -ordered is ascending
+        ranks = np.searchsorted(-ordered, -ordered, side='left') + 1
+        return Ranking(self.keys[order], self.labels[order], counts[order], ordered, ranks)
+
+    def above_threshold(self, threshold, weights=None, scores=None):
+        """
+        Row keys whose score reaches `threshold`.
+        """
+        if scores is None:
+            scores = self.scores(weights)
+        return self.keys[scores >= threshold]
@@ -0,0 +1,107 @@
+"""
+Re-ranking of finished jobs under the current settings.
+
+Conviction flags, scores and ranks are fixed when a job runs. After the
+threshold, scoring mode or screener weights change, rerank_jobs()
+recomputes them for past jobs from their stored results, without
+rescanning: one incidence matrix per job, set-based UPDATEs for the
+flags and a batched in-place update of the symbol summary. Jobs are processed oldest first (so
+decay scoring carries the new scores forward) in chunks, each chunk in
+its own transaction, so the database is never locked for long.
+
+A settings change only re-ranks the latest job while the user waits;
+request_rerank() leaves the rest to a worker (see analyzer.job_queue) or
+the rerank_jobs command.
+"""
+import time
+
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import GlobalSettings, JobSymbolSummary, ScanJob, ScanReport, StockResult
+from .ranking import IncidenceMatrix
+from .services import build_symbol_summary, conviction_scores
+
+
+def rerank_job(job_id, global_settings):
+    """
+    Recompute one job's flags, summary and report counts. Returns the
+    number of high conviction symbols.
+    """
+    incidence = IncidenceMatrix.from_job(job_id)
+    scores = conviction_scores(job_id, incidence, global_settings)
+    threshold = global_settings.min_ranking_threshold
+    high_conviction_ids = incidence.above_threshold(threshold, scores=scores).tolist()
+
+    results = StockResult.objects.filter(job_id=job_id)
+    results.filter(is_high_conviction=True).exclude(instrument_id__in=high_conviction_ids).update(is_high_conviction=False)
+    results.filter(is_high_conviction=False, instrument_id__in=high_conviction_ids).update(is_high_conviction=True)
+
+    if JobSymbolSummary.objects.filter(job_id=job_id).count() == len(incidence):
+        # Same symbols, new numbers: one parameterised UPDATE per row through
+        # executemany, far cheaper than rebuilding the rows through the ORM
+        ranking = incidence.ranking(scores=scores)
+        rows = zip(
+            ranking.scores.tolist(), ranking.ranks.tolist(), (ranking.scores >= threshold).tolist(),
+            [job_id] * len(ranking.keys), ranking.labels.tolist(),
+        )
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f"UPDATE {JobSymbolSummary._meta.db_table} SET conviction_score = %s, rank = %s, is_high_conviction = %s "
+                "WHERE job_id = %s AND symbol = %s",
+                list(rows),
+            )
+    else:
+        build_symbol_summary(job_id, incidence, scores)
+    ScanReport.objects.filter(job_id=job_id).update(high_conviction_count=len(high_conviction_ids))
+    return len(high_conviction_ids)
+
+
+def request_rerank():
+    """
+    Mark every past job as due for re-ranking under the current settings.
+    """
+    GlobalSettings.objects.update(rerank_pending=True)
+
+
+def claim_rerank():
+    """
+    True for the one caller that takes a pending re-rank request.
+    """
+    pending = GlobalSettings.objects.filter(rerank_pending=True)
+    return pending.exists() and bool(pending.update(rerank_pending=False)) # Reads first, like requeue_orphans()
+
+
+def rerank_jobs(job_ids=None, chunk_size=25, progress=None):
+    """
+    Re-rank the given completed jobs (all of them by default). Calls
+    progress(done, total) after every chunk. Returns a dict with the
+    number of jobs, high conviction symbols and seconds taken.
+    """
+    started = time.monotonic()
+    jobs = ScanJob.objects.filter(status='COMPLETED')
+    if job_ids is not None:
+        jobs = jobs.filter(id__in=job_ids)
+    else:
+        claim_rerank() # A full re-rank answers any request made so far
+    global_settings = GlobalSettings.get_setting()
+    ids = list(jobs.order_by('id').values_list('id', flat=True))
+
+    high_conviction = 0
+    for start in range(0, len(ids), chunk_size):
+        with transaction.atomic():
+            for job_id in ids[start:start + chunk_size]:
+                high_conviction += rerank_job(job_id, global_settings)
+        if progress:
+            progress(min(start + chunk_size, len(ids)), len(ids))
+
+    # Rankings cached under the old version (scan diffs, pages of finished jobs) are now stale
+    GlobalSettings.objects.filter(id=global_settings.id).update(ranking_version=F('ranking_version') + 1, ranked_at=timezone.now())
+    GlobalSettings.clear_cache()
+
+    return {
+        'jobs': len(ids),
+        'high_conviction': high_conviction,
+        'seconds': round(time.monotonic() - started, 3),
+    }
@@ -1,328 +1,470 @@
-import json
-import time
+import numpy as np
 import requests
+import threading
 import traceback
-import csv
 import os
-from datetime import datetime, timedelta
 from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from django.db import connection, transaction
+from django.db.models import Max
 from django.utils import timezone
 from django.conf import settings
-from .models import Screener, ScanJob, StockResult, ScanReport
+from .models import Screener, ScanJob, StockResult, ScanReport, ScreenerClauseCache, GlobalSettings, JobSymbolSummary, Instrument
+from .chartink_client import (
+    DEFAULT_HEADERS, capture_scan_clause, clause_hash, copy_driver_cookies,
+    decode_scan_clause, fetch_csrf_token, fetch_scan_clause, post_scan_clause,
+)
+from .browser_pool import get_pool
+from .job_state import LiveJobState
+from .instruments import InstrumentCache
+from .ranking import IncidenceMatrix
+from .bitmaps import build_screener_bitmaps
+from .persistence import update_symbol_persistence
+from .diff import diff_jobs
+from .caching import job_finished
+from .exports import export_chunks
+from .http_engine import AsyncScanEngine, ProcessRequest
 
-# Selenium Imports
-from selenium import webdriver
-from selenium.webdriver.chrome.service import Service
-from selenium.webdriver.chrome.options import Options
-from webdriver_manager.chrome import ChromeDriverManager
-from selenium.webdriver.common.by import By
+# Rows per INSERT; keeps well under SQLite's 32766 bound-parameter limit
+RESULT_BATCH_SIZE = 500
 
 class ChartinkScanner:
-    def __init__(self, job_id):
+    def __init__(self, job_id, shared=False):
         self.job_id = job_id
         self.job = ScanJob.objects.get(id=job_id)
-        self.session = requests.Session()
-        self.requests_headers = {
-            'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-             'X-Requested-With': 'XMLHttpRequest',
-        }
+        self.requests_headers = DEFAULT_HEADERS.copy()
+        self._local = threading.local()
+        # shared: other workers log to this job too (per-screener tasks)
+        self.state = LiveJobState(self.job, shared=shared)
+        self.instruments = InstrumentCache()
+        self.pool_stats = Counter() # Browser pool checkouts of the current batch
+        # Called before the job turns terminal; raises to leave it alone
+        self.before_finish = None
+
+    def _thread_state(self):
+        # One session (and CSRF token) per worker thread: a token is only
+        # valid together with the cookies it was issued with.
+        state = self._local
+        if not hasattr(state, 'session'):
+            state.session = requests.Session()
+            state.csrf_token = None
+        return state
 
-    def log(self, message):
-        timestamp = datetime.now().strftime("%H:%M:%S")
-        self.job.log += f"[{timestamp}] {message}\n"
-        self.job.save(update_fields=['log'])
+    @property
+    def session(self):
+        return self._thread_state().session
+
+    @property
+    def csrf_token(self):
+        return self._thread_state().csrf_token
+
+    @csrf_token.setter
+    def csrf_token(self, value):
+        self._thread_state().csrf_token = value
+
+    def log(self, message, event='', data=None):
+        self.state.log(message, event=event, data=data)
         print(f"[Job {self.job_id}] {message}")
 
     def update_progress(self, progress):
-        self.job.progress = progress
-        self.job.save(update_fields=['progress'])
+        # In memory only; the job state registry writes it behind to the DB
+        self.state.set_progress(progress)
 
-    def run(self):
-        try:
-            self.job.status = 'RUNNING'
-            self.job.started_at = timezone.now()
-            self.job.save()
-            self.log("Starting scan job...")
+    def scan_screeners(self, screeners, concurrency, global_settings, on_result=None):
+        """
+        Scan and save the given screeners, `concurrency` at a time. Calls
+        on_result(screener, count, error) as each one is saved (error is
+        None on success) instead of advancing progress itself.
+        """
+        # The pool is shared with other batches in this process; count only this one's checkouts
+        self.pool_stats = Counter()
 
-            screeners = Screener.objects.filter(is_active=True)
-            total_screeners = screeners.count()
-            
-            if total_screeners == 0:
-                self.log("No active screeners found.")
-                self.job.status = 'COMPLETED'
-                self.job.completed_at = timezone.now()
-                self.job.progress = 100
-                self.job.save()
-                return
-
-            self.log(f"Found {total_screeners} active screeners.")
-            
-            all_results = [] # To verify high conviction later
-            
-            for index, screener in enumerate(screeners):
-                progress = int((index / total_screeners) * 90) # 0 to 90% for scanning
-                self.update_progress(progress)
-                
-                self.log(f"Processing: {screener.name} ({screener.url})")
+        # Known clauses go out together; only the rest need extraction
+        prefetched = self.post_cached_clauses(screeners, global_settings.http_max_in_flight)
+        
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            futures = [
+                None if screener.id in prefetched else executor.submit(self.scan_screener, screener)
+                for screener in screeners
+            ]
+
+            # Consume in submission order so rows are written exactly as in a serial run
+            for index, (screener, future) in enumerate(zip(screeners, futures)):
                 try:
-                    stocks = self.process_screener(screener.url)
-                    self.log(f"  > Found {len(stocks)} stocks.")
-                    
-                    for stock in stocks:
-                        symbol = stock.get('nsecode', stock.get('bsecode', 'Unknown'))
-                        # Normalize symbol
-                        if not symbol: continue
-                        
-                        result = StockResult(
-                            job=self.job,
-                            screener=screener,
-                            symbol=symbol,
-                            name=stock.get('name', ''),
-                            nse_code=stock.get('nsecode'),
-                            bse_code=stock.get('bsecode'),
-                            close_price=stock.get('close'),
-                            volume=stock.get('volume')
-                        )
-                        result.save()
-                        all_results.append(symbol)
+                    stocks = prefetched[screener.id] if future is None else future.result()
+                    symbols = self.save_results(screener, stocks, on_saved=on_result)
+                    self.log(f"  > {screener.name}: found {len(stocks)} stocks.", event='screener', data={
+                        'screener_id': screener.id, 'name': screener.name, 'ok': True, 'count': len(symbols),
+                    })
                         
                 except Exception as e:
-                    self.log(f"Error processing {screener.url}: {e}")
+                    self.log(f"Error processing {screener.url}: {e}", event='screener', data={
+                        'screener_id': screener.id, 'name': screener.name, 'ok': False, 'error': str(e),
+                    })
+                    if on_result:
+                        on_result(screener, 0, e)
                     # Continue to next screener
-            
-            # High Conviction Logic
-            self.log("Calculating high conviction stocks...")
-            self.update_progress(95)
-            
-            from .models import GlobalSettings
-            settings = GlobalSettings.get_setting()
-            threshold = settings.min_ranking_threshold
-            
-            stock_counts = Counter(all_results)
-            high_conviction_symbols = [symbol for symbol, count in stock_counts.items() if count >= threshold]
-            
-            if high_conviction_symbols:
-                StockResult.objects.filter(job=self.job, symbol__in=high_conviction_symbols).update(is_high_conviction=True)
-                self.log(f"Identified {len(high_conviction_symbols)} high conviction stocks (Threshold: {threshold}).")
-            
-            # Export to CSV
-            self.log("Exporting results to CSV...")
-            self.update_progress(98)
-            csv_path = self.export_to_csv()
-            if csv_path:
-                self.log(f"CSV report saved: {csv_path}")
-            
-            self.job.status = 'COMPLETED'
-            self.job.completed_at = timezone.now()
-            self.job.progress = 100
-            self.job.save()
-            self.log("Scan completed successfully.")
 
-        except Exception as e:
-            self.log(f"Critical Job Error: {str(e)}")
-            self.log(traceback.format_exc())
-            self.job.status = 'FAILED'
-            self.job.completed_at = timezone.now()
-            self.job.save()
+                if not on_result:
+                    progress = int(((index + 1) / len(screeners)) * 90) # 0 to 90% for scanning
+                    self.update_progress(progress)
+
+        stats = self.pool_stats
+        self.log(f"Browser pool: {stats['hits']} hits, {stats['misses']} misses, {stats['recycled']} recycled.")
+
+    def complete(self, global_settings):
+        """
+        Rank the saved results, build the summaries and report, and mark
+        the job COMPLETED.
+        """
+        # High Conviction Logic
+        self.log("Calculating high conviction stocks...")
+        self.update_progress(95)
+        
+        threshold = global_settings.min_ranking_threshold
+        
+        incidence = IncidenceMatrix.from_job(self.job_id)
+        scores = conviction_scores(self.job_id, incidence, global_settings)
+        high_conviction_ids = incidence.above_threshold(threshold, scores=scores).tolist()
+        
+        if high_conviction_ids:
+            StockResult.objects.filter(job=self.job, instrument_id__in=high_conviction_ids).update(is_high_conviction=True)
+            self.log(f"Identified {len(high_conviction_ids)} high conviction stocks (Threshold: {threshold}, scoring: {global_settings.scoring_mode}).")
+        
+        self.log("Building symbol summary...")
+        build_symbol_summary(self.job_id, incidence, scores)
+        build_screener_bitmaps(self.job_id, incidence)
+
+        self.log("Updating symbol streaks...")
+        continued = update_symbol_persistence(self.job_id, incidence)
+        self.log(f"{continued} of {len(incidence)} symbols continue a streak from the previous scan.")
+
+        # Export to CSV
+        self.log("Exporting results to CSV..." if global_settings.write_csv_reports else "Recording scan report...")
+        self.update_progress(98)
+        ScanReport.objects.filter(job=self.job).delete() # From an interrupted earlier attempt
+        csv_path = self.export_to_csv(write_file=global_settings.write_csv_reports)
+        if csv_path:
+            self.log(f"CSV report saved: {csv_path}")
+        
+        self.log("Scan completed successfully.")
+        self.finish('COMPLETED')
 
-    def process_screener(self, url):
+    def fail(self, error):
         """
-        Process a single screener URL with a fresh driver instance.
+        Log a job-level error and mark the job FAILED, keeping whatever
+        was saved viewable.
         """
-        driver = None
+        self.log(f"Critical Job Error: {str(error)}")
+        self.log(traceback.format_exc())
         try:
-            # Setup Headless Chrome
-            chrome_options = Options()
-            chrome_options.add_argument("--headless=new") 
-            chrome_options.add_argument("--no-sandbox")
-            chrome_options.add_argument("--disable-dev-shm-usage")
-            chrome_options.add_argument("--page-load-strategy=eager")
-            chrome_options.add_argument("user-agent=Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36")
-            
-            driver = webdriver.Chrome(service=Service(ChromeDriverManager().install()), options=chrome_options)
-            driver.set_page_load_timeout(60)
-
-            # 1. Enable interception BEFORE navigation using CDP
-            interceptor_script = """
-            window._captured_scan_clause = null;
-            const oldOpen = XMLHttpRequest.prototype.open;
-            const oldSend = XMLHttpRequest.prototype.send;
-            
-            XMLHttpRequest.prototype.open = function(method, url) {
-                this._method = method;
-                this._url = url;
-                return oldOpen.apply(this, arguments);
-            };
-            
-            XMLHttpRequest.prototype.send = function(body) {
-                if (this._method === 'POST' && this._url.includes('/screener/process')) {
-                    window._captured_scan_clause = body;
-                }
-                return oldSend.apply(this, arguments);
-            };
-            """
-            
-            driver.execute_cdp_cmd('Page.addScriptToEvaluateOnNewDocument', {
-                'source': interceptor_script
-            })
+            build_symbol_summary(self.job_id)
+            build_screener_bitmaps(self.job_id)
+        except Exception:
+            pass
+        self.finish('FAILED')
 
-            # 2. Navigate
-            driver.get(url)
+    def finish(self, status):
+        """
+        Move the job to a terminal state. The log is persisted first, so anyone
+        who observes the terminal status can already read every line.
+        """
+        if self.before_finish:
+            self.before_finish()
+        self.state.finish(status)
+        job_finished(self.job_id)
 
-            # 3. Wait for capture (Auto-run)
-            scan_clause_raw = None
-            csrf_token = None
-            
-            for i in range(10): 
-                try:
-                    scan_clause_raw = driver.execute_script("return window._captured_scan_clause;")
-                    if scan_clause_raw:
-                        break
-                except:
-                    pass
-                time.sleep(0.5)
-
-            # 4. Fallback: Find and Click 'Run Scan'
-            if not scan_clause_raw:
-                try:
-                    run_button = None
-                    xpath_locators = [
-                        "//button[contains(text(), 'Run Scan')]",
-                        "//input[@value='Run Scan']",
-                        "//button[contains(@class, 'btn-primary')]",
-                    ]
-                    
-                    for xpath in xpath_locators:
-                        try:
-                            element = driver.find_element(By.XPATH, xpath)
-                            if element.is_displayed():
-                                run_button = element
-                                break
-                        except:
-                            continue
-
-                    if run_button:
-                        driver.execute_script("arguments[0].scrollIntoView(true);", run_button)
-                        time.sleep(0.5)
-                        try:
-                            run_button.click()
-                        except:
-                            driver.execute_script("arguments[0].click();", run_button)
-                        
-                        for i in range(10):
-                            scan_clause_raw = driver.execute_script("return window._captured_scan_clause;")
-                            if scan_clause_raw:
-                                break
-                            time.sleep(0.5)
-                except:
-                    pass
-
-            # 5. Get CSRF Token
+    def build_results(self, screener, stocks):
+        """
+        Unsaved StockResult rows for one screener's response.
+        """
+        rows = []
+        listings = {}
+        for stock in stocks:
+            symbol = stock.get('nsecode', stock.get('bsecode', 'Unknown'))
+            # Normalize symbol
+            if not symbol: continue
+
+            rows.append((symbol, stock))
+            listings.setdefault(symbol, (stock.get('name', ''), stock.get('nsecode'), stock.get('bsecode')))
+
+        instruments = self.instruments.resolve(listings)
+        return [
+            StockResult(
+                job=self.job,
+                screener=screener,
+                instrument=instruments[symbol],
+                close_price=stock.get('close'),
+                volume=stock.get('volume')
+            )
+            for symbol, stock in rows
+        ]
+
+    def save_results(self, screener, stocks, on_saved=None):
+        """
+        Write one screener's rows with batched INSERTs in a single transaction,
+        calling on_saved(screener, count, None) inside it so a task can be
+        marked done atomically with its rows. Returns the saved symbols.
+        """
+        results = self.build_results(screener, stocks)
+        with transaction.atomic():
+            StockResult.objects.bulk_create(results, batch_size=RESULT_BATCH_SIZE)
+            if on_saved:
+                on_saved(screener, len(results), None)
+        return [result.symbol for result in results]
+
+    def scan_screener(self, screener):
+        """
+        Worker-thread entry point; failures propagate to this screener's future only.
+        """
+        self.log(f"Processing: {screener.name} ({screener.url})")
+        try:
+            # run() already tried the cached clause through the async engine
+            return self.process_screener(screener, use_cache=False)
+        finally:
+            connection.close()
+
+    def post_cached_clauses(self, screeners, max_in_flight):
+        """
+        POST every unexpired cached scan_clause concurrently through the
+        async engine. Returns {screener_id: stocks} for the ones that worked.
+        """
+        caches = {
+            cache.screener_id: cache
+            for cache in ScreenerClauseCache.objects.filter(screener__in=screeners)
+            if not cache.is_expired()
+        }
+        cached_screeners = [screener for screener in screeners if screener.id in caches]
+        if not cached_screeners:
+            return {}
+
+        try:
+            csrf_token = self.get_csrf_token(cached_screeners[0].url)
+        except Exception as e:
+            self.log(f"Could not fetch CSRF token for cached clauses: {e}")
+            return {}
+
+        cookies = self.session.cookies.get_dict()
+        engine = AsyncScanEngine(max_in_flight=max_in_flight, headers=self.requests_headers)
+        results = engine.run([
+            ProcessRequest(screener.id, caches[screener.id].scan_clause, csrf_token, cookies)
+            for screener in cached_screeners
+        ])
+
+        served = {}
+        for screener in cached_screeners:
+            result = results[screener.id]
+            if isinstance(result, Exception):
+                self.log(f"  > {screener.name}: cached scan_clause failed ({result}), re-extracting.")
+            else:
+                self.log(f"  > {screener.name}: served from scan_clause cache.")
+                served[screener.id] = result
+        self.log(f"Served {len(served)}/{len(screeners)} screeners from cached clauses.")
+        return served
+
+    def process_screener(self, screener, use_cache=True):
+        """
+        Process a single screener. A cached scan_clause is POSTed directly;
+        otherwise the clause is extracted by the cheapest tier that works:
+        tier 1 parses the page HTML, tier 2 intercepts it in a browser.
+        """
+        cached = ScreenerClauseCache.objects.filter(screener=screener).first() if use_cache else None
+        if cached and not cached.is_expired():
             try:
-                csrf_element = driver.find_element(By.CSS_SELECTOR, "meta[name='csrf-token']")
-                csrf_token = csrf_element.get_attribute("content")
-            except:
-                pass
-
-            # 6. Process captured data
-            stocks = []
-            if scan_clause_raw and csrf_token:
-                import urllib.parse
-                decoded = urllib.parse.unquote(scan_clause_raw)
-                
-                final_scan_clause = None
-                try:
-                    json_data = json.loads(decoded)
-                    if isinstance(json_data, dict) and 'scan_clause' in json_data:
-                        final_scan_clause = json_data['scan_clause']
-                except json.JSONDecodeError:
-                    pass
-                
-                if not final_scan_clause:
-                    if decoded.startswith('scan_clause='):
-                        final_scan_clause = decoded.replace('scan_clause=', '', 1)
-                    else:
-                        final_scan_clause = decoded
-
-                # Fetch data using requests
-                selenium_cookies = driver.get_cookies()
-                for cookie in selenium_cookies:
-                    self.session.cookies.set(cookie['name'], cookie['value'])
-
-                payload = {'scan_clause': final_scan_clause}
-                post_headers = self.requests_headers.copy()
-                post_headers.update({'X-Csrf-Token': csrf_token})
-
-                process_url = 'https://chartink.com/screener/process'
-                r = self.session.post(process_url, data=payload, headers=post_headers)
-                r.raise_for_status()
-                data = r.json()
-                stocks = data.get('data', [])
+                stocks = post_scan_clause(self.session, cached.scan_clause, self.get_csrf_token(screener.url), self.requests_headers)
+                self.log(f"  > {screener.name}: served from scan_clause cache.")
+                return stocks
+            except Exception as e:
+                self.log(f"  > {screener.name}: cached scan_clause failed ({e}), re-extracting.")
+                self.csrf_token = None
 
+        tiers = [
+            (1, 'HTTP', self.extract_with_http),
+            (2, 'browser', self.capture_with_browser),
+        ]
+        for tier, label, extract in tiers:
+            try:
+                scan_clause, csrf_token = extract(screener.url)
+                if not (scan_clause and csrf_token):
+                    self.log(f"  > {screener.name}: tier {tier} ({label}) found no scan_clause.")
+                    continue
+                stocks = post_scan_clause(self.session, scan_clause, csrf_token, self.requests_headers)
+            except Exception as e:
+                if tier == len(tiers):
+                    raise
+                self.log(f"  > {screener.name}: tier {tier} ({label}) failed: {e}")
+                self.csrf_token = None
+                continue
+
+            ScreenerClauseCache.objects.update_or_create(
+                screener=screener,
+                defaults={
+                    'scan_clause': scan_clause,
+                    'clause_hash': clause_hash(scan_clause),
+                    'captured_at': timezone.now(),
+                }
+            )
+            self.log(f"  > {screener.name}: served by tier {tier} ({label}).")
             return stocks
 
-        except Exception as e:
-            raise e
-        finally:
-            if driver:
-                driver.quit()
+        return []
+
+    def extract_with_http(self, url):
+        """
+        Tier 1: read the scan_clause and CSRF token from the page HTML.
+        """
+        scan_clause, csrf_token = fetch_scan_clause(self.session, url, self.requests_headers)
+        if csrf_token:
+            self.csrf_token = csrf_token
+        return scan_clause, csrf_token
+
+    def get_csrf_token(self, url):
+        """
+        CSRF token for this scanner's session, fetched once with a plain GET.
+        """
+        if not self.csrf_token:
+            self.csrf_token = fetch_csrf_token(self.session, url, self.requests_headers)
+        return self.csrf_token
+
+    def capture_with_browser(self, url):
+        """
+        Tier 2: capture the scan_clause with a warm Chrome from the shared pool.
+        Returns (scan_clause, csrf_token) and leaves the browser cookies in self.session.
+        """
+        with get_pool().checkout(stats=self.pool_stats) as driver:
+            scan_clause_raw, csrf_token = capture_scan_clause(driver, url)
+            if not (scan_clause_raw and csrf_token):
+                return None, None
+
+            copy_driver_cookies(driver, self.session)
+            self.csrf_token = csrf_token
+            return decode_scan_clause(scan_clause_raw), csrf_token
     
-    def export_to_csv(self):
+    def export_to_csv(self, write_file=True):
         """
-        Export scan results to CSV file with timestamp.
-        Returns the file path if successful, None otherwise.
+        Export scan results to CSV file with timestamp and record the
+        ScanReport. With write_file=False only the report is recorded;
+        the CSV is then streamed from the database on download.
+        Returns the file path if a file was written, None otherwise.
         """
         try:
-            # Create scan_reports directory if it doesn't exist
-            base_dir = settings.BASE_DIR.parent if hasattr(settings.BASE_DIR, 'parent') else os.path.dirname(settings.BASE_DIR)
-            reports_dir = os.path.join(base_dir, 'scan_reports')
-            os.makedirs(reports_dir, exist_ok=True)
-            
-            # Generate filename with timestamp
-            timestamp = datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
-            filename = f'scan_report_{timestamp}.csv'
-            filepath = os.path.join(reports_dir, filename)
-            
-            # Get all results with screener counts
-            from django.db.models import Count
-            results = StockResult.objects.filter(job=self.job).values(
-                'symbol', 'name', 'nse_code', 'bse_code', 'close_price', 'volume', 'is_high_conviction'
-            ).annotate(screener_count=Count('screener')).order_by('-screener_count', 'symbol')
-            
-            # Write to CSV
-            with open(filepath, 'w', newline='', encoding='utf-8') as csvfile:
-                fieldnames = ['Symbol', 'Name', 'NSE Code', 'BSE Code', 'Close Price', 'Volume', 'Screener Count', 'High Conviction']
-                writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
+            filepath = ''
+            if write_file:
+                # Create scan_reports directory if it doesn't exist
+                base_dir = settings.BASE_DIR.parent if hasattr(settings.BASE_DIR, 'parent') else os.path.dirname(settings.BASE_DIR)
+                reports_dir = os.path.join(base_dir, 'scan_reports')
+                os.makedirs(reports_dir, exist_ok=True)
                 
-                writer.writeheader()
-                for result in results:
-                    writer.writerow({
-                        'Symbol': result['symbol'],
-                        'Name': result['name'],
-                        'NSE Code': result['nse_code'] or '',
-                        'BSE Code': result['bse_code'] or '',
-                        'Close Price': result['close_price'] or '',
-                        'Volume': result['volume'] or '',
-                        'Screener Count': result['screener_count'],
-                        'High Conviction': 'Yes' if result['is_high_conviction'] else 'No'
-                    })
+                # Generate filename with timestamp
+                timestamp = datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
+                filename = f'scan_report_{timestamp}.csv'
+                filepath = os.path.join(reports_dir, filename)
+                
+                # Same rows and columns as the on-demand export
+                with open(filepath, 'wb') as csvfile:
+                    for chunk in export_chunks(self.job_id, 'csv'):
+                        csvfile.write(chunk)
             
             # Save report metadata
-            high_conviction_count = results.filter(is_high_conviction=True).values('symbol').distinct().count()
+            results = JobSymbolSummary.objects.filter(job=self.job)
             ScanReport.objects.create(
                 job=self.job,
                 csv_file_path=filepath,
-                total_stocks=results.values('symbol').distinct().count(),
-                high_conviction_count=high_conviction_count
+                total_stocks=results.count(),
+                high_conviction_count=results.filter(is_high_conviction=True).count()
             )
             
-            return filepath
+            return filepath or None
             
         except Exception as e:
             self.log(f"Error exporting to CSV: {str(e)}")
             return None
 
 
+def conviction_scores(job_id, incidence, global_settings):
+    """
+    Conviction score of every row of a job's IncidenceMatrix under the
+    configured scoring mode:
+      count    - number of screeners
+      weighted - sum of the screeners' weights
+      decay    - weighted sum plus score_decay x the symbol's score in the
+                 previous completed job (an exponentially weighted history)
+    """
+    mode = global_settings.scoring_mode
+    if mode == 'count':
+        return incidence.scores()
+
+    weights = dict(Screener.objects.filter(id__in=incidence.screeners.tolist()).values_list('id', 'weight'))
+    scores = incidence.scores(weights)
+    if mode == 'decay':
+        previous_job = ScanJob.objects.filter(status='COMPLETED', id__lt=job_id).order_by('-id').first()
+        if previous_job:
+            previous = dict(JobSymbolSummary.objects.filter(job=previous_job).values_list('symbol', 'conviction_score'))
+            carried = np.array([previous.get(symbol, 0.0) for symbol in incidence.labels.tolist()], dtype=float)
+            scores = scores + global_settings.score_decay * carried
+    return scores
+
+
+def build_symbol_summary(job_id, incidence=None, scores=None):
+    """
+    (Re)write the JobSymbolSummary rows of a job from its StockResults:
+    one row per symbol with its screener count, conviction score and
+    rank. Pass the job's IncidenceMatrix and scores if they are already
+    computed. Returns the number of symbols.
+    """
+    if incidence is None:
+        incidence = IncidenceMatrix.from_job(job_id)
+    if scores is None:
+        scores = conviction_scores(job_id, incidence, GlobalSettings.get_setting())
+    ranking = incidence.ranking(scores=scores)
+    instrument_ids = ranking.keys.tolist()
+    instruments = Instrument.objects.in_bulk(instrument_ids)
+    quotes = {
+        row['instrument_id']: row
+        for row in StockResult.objects.filter(job_id=job_id).values('instrument_id').annotate(
+            stock_close_price=Max('close_price'),
+            stock_volume=Max('volume'),
+            high_conviction=Max('is_high_conviction'),
+        ).order_by()
+    }
+
+    # Streaks are copied in once, when the job completes (see persistence); keep them across rebuilds
+    streaks = {
+        symbol: (streak, longest_streak, first_seen_at)
+        for symbol, streak, longest_streak, first_seen_at in JobSymbolSummary.objects.filter(job_id=job_id).values_list(
+            'symbol', 'streak', 'longest_streak', 'first_seen_at'
+        )
+    }
+
+    summaries = []
+    for instrument_id, count, score, rank in zip(instrument_ids, ranking.counts.tolist(), ranking.scores.tolist(), ranking.ranks.tolist()):
+        instrument = instruments[instrument_id]
+        quote = quotes[instrument_id]
+        streak, longest_streak, first_seen_at = streaks.get(instrument.symbol, (0, 0, None))
+        summaries.append(JobSymbolSummary(
+            job_id=job_id,
+            symbol=instrument.symbol,
+            name=instrument.name,
+            nse_code=instrument.nse_code,
+            bse_code=instrument.bse_code,
+            screener_count=count,
+            conviction_score=score,
+            close_price=quote['stock_close_price'],
+            volume=quote['stock_volume'],
+            is_high_conviction=bool(quote['high_conviction']),
+            rank=rank,
+            streak=streak,
+            longest_streak=longest_streak,
+            first_seen_at=first_seen_at,
+        ))
+
+    with transaction.atomic():
+        JobSymbolSummary.objects.filter(job_id=job_id).delete()
+        JobSymbolSummary.objects.bulk_create(summaries, batch_size=RESULT_BATCH_SIZE)
+    return len(summaries)
+
+
 def find_new_stocks(latest_job_id):
     """
     Compare the latest scan with a scan from approximately one week ago (6+ days).
@@ -330,7 +472,7 @@ def find_new_stocks(latest_job_id):
     """
     try:
         # Get the latest job's report
-        latest_report = ScanReport.objects.filter(job_id=latest_job_id).first()
+        latest_report = ScanReport.objects.filter(job_id=latest_job_id).select_related('job').first()
         if not latest_report:
             return None, "No report found for the latest scan."
         
@@ -338,43 +480,21 @@ def find_new_stocks(latest_job_id):
         week_ago = timezone.now() - timedelta(days=6)
         old_report = ScanReport.objects.filter(
             created_at__lte=week_ago
-        ).order_by('-created_at').first()
+        ).select_related('job').order_by('-created_at').first()
         
         if not old_report:
             return None, "No scan data from 6+ days ago found."
         
-        # Get symbols from latest scan
-        latest_symbols = set(
-            StockResult.objects.filter(job_id=latest_job_id).values_list('symbol', flat=True).distinct()
-        )
-        
-        # Get symbols from week-old scan
-        old_symbols = set(
-            StockResult.objects.filter(job_id=old_report.job_id).values_list('symbol', flat=True).distinct()
-        )
-        
-        # Find new symbols
-        new_symbols = latest_symbols - old_symbols
-        
-        # Get full details for new symbols from latest scan
-        from django.db.models import Count, Max
-        new_stocks = StockResult.objects.filter(
-            job_id=latest_job_id,
-            symbol__in=new_symbols
-        ).values('symbol', 'name', 'nse_code', 'bse_code').annotate(
-            screener_count=Count('screener'),
-            close_price=Max('close_price'),
-            volume=Max('volume'),
-            is_high_conviction=Max('is_high_conviction')
-        ).order_by('-screener_count', 'symbol')
+        # Added symbols of the diff are the new ones
+        diff = diff_jobs(latest_report.job, old_report.job)
         
         return {
-            'new_stocks': list(new_stocks),
+            'new_stocks': diff['added'],
             'latest_scan_date': latest_report.created_at,
             'comparison_scan_date': old_report.created_at,
-            'new_count': len(new_symbols),
-            'latest_total': len(latest_symbols),
-            'old_total': len(old_symbols)
+            'new_count': len(diff['added']),
+            'latest_total': diff['new_total'],
+            'old_total': diff['old_total']
         }, None
         
     except Exception as e:
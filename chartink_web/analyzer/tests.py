@@ -1,3 +1,1355 @@
-from django.test import TestCase
+import asyncio
+import csv
+import gzip
+import importlib.util
+import io
+import json
+import os
+import tempfile
+import time
+from collections import Counter
+from datetime import timedelta
+from unittest import IsolatedAsyncioTestCase, skipUnless
+from unittest.mock import patch
 
-# Create your tests here.
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from bs4 import BeautifulSoup
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, OperationalError, connection, transaction
+from django.db.models import Count, Max
+from django.test import SimpleTestCase, TestCase
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from .models import (
+    GlobalSettings, Instrument, JobSymbolSummary, ScanJob, ScanLogEntry, ScanReport, ScanTask, Screener, ScreenerClauseCache,
+    StockResult, SymbolPersistence,
+)
+from .bitmaps import parse_expression, run_query
+from .browser_pool import BrowserPool, get_pool
+from .checks import check_shared_cache
+from .chartink_client import clause_hash, extract_scan_clause, fetch_scan_clause, post_scan_clause
+from .diff import diff_jobs
+from .exports import DEFAULT_COLUMNS, EXPORT_COLUMNS
+from .http_engine import AsyncScanEngine, ProcessRequest
+from .job_queue import (
+    MAX_ATTEMPTS, Worker, claim_finalization, claim_job, claim_tasks, enqueue_scan, finalize_job, heartbeat, heartbeat_tasks, plan_job,
+    requeue_orphans, worker_name,
+)
+from .job_state import CACHE_KEY, LiveJobState
+from .overlap import screener_overlap
+from .pagination import encode_cursor
+from .persistence import update_symbol_persistence
+from .ranking import IncidenceMatrix
+from .rerank import rerank_jobs
+from .services import ChartinkScanner, build_screener_bitmaps, build_symbol_summary
+
+
+# The server's cache is shared with its workers; tests use their own
+TEST_CACHE_SETTINGS = override_settings(
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}, ANALYZER_JOB_STATE_CACHE=None,
+)
+
+
+class AnalyzerTestCase(TestCase):
+    """
+    The settings row and SCREENERS active screeners, `cls.screeners`,
+    slugs s0, s1, ... The database is rolled back after every test but
+    the cache isn't, so cached settings and pages are cleared as well.
+    """
+    SCREENERS = 3
+
+    @classmethod
+    def setUpClass(cls):
+        TEST_CACHE_SETTINGS.enable()
+        cls.addClassCleanup(TEST_CACHE_SETTINGS.disable)
+        cache.clear()
+        super().setUpClass()
+
+    @classmethod
+    def setUpTestData(cls):
+        GlobalSettings.get_setting()
+        cls.screeners = [
+            Screener.objects.create(url=f'https://chartink.com/screener/s{i}', name=f'Screener {i}') for i in range(cls.SCREENERS)
+        ]
+
+    def setUp(self):
+        cache.clear()
+        super().setUp()
+
+
+def make_job(screeners, symbols, completed_at):
+    """
+    A completed job in which the i-th screener returned every i-th symbol,
+    with its symbol summary and report.
+    """
+    job = ScanJob.objects.create(status='COMPLETED', progress=100, completed_at=completed_at)
+    instruments = {
+        symbol: Instrument.objects.get_or_create(symbol=symbol, defaults={'name': f'{symbol} Ltd', 'nse_code': symbol})[0]
+        for symbol in symbols
+    }
+    StockResult.objects.bulk_create([
+        StockResult(job=job, screener=screener, instrument=instruments[symbol], close_price=10.0, volume=100)
+        for step, screener in enumerate(screeners, start=1)
+        for symbol in symbols[::step]
+    ])
+    build_symbol_summary(job.id)
+    build_screener_bitmaps(job.id)
+    update_symbol_persistence(job.id)
+    report = ScanReport.objects.create(job=job, csv_file_path='', total_stocks=len(symbols))
+    ScanReport.objects.filter(id=report.id).update(created_at=completed_at) # auto_now_add ignores the argument
+    return job
+
+
+def make_scanner(job):
+    """
+    A scanner for `job` whose log is only flushed when asked, on the test's
+    thread: other threads can't see the test transaction.
+    """
+    scanner = ChartinkScanner(job.id)
+    scanner.state = LiveJobState(scanner.job, flush_interval=0, max_buffered=10000, shared=True)
+    return scanner
+
+
+class ClauseCacheTests(AnalyzerTestCase):
+    SCREENERS = 1
+    STOCKS = [{'nsecode': 'TCS', 'name': 'TCS Ltd', 'close': 3500.0, 'volume': 1000}]
+    CACHED_CLAUSE = '( {cash} ( latest close > 100 ) )'
+    FRESH_CLAUSE = '( {cash} ( latest close > 200 ) )'
+
+    def setUp(self):
+        super().setUp()
+        self.screener = self.screeners[0]
+        self.scanner = make_scanner(ScanJob.objects.create(status='RUNNING'))
+        self.cached = ScreenerClauseCache.objects.create(
+            screener=self.screener, scan_clause=self.CACHED_CLAUSE, clause_hash=clause_hash(self.CACHED_CLAUSE),
+        )
+
+    def process(self, *responses):
+        """
+        process_screener() with each POST answered by the next of
+        `responses` and tier 1 extracting FRESH_CLAUSE.
+        """
+        with patch('analyzer.services.fetch_csrf_token', return_value='token'), \
+                patch('analyzer.services.post_scan_clause', side_effect=responses) as post, \
+                patch.object(self.scanner, 'extract_with_http', return_value=(self.FRESH_CLAUSE, 'token')) as extract:
+            stocks = self.scanner.process_screener(self.screener)
+        self.assertEqual(stocks, self.STOCKS)
+        return [call.args[1] for call in post.call_args_list], extract.call_count
+
+    def assertCached(self, scan_clause):
+        cached = ScreenerClauseCache.objects.get(screener=self.screener)
+        self.assertEqual((cached.scan_clause, cached.clause_hash), (scan_clause, clause_hash(scan_clause)))
+        return cached
+
+    def test_hit_skips_extraction(self):
+        self.assertEqual(self.process(self.STOCKS), ([self.CACHED_CLAUSE], 0))
+        self.assertCached(self.CACHED_CLAUSE)
+
+    def test_expired_clause_is_extracted_again(self):
+        captured_at = timezone.now() - timedelta(seconds=self.cached.ttl_seconds + 1)
+        ScreenerClauseCache.objects.filter(id=self.cached.id).update(captured_at=captured_at)
+        self.assertEqual(self.process(self.STOCKS), ([self.FRESH_CLAUSE], 1))
+        self.assertGreater(self.assertCached(self.FRESH_CLAUSE).captured_at, captured_at)
+
+    def test_rejected_clause_is_extracted_again(self):
+        posted, extractions = self.process(ValueError("Chartink rejected scan_clause"), self.STOCKS)
+        self.assertEqual((posted, extractions), ([self.CACHED_CLAUSE, self.FRESH_CLAUSE], 1))
+        self.assertCached(self.FRESH_CLAUSE)
+
+
+class FakeResponse:
+    def __init__(self, content=b'', data=None):
+        self.content = content
+        self.data = data
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self.data
+
+
+class FakeSession:
+    """
+    A requests session answering every GET with `page` and every POST with `data`.
+    """
+    def __init__(self, page='', data=None):
+        self.page = page
+        self.data = data
+
+    def get(self, url, **kwargs):
+        return FakeResponse(content=self.page.encode())
+
+    def post(self, url, **kwargs):
+        return FakeResponse(data=self.data)
+
+
+SCREENER_PAGE = """<html><head><meta name="csrf-token" content="token"></head>
+<body>{}<script src="/js/app.js"></script></body></html>"""
+
+
+class ClauseExtractionTests(AnalyzerTestCase):
+    SCREENERS = 1
+
+    def extract(self, body):
+        return fetch_scan_clause(FakeSession(SCREENER_PAGE.format(body)), 'https://chartink.com/screener/s0')
+
+    def test_clause_found(self):
+        for body in [
+            '<script>var scan_clause = "( {cash} ( latest close > 100 ) )";</script>',
+            '<script>window.page = {"scan_clause": "( {cash} ( latest close > 100 ) )"};</script>',
+            '<textarea name="scan_clause">( {cash} ( latest close > 100 ) )</textarea>',
+        ]:
+            with self.subTest(body=body):
+                self.assertEqual(self.extract(body), ('( {cash} ( latest close > 100 ) )', 'token'))
+
+    def test_escaped_quotes(self):
+        body = r'<script>scan_clause = "( {cash} ( latest name = \"A\\\"B\" ) )"; other = "x";</script>'
+        self.assertEqual(self.extract(body)[0], '( {cash} ( latest name = "A\\"B" ) )')
+        body = r"<script>scan_clause = '( {cash} ( latest name = \'AB\' ) )';</script>"
+        self.assertEqual(self.extract(body)[0], "( {cash} ( latest name = 'AB' ) )")
+
+    def test_missing_clause_falls_through_to_the_browser(self):
+        self.assertEqual(self.extract('<script>renderScreener();</script>'), (None, 'token'))
+        self.assertIsNone(extract_scan_clause(BeautifulSoup('<input name="scan_clause" value=" ">', 'html.parser')))
+
+        scanner = make_scanner(ScanJob.objects.create(status='RUNNING'))
+        scanner._thread_state().session = FakeSession(SCREENER_PAGE.format(''), data={'data': [{'nsecode': 'TCS'}]})
+        with patch.object(scanner, 'capture_with_browser', return_value=('( {cash} ( latest close > 1 ) )', 'token')) as browser:
+            self.assertEqual(scanner.process_screener(self.screeners[0], use_cache=False), [{'nsecode': 'TCS'}])
+        browser.assert_called_once()
+        self.assertEqual(ScreenerClauseCache.objects.get(screener=self.screeners[0]).scan_clause, '( {cash} ( latest close > 1 ) )')
+
+    def test_rejected_clause_raises(self):
+        for data in [{'scan_error': 'Invalid scan clause', 'data': []}, {'message': 'no data'}]:
+            with self.subTest(data=data), self.assertRaises(ValueError):
+                post_scan_clause(FakeSession(data=data), '( {cash} )', 'token')
+        self.assertEqual(post_scan_clause(FakeSession(data={'data': [{'nsecode': 'TCS'}]}), '( {cash} )', 'token'), [{'nsecode': 'TCS'}])
+
+
+class AsyncScanEngineTests(IsolatedAsyncioTestCase):
+    """
+    The engine against a local stand-in for /screener/process that echoes
+    each request's clause, CSRF token and session cookie back.
+    """
+    async def asyncSetUp(self):
+        self.in_flight = self.max_in_flight = 0
+        app = web.Application()
+        app.router.add_post('/screener/process', self.process)
+        self.server = TestServer(app)
+        await self.server.start_server()
+        self.addAsyncCleanup(self.server.close)
+
+    async def process(self, request):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(0.02)
+            scan_clause = (await request.post())['scan_clause']
+            if scan_clause == 'fail':
+                return web.Response(status=500)
+            return web.json_response({'data': [{
+                'scan_clause': scan_clause,
+                'csrf_token': request.headers.get('X-Csrf-Token'),
+                'session': request.cookies.get('ci_session'),
+            }]})
+        finally:
+            self.in_flight -= 1
+
+    async def fetch_all(self, scan_clauses, max_in_flight):
+        engine = AsyncScanEngine(max_in_flight=max_in_flight, url=str(self.server.make_url('/screener/process')))
+        return await engine.fetch_all([
+            ProcessRequest(key, scan_clause, f'token{key}', {'ci_session': f'session{key}'})
+            for key, scan_clause in enumerate(scan_clauses)
+        ])
+
+    async def test_max_in_flight(self):
+        results = await self.fetch_all([f'clause {i}' for i in range(10)], max_in_flight=3)
+        self.assertEqual(len(results), 10)
+        self.assertEqual(self.max_in_flight, 3)
+
+    async def test_failure_is_returned_without_cancelling_the_rest(self):
+        results = await self.fetch_all(['clause 0', 'fail', 'clause 2'], max_in_flight=2)
+        self.assertIsInstance(results[1], Exception)
+        self.assertEqual([results[0][0]['scan_clause'], results[2][0]['scan_clause']], ['clause 0', 'clause 2'])
+
+    async def test_cookies_and_token_per_request(self):
+        results = await self.fetch_all(['clause 0', 'clause 1'], max_in_flight=2)
+        for key, stocks in results.items():
+            self.assertEqual((stocks[0]['csrf_token'], stocks[0]['session']), (f'token{key}', f'session{key}'))
+
+
+class ConcurrentScanTests(AnalyzerTestCase):
+    SCREENERS = 5
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        GlobalSettings.objects.update_or_create(id=1, defaults={'write_csv_reports': False})
+
+    def fetch(self, screener, use_cache=True):
+        # Later screeners answer sooner, so they finish out of submission order
+        position = self.screeners.index(screener)
+        time.sleep(0.01 * (self.SCREENERS - position))
+        if screener == self.failing:
+            raise ValueError("Chartink rejected scan_clause")
+        return [{'nsecode': f'SYM{i}', 'name': f'SYM{i} Ltd', 'close': float(i), 'volume': i} for i in range(position, 12, position + 1)]
+
+    def scan(self, concurrency):
+        job = ScanJob.objects.create(status='RUNNING')
+        scanner = make_scanner(job)
+        with patch.object(scanner, 'process_screener', side_effect=self.fetch):
+            scanner.scan_screeners(self.screeners, concurrency, GlobalSettings.get_setting())
+        scanner.complete(GlobalSettings.get_setting())
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'COMPLETED')
+        return list(StockResult.objects.filter(job=job).order_by('id').values_list('screener_id', 'instrument__symbol', 'close_price'))
+
+    def test_concurrent_scan_saves_the_serial_rows(self):
+        self.failing = None
+        self.assertEqual(self.scan(concurrency=4), self.scan(concurrency=1))
+
+    def test_failing_screener_leaves_the_others_saved(self):
+        self.failing = self.screeners[2]
+        rows = self.scan(concurrency=4)
+        self.assertEqual({screener_id for screener_id, _, _ in rows}, {s.id for s in self.screeners if s != self.failing})
+        error = ScanLogEntry.objects.get(event='screener', data__ok=False)
+        self.assertEqual(error.data['screener_id'], self.failing.id)
+
+
+class SaveResultsTests(AnalyzerTestCase):
+    SCREENERS = 2
+    STOCKS = [{'nsecode': f'SYM{i}', 'name': f'SYM{i} Ltd', 'close': float(i), 'volume': i} for i in range(30)]
+
+    def setUp(self):
+        super().setUp()
+        self.job = ScanJob.objects.create(status='RUNNING')
+        self.scanner = make_scanner(self.job)
+
+    def inserts(self, context):
+        return [query for query in context.captured_queries if query['sql'].startswith('INSERT INTO "analyzer_stockresult"')]
+
+    def test_one_screener_in_one_batch(self):
+        with CaptureQueriesContext(connection) as context:
+            symbols = self.scanner.save_results(self.screeners[0], self.STOCKS)
+        self.assertEqual(len(self.inserts(context)), 1)
+        self.assertEqual(symbols, [stock['nsecode'] for stock in self.STOCKS])
+        rows = StockResult.objects.filter(job=self.job).select_related('instrument').order_by('id')
+        self.assertEqual(
+            [(row.screener_id, row.instrument.symbol, row.close_price) for row in rows],
+            [(self.screeners[0].id, stock['nsecode'], stock['close']) for stock in self.STOCKS],
+        )
+
+    def test_failure_rolls_back_only_that_screener(self):
+        self.scanner.save_results(self.screeners[0], self.STOCKS)
+
+        def on_saved(screener, count, error):
+            raise RuntimeError("lease lost")
+
+        with patch('analyzer.services.RESULT_BATCH_SIZE', 10), CaptureQueriesContext(connection) as context:
+            with self.assertRaises(RuntimeError):
+                self.scanner.save_results(self.screeners[1], self.STOCKS, on_saved=on_saved)
+        self.assertEqual(len(self.inserts(context)), 3)
+        self.assertEqual(set(StockResult.objects.filter(job=self.job).values_list('screener_id', flat=True)), {self.screeners[0].id})
+
+
+class JobLogTestCase(AnalyzerTestCase):
+    """
+    A running job with five log lines.
+    """
+    SCREENERS = 0
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.job = ScanJob.objects.create(status='RUNNING', progress=40, log_seq=5)
+        ScanLogEntry.objects.bulk_create([ScanLogEntry(job=cls.job, seq=seq, message=f'line {seq}') for seq in range(1, 6)])
+
+
+class ScanStatusTests(JobLogTestCase):
+    def status(self, job=None, **params):
+        response = self.client.get(reverse('scan_status', args=[(job or self.job).id]), params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def lines(self, after):
+        return ''.join(f'{entry.line}\n' for entry in ScanLogEntry.objects.filter(job=self.job, seq__gt=after).order_by('seq'))
+
+    def test_lines_after_a_seq(self):
+        data = self.status()
+        self.assertEqual((data['status'], data['progress'], data['log'], data['last_seq']), ('RUNNING', 40, self.lines(0), 5))
+        data = self.status(after=3)
+        self.assertEqual((data['log'], data['last_seq']), (self.lines(3), 5))
+        self.assertEqual(data['log'].count('\n'), 2)
+        data = self.status(after=5) # Nothing new: the client keeps its seq
+        self.assertEqual((data['log'], data['last_seq']), ('', 5))
+
+    def test_jobs_logged_before_log_entries(self):
+        job = ScanJob.objects.create(status='COMPLETED', log='old line\n')
+        self.assertEqual((self.status(job)['log'], self.status(job)['last_seq']), ('old line\n', 0))
+
+    def test_bad_after(self):
+        for after in ['abc', '-1', '1.5']:
+            with self.subTest(after=after):
+                response = self.client.get(reverse('scan_status', args=[self.job.id]), {'after': after})
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(response.json()['status'], 'error')
+        self.assertEqual(self.client.get(reverse('scan_status', args=[999999])).status_code, 404)
+
+
+    def test_running_job_served_from_the_shared_cache(self):
+        self.addCleanup(cache.clear)
+        with override_settings(ANALYZER_JOB_STATE_CACHE='default'):
+            # Two task workers log to the job; the second publishes on top of the first
+            states = [LiveJobState(self.job, flush_interval=0, shared=True) for _ in range(2)]
+            with self.captureOnCommitCallbacks(execute=True): # Published once the lines are committed
+                states[0].log('from the first')
+                states[0].set_progress(60)
+                states[0].flush()
+            self.assertEqual(self.status()['last_seq'], 6)
+            with self.captureOnCommitCallbacks(execute=True):
+                states[1].log('from the second')
+                states[1].flush()
+            with self.assertNumQueries(0):
+                data = self.status(after=3)
+            self.assertEqual((data['status'], data['progress'], data['log'], data['last_seq']), ('RUNNING', 60, self.lines(3), 7))
+
+            snapshot = cache.get(CACHE_KEY.format(self.job.id))
+            states[1].close()
+            states[0].finish('COMPLETED')
+            self.assertEqual((self.status()['status'], self.status()['log']), ('COMPLETED', self.lines(0)))
+            # A snapshot written late by a slow writer doesn't bring the job back
+            cache.set(CACHE_KEY.format(self.job.id), snapshot)
+            self.assertEqual(self.status()['status'], 'COMPLETED')
+
+    def test_shared_cache_holds_the_logs_tail(self):
+        self.addCleanup(cache.clear)
+        with override_settings(ANALYZER_JOB_STATE_CACHE='default'), patch('analyzer.job_state.SNAPSHOT_LINES', 3):
+            state = LiveJobState(self.job, flush_interval=0, shared=True)
+            with self.captureOnCommitCallbacks(execute=True):
+                state.log('six')
+                state.flush()
+            with self.captureOnCommitCallbacks(execute=True):
+                state.log('seven')
+                state.flush()
+            self.assertEqual([line[0] for line in cache.get(CACHE_KEY.format(self.job.id))['lines']], [5, 6, 7])
+            with self.assertNumQueries(0):
+                data = self.status(after=4)
+            self.assertEqual(data['log'], self.lines(4))
+            # Further behind than the tail: the lines come from the database
+            with self.assertNumQueries(1):
+                data = self.status(after=1)
+            self.assertEqual((data['status'], data['log'], data['last_seq']), ('RUNNING', self.lines(1), 7))
+            state.close()
+
+
+class ScanEventTests(JobLogTestCase):
+    def frames(self, job=None, count=None, headers=None, **params):
+        """
+        The first `count` frames of the job's event stream (all of them
+        once it ends), as {field: value} dicts.
+        """
+        response = self.client.get(reverse('scan_events', args=[(job or self.job).id]), params, headers=headers or {})
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        frames = []
+        for chunk in response.streaming_content:
+            frames.append(dict(line.split(': ', 1) for line in chunk.decode().strip().splitlines()))
+            if len(frames) == count:
+                break
+        response.close()
+        return frames
+
+    def test_log_lines_carry_their_seq(self):
+        frames = self.frames(count=7)
+        self.assertEqual(frames[0], {'retry': '2000'})
+        self.assertEqual([(frame['event'], frame['id']) for frame in frames[1:6]], [('log', str(seq)) for seq in range(1, 6)])
+        self.assertEqual(json.loads(frames[1]['data'])['line'], ScanLogEntry.objects.get(job=self.job, seq=1).line)
+        self.assertEqual(frames[6]['event'], 'progress')
+
+    def test_resume_after_last_event_id(self):
+        ScanJob.objects.filter(id=self.job.id).update(status='COMPLETED', progress=100)
+        frames = self.frames(headers={'last-event-id': '3'})
+        self.assertEqual([(frame['event'], frame.get('id')) for frame in frames[1:]], [
+            ('log', '4'), ('log', '5'), ('progress', None), ('done', None),
+        ])
+        self.assertEqual([frame.get('id') for frame in self.frames(after=4)][1:3], ['5', None])
+
+    def test_bad_last_event_id_replays_everything(self):
+        ScanJob.objects.filter(id=self.job.id).update(status='COMPLETED')
+        for headers, params in [({'last-event-id': 'abc'}, {}), ({}, {'after': '-2'})]:
+            with self.subTest(headers=headers, params=params):
+                self.assertEqual([frame.get('id') for frame in self.frames(headers=headers, **params)][1:6], ['1', '2', '3', '4', '5'])
+
+
+class FakeDriver:
+    """
+    Stands in for a Chrome driver: reports `heap_mb` as its JS heap and
+    records whether it was quit.
+    """
+    def __init__(self, heap_mb=10):
+        self.heap_mb = heap_mb
+        self.quit_called = False
+
+    def execute_cdp_cmd(self, command, params):
+        if command == 'Performance.getMetrics':
+            return {'metrics': [{'name': 'JSHeapTotalSize', 'value': self.heap_mb * 1024 * 1024}]}
+        return {}
+
+    def execute_script(self, script):
+        pass
+
+    def get(self, url):
+        pass
+
+    def quit(self):
+        self.quit_called = True
+
+
+class BrowserPoolTests(SimpleTestCase):
+    def pool(self, **kwargs):
+        self.launched = []
+
+        def launch():
+            self.launched.append(FakeDriver())
+            return self.launched[-1]
+        return BrowserPool(driver_factory=launch, **kwargs)
+
+    def stats(self, pool):
+        stats = pool.stats()
+        return stats['hits'], stats['misses'], stats['recycled']
+
+    def test_most_recently_returned_driver_is_reused(self):
+        pool = self.pool()
+        with pool.checkout() as first, pool.checkout() as second:
+            pass # second goes back first, then first
+        with pool.checkout() as reused:
+            self.assertIs(reused, first)
+        self.assertEqual(self.stats(pool), (1, 2, 0))
+        self.assertEqual(pool.stats()['idle'], 2)
+
+    def test_recycled_after_max_pages(self):
+        pool = self.pool(max_pages=2)
+        for _ in range(3):
+            with pool.checkout():
+                pass
+        self.assertEqual(len(self.launched), 2)
+        self.assertTrue(self.launched[0].quit_called)
+        self.assertEqual(self.stats(pool), (1, 2, 1))
+
+    def test_recycled_past_the_heap_limit_or_after_an_error(self):
+        pool = self.pool(max_memory_mb=100)
+        with pool.checkout() as driver:
+            driver.heap_mb = 150
+        with self.assertRaises(RuntimeError), pool.checkout():
+            raise RuntimeError("page crashed")
+        self.assertTrue(all(driver.quit_called for driver in self.launched))
+        self.assertEqual(self.stats(pool), (0, 2, 2))
+
+    def test_checkouts_counted_per_batch(self):
+        pool = self.pool(max_pages=2)
+        first, second = Counter(), Counter()
+        with pool.checkout(stats=first), pool.checkout(stats=second):
+            pass
+        for _ in range(2):
+            with pool.checkout(stats=first):
+                pass
+        # Both drivers reach max_pages in the loop, so both recycles are the first batch's
+        self.assertEqual(dict(first), {'misses': 1, 'hits': 2, 'recycled': 2})
+        self.assertEqual(dict(second), {'misses': 1})
+        self.assertEqual(self.stats(pool), (2, 2, 2))
+
+    def test_resize(self):
+        pool = self.pool(max_size=2)
+        with pool.checkout(), pool.checkout():
+            pass
+        pool.resize(1)
+        self.assertEqual((pool.max_size, pool.stats()['idle']), (1, 1))
+        self.assertTrue(self.launched[1].quit_called) # The warmest one is kept
+
+    def test_get_pool_resizes_the_shared_pool(self):
+        with patch('analyzer.browser_pool._shared_pool', None):
+            pool = get_pool(max_size=2)
+            self.assertIs(get_pool(max_size=4), pool)
+            self.assertEqual(pool.max_size, 4)
+            self.assertIs(get_pool(), pool)
+            self.assertEqual(pool.max_size, 4)
+
+
+class SymbolSummaryTests(AnalyzerTestCase):
+    def test_matches_a_group_by_over_results(self):
+        job = make_job(self.screeners, [f'SYM{i:02}' for i in range(12)], timezone.now())
+        # Quotes and flags that differ between the screeners' rows
+        for row in StockResult.objects.filter(job=job).select_related('screener'):
+            StockResult.objects.filter(id=row.id).update(
+                close_price=row.screener_id * 1.5, volume=row.screener_id * 10, is_high_conviction=row.screener == self.screeners[2],
+            )
+        build_symbol_summary(job.id)
+
+        grouped = StockResult.objects.filter(job=job).values('instrument__symbol').annotate(
+            count=Count('screener', distinct=True), close=Max('close_price'), volume=Max('volume'), flag=Max('is_high_conviction'),
+        ).order_by('instrument__symbol')
+        summaries = JobSymbolSummary.objects.filter(job=job).order_by('symbol')
+        self.assertEqual(
+            [(s.symbol, s.screener_count, s.conviction_score, s.close_price, s.volume, s.is_high_conviction) for s in summaries],
+            [(g['instrument__symbol'], g['count'], float(g['count']), g['close'], g['volume'], bool(g['flag'])) for g in grouped],
+        )
+        # Ranked by count, ties sharing a rank
+        ranks = {s.screener_count: s.rank for s in summaries}
+        self.assertEqual(ranks, {3: 1, 2: 3, 1: 9}) # 2, 6 and 4 symbols
+
+
+class ViewQueryTests(AnalyzerTestCase):
+    """
+    The result views must run a fixed number of queries however much
+    history is stored, and every query must be answered from an index.
+    """
+    VIEW_QUERY_COUNTS = {
+        'dashboard': 4,
+        'result_detail': 5,
+        'result_stocks': 2,
+        'result_stocks_screener': 2,
+        'new_stocks': 5,
+        'download_csv': 3,
+        'export_job': 3,
+        'scan_diff': 5,
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        symbols = [f'SYM{i}' for i in range(60)]
+        now = timezone.now()
+        cls.old_job = make_job(cls.screeners, symbols[:40], now - timedelta(days=8))
+        cls.job = make_job(cls.screeners, symbols[20:], now)
+
+    def setUp(self):
+        super().setUp()
+        handle, self.csv_path = tempfile.mkstemp(suffix='.csv')
+        os.close(handle)
+        ScanReport.objects.filter(job=self.job).update(csv_file_path=self.csv_path)
+
+    def tearDown(self):
+        os.remove(self.csv_path)
+
+    def view_urls(self):
+        return {
+            'dashboard': reverse('dashboard'),
+            'result_detail': reverse('result_detail', args=[self.job.id]),
+            'result_stocks': reverse('result_stocks', args=[self.job.id]) + '?sort=-volume&limit=10',
+            'result_stocks_screener': reverse('result_stocks', args=[self.job.id]) + f'?screener={self.screeners[1].id}',
+            'new_stocks': reverse('new_stocks'),
+            'download_csv': reverse('download_csv', args=[self.job.id]),
+            'export_job': reverse('export_job', args=[self.job.id]) + '?format=ndjson',
+            'scan_diff': reverse('scan_diff') + f'?new={self.job.id}&old={self.old_job.id}',
+        }
+
+    def get(self, url):
+        cache.clear() # Memoized diffs would hide queries
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+            if getattr(response, 'streaming', False):
+                b''.join(response.streaming_content)
+        self.assertEqual(response.status_code, 200)
+        return context.captured_queries
+
+    def test_query_counts(self):
+        for name, url in self.view_urls().items():
+            with self.subTest(view=name):
+                self.assertEqual(len(self.get(url)), self.VIEW_QUERY_COUNTS[name])
+
+    def test_query_counts_do_not_grow_with_history(self):
+        for days in range(9, 14):
+            make_job(self.screeners, [f'OLD{days}_{i}' for i in range(50)], timezone.now() - timedelta(days=days))
+        self.test_query_counts()
+
+    @skipUnless(connection.vendor == 'sqlite', 'EXPLAIN QUERY PLAN is SQLite syntax')
+    def test_queries_use_indexes(self):
+        for name, url in self.view_urls().items():
+            with connection.cursor() as cursor:
+                for query in self.get(url):
+                    if not query['sql'].startswith('SELECT'):
+                        continue
+                    cursor.execute('EXPLAIN QUERY PLAN ' + query['sql'])
+                    plan = [row[-1] for row in cursor.fetchall()]
+                    with self.subTest(view=name, sql=query['sql']):
+                        # SEARCH = index lookup; SCAN = reading the whole table
+                        self.assertFalse([step for step in plan if step.startswith('SCAN')], plan)
+
+
+class IncidenceMatrixTests(SimpleTestCase):
+    PAIRS = [('TCS', 1), ('INFY', 1), ('INFY', 2), ('WIPRO', 2), ('TCS', 3), ('INFY', 3)]
+
+    def test_counts_and_ranks(self):
+        ranking = IncidenceMatrix.from_pairs(self.PAIRS).ranking()
+        self.assertEqual(ranking.labels.tolist(), ['INFY', 'TCS', 'WIPRO'])
+        self.assertEqual(ranking.counts.tolist(), [3, 2, 1])
+        self.assertEqual(ranking.ranks.tolist(), [1, 2, 3])
+
+    def test_weighted_ties_share_a_rank(self):
+        ranking = IncidenceMatrix.from_pairs(self.PAIRS).ranking(weights={2: 0.0, 3: 2.0})
+        self.assertEqual(ranking.labels.tolist(), ['INFY', 'TCS', 'WIPRO'])
+        self.assertEqual(ranking.scores.tolist(), [3.0, 3.0, 0.0])
+        self.assertEqual(ranking.ranks.tolist(), [1, 1, 3])
+
+    def test_threshold(self):
+        matrix = IncidenceMatrix.from_pairs(self.PAIRS)
+        self.assertEqual(sorted(matrix.above_threshold(2).tolist()), ['INFY', 'TCS'])
+
+    def test_empty(self):
+        ranking = IncidenceMatrix.from_pairs([]).ranking()
+        self.assertEqual(len(ranking.keys), 0)
+
+    def test_rows_without_a_symbol_are_skipped(self):
+        ranking = IncidenceMatrix.from_pairs(self.PAIRS + [(None, 1), (None, 2)]).ranking()
+        self.assertEqual(ranking.labels.tolist(), ['INFY', 'TCS', 'WIPRO'])
+        self.assertEqual(ranking.counts.tolist(), [3, 2, 1])
+
+    def test_cli_skips_null_codes(self):
+        # The command-line analyzer lives next to chartink_web, outside any package
+        path = os.path.join(os.path.dirname(settings.BASE_DIR), 'chartink_analyzer.py')
+        spec = importlib.util.spec_from_file_location('chartink_analyzer', path)
+        cli = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(cli)
+
+        stocks = [
+            {'nsecode': 'TCS', 'name': 'TCS'}, {'nsecode': None, 'bsecode': '500209', 'name': 'Infosys'},
+            {'nsecode': None, 'bsecode': None, 'name': 'Unlisted'},
+        ]
+        with patch.object(cli, 'ClauseFileCache'):
+            analyzer = cli.ChartinkAnalyzer()
+        with patch.object(analyzer, 'load_config', return_value={'screeners': ['s0', 's1']}), \
+                patch.object(analyzer, 'post_cached_clauses', return_value={'s0': stocks, 's1': stocks[:1]}), \
+                patch.object(analyzer, 'save_to_csv') as save, patch('builtins.print'):
+            analyzer.run()
+        self.assertEqual([row['symbol'] for row in save.call_args.args[0]], ['TCS', '500209', 'TCS'])
+        self.assertEqual(IncidenceMatrix.from_pairs(analyzer.hits).ranking().labels.tolist(), ['TCS', '500209'])
+
+
+class ConvictionScoreTests(AnalyzerTestCase):
+    SCREENERS = 2
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        Screener.objects.filter(id=cls.screeners[1].id).update(weight=3.0)
+
+    def scores(self, job):
+        return dict(JobSymbolSummary.objects.filter(job=job).values_list('symbol', 'conviction_score'))
+
+    def test_weighted(self):
+        GlobalSettings.objects.update_or_create(id=1, defaults={'scoring_mode': 'weighted'})
+        # Screener 1 returns A and B, screener 2 (weight 3) returns only A
+        job = make_job(self.screeners, ['A', 'B'], timezone.now())
+        self.assertEqual(self.scores(job), {'A': 4.0, 'B': 1.0})
+
+    def test_decay_carries_over_the_previous_score(self):
+        GlobalSettings.objects.update_or_create(id=1, defaults={'scoring_mode': 'decay', 'score_decay': 0.5})
+        make_job(self.screeners, ['A', 'B'], timezone.now() - timedelta(days=1))
+        job = make_job(self.screeners, ['A', 'C'], timezone.now())
+        self.assertEqual(self.scores(job), {'A': 4.0 + 0.5 * 4.0, 'C': 1.0})
+        self.assertEqual(JobSymbolSummary.objects.get(job=job, symbol='A').rank, 1)
+
+
+class ScreenerWeightTests(AnalyzerTestCase):
+    SCREENERS = 1
+
+    def test_bad_weights_are_rejected(self):
+        screener = self.screeners[0]
+        for weight in ['abc', 'nan', 'inf', '-inf']:
+            with self.subTest(weight=weight):
+                response = self.client.post(reverse('screener_add'), {'url': 'https://chartink.com/screener/new', 'name': 'New', 'weight': weight})
+                self.assertRedirects(response, reverse('screener_add'), fetch_redirect_response=False)
+                self.assertFalse(Screener.objects.filter(url='https://chartink.com/screener/new').exists())
+
+                edit_url = reverse('screener_edit', args=[screener.id])
+                response = self.client.post(edit_url, {'url': screener.url, 'name': 'Renamed', 'weight': weight})
+                self.assertRedirects(response, edit_url, fetch_redirect_response=False)
+                self.assertEqual(Screener.objects.get(id=screener.id).name, screener.name)
+
+    def test_negative_weights_become_zero(self):
+        self.client.post(reverse('screener_add'), {'url': 'https://chartink.com/screener/new', 'name': 'New', 'weight': '-2'})
+        self.assertEqual(Screener.objects.get(url='https://chartink.com/screener/new').weight, 0.0)
+        screener = self.screeners[0]
+        self.client.post(reverse('screener_edit', args=[screener.id]), {'url': screener.url, 'name': screener.name, 'weight': '2.5'})
+        self.assertEqual(Screener.objects.get(id=screener.id).weight, 2.5)
+
+
+class RerankTests(AnalyzerTestCase):
+    def flagged(self, job):
+        return list(JobSymbolSummary.objects.filter(job=job, is_high_conviction=True).values_list('symbol', flat=True))
+
+    def test_threshold_change_reflags_past_jobs(self):
+        old_job = make_job(self.screeners, ['A', 'B'], timezone.now() - timedelta(days=1))
+        job = make_job(self.screeners, ['A', 'B', 'C', 'D'], timezone.now())
+        self.assertEqual(JobSymbolSummary.objects.filter(job=job, is_high_conviction=True).count(), 0) # make_job never flags
+
+        response = self.client.post(reverse('update_settings'), {'min_ranking_threshold': '3'})
+        self.assertEqual(response.status_code, 302)
+        # Only A was returned by all three screeners
+        self.assertEqual(self.flagged(job), ['A'])
+        self.assertEqual(list(StockResult.objects.filter(job=job, is_high_conviction=True).values_list('instrument__symbol', flat=True).distinct()), ['A'])
+        self.assertEqual(ScanReport.objects.get(job=job).high_conviction_count, 1)
+
+        # Older scans wait for a worker
+        self.assertEqual(self.flagged(old_job), [])
+        self.assertTrue(GlobalSettings.objects.get().rerank_pending)
+        Worker(once=True, log=lambda message: None).work()
+        self.assertEqual(self.flagged(old_job), ['A'])
+        self.assertFalse(GlobalSettings.objects.get().rerank_pending)
+
+        response = self.client.post(reverse('rerank'), {'job_ids': str(job.id)})
+        self.assertEqual(response.json()['jobs'], 1)
+
+
+    def test_bad_settings_are_rejected(self):
+        for field, value in [
+            ('min_ranking_threshold', 'abc'), ('min_ranking_threshold', '1.5'), ('scan_concurrency', 'x'),
+            ('http_max_in_flight', '8x'), ('score_decay', 'abc'), ('score_decay', 'nan'),
+        ]:
+            with self.subTest(field=field, value=value):
+                # Nothing is saved when any field is bad
+                response = self.client.post(reverse('update_settings'), {'min_ranking_threshold': '5', field: value})
+                self.assertRedirects(response, reverse('screener_list'), fetch_redirect_response=False)
+                self.assertEqual(GlobalSettings.objects.get().min_ranking_threshold, 2)
+
+
+class ScanDiffTests(AnalyzerTestCase):
+    SCREENERS = 2
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.old_job = make_job(cls.screeners, ['A', 'B', 'C'], timezone.now() - timedelta(days=7))
+        cls.new_job = make_job(cls.screeners, ['B', 'D', 'A'], timezone.now())
+
+    def test_added_dropped_retained(self):
+        diff = diff_jobs(self.new_job, self.old_job)
+        self.assertEqual([entry['symbol'] for entry in diff['added']], ['D'])
+        self.assertEqual([entry['symbol'] for entry in diff['dropped']], ['C'])
+        retained = {entry['symbol']: entry['count_delta'] for entry in diff['retained']}
+        # The second screener returns every other symbol: A, C before and B, A now
+        self.assertEqual(retained, {'A': 0, 'B': 1})
+
+    def test_memoized_until_rerank(self):
+        diff_jobs(self.new_job, self.old_job)
+        with self.assertNumQueries(0): # The ranking version is cached too
+            diff_jobs(self.new_job, self.old_job)
+        rerank_jobs()
+        with self.assertNumQueries(2): # Settings, then the diff
+            diff_jobs(self.new_job, self.old_job)
+
+    def test_days_back_api(self):
+        response = self.client.get(reverse('api_diff'), {'days': 6})
+        self.assertEqual(response.json()['old_job']['id'], self.old_job.id)
+        response = self.client.get(reverse('api_diff'), {'days': 30})
+        self.assertEqual(response.status_code, 404)
+
+    def test_job_ids_that_arent_numbers(self):
+        for params in [{'new': 'abc'}, {'new': self.new_job.id, 'old': 'abc'}, {'new': 999999}]:
+            with self.subTest(params=params):
+                message = f"No scan job with id '{params.get('old', params['new'])}'."
+                response = self.client.get(reverse('api_diff'), params)
+                self.assertEqual((response.status_code, response.json()['message']), (404, message))
+                response = self.client.get(reverse('api_v1_diffs'), params)
+                self.assertEqual((response.status_code, response.json()['message']), (404, message))
+                response = self.client.get(reverse('scan_diff'), params)
+                self.assertEqual((response.status_code, response.context['error_message']), (200, message))
+
+
+class BitmapQueryTests(AnalyzerTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        now = timezone.now()
+        # s0 returns every symbol, s1 every other one and s2 every third one
+        cls.old_job = make_job(cls.screeners, ['A', 'B', 'C', 'D', 'E', 'F'], now - timedelta(days=1))
+        cls.new_job = make_job(cls.screeners, ['B', 'A', 'D', 'C'], now)
+
+    def symbols(self, expression, **kwargs):
+        return {match['symbol']: match['jobs'] for match in run_query(expression, **kwargs)['matches']}
+
+    def test_operators(self):
+        latest = {'job_ids': [self.old_job.id]}
+        self.assertEqual(self.symbols('s1 & s2', **latest), {'A': 1})
+        self.assertEqual(self.symbols('s0 and not s1', **latest), {'B': 1, 'D': 1, 'F': 1})
+        self.assertEqual(self.symbols('~(s1 | s2)', **latest), {'B': 1, 'F': 1})
+        self.assertEqual(self.symbols(f'"Screener 2" | {self.screeners[1].id}', **latest), {'A': 1, 'C': 1, 'D': 1, 'E': 1})
+
+    def test_modes_across_jobs(self):
+        self.assertEqual(self.symbols('s1', mode='any'), {'A': 1, 'B': 1, 'C': 1, 'D': 1, 'E': 1})
+        self.assertEqual(self.symbols('s1', mode='all'), {}) # A, C, E then B, D
+        self.assertEqual(self.symbols('s0', mode='all'), {'A': 2, 'B': 2, 'C': 2, 'D': 2})
+        self.assertEqual(self.symbols('s0', last=1), {'A': 1, 'B': 1, 'C': 1, 'D': 1})
+
+    def test_invalid_expressions(self):
+        for expression in ['', 's1 &', '(s1 | s2', 's1 s2', 'nope']:
+            with self.subTest(expression=expression):
+                with self.assertRaises(ValueError):
+                    parse_expression(expression)
+        response = self.client.get(reverse('api_query'), {'q': 's1 & nope'})
+        self.assertEqual(response.status_code, 400)
+
+
+class ScreenerOverlapTests(AnalyzerTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.idle = Screener.objects.create(url='https://chartink.com/screener/idle', name='Idle')
+        make_job(cls.screeners, ['A', 'B', 'C', 'D', 'E', 'F'], timezone.now())
+
+    def test_jaccard_and_inclusion(self):
+        overlap = screener_overlap()
+        self.assertEqual(overlap['hits'], [6, 3, 2])
+        pairs = {(pair['a'], pair['b']): pair for pair in overlap['pairs']}
+        s0, s1, s2 = (screener.id for screener in self.screeners)
+        # s1 (A, C, E) lies entirely inside s0 but is half its size
+        self.assertEqual((pairs[s0, s1]['jaccard'], pairs[s0, s1]['b_in_a']), (0.5, 1.0))
+        self.assertTrue(pairs[s0, s1]['redundant'])
+        # s1 and s2 (A, D) share only A
+        self.assertEqual(pairs[s1, s2]['jaccard'], 0.25)
+        self.assertFalse(pairs[s1, s2]['redundant'])
+        self.assertEqual([screener['id'] for screener in overlap['idle']], [self.idle.id])
+
+    def test_cached_per_window(self):
+        screener_overlap()
+        with self.assertNumQueries(2): # The window and the screener names
+            screener_overlap()
+        response = self.client.get(reverse('api_overlap'), {'last': 5})
+        self.assertEqual(response.json()['jobs'], list(ScanJob.objects.values_list('id', flat=True)))
+
+
+class SymbolPersistenceTests(AnalyzerTestCase):
+    SCREENERS = 1
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        now = timezone.now()
+        cls.jobs = [
+            make_job(cls.screeners, symbols, now - timedelta(days=days))
+            for days, symbols in [(3, ['A', 'B']), (2, ['A']), (1, ['A', 'B'])]
+        ]
+
+    def test_streaks(self):
+        persistence = {row.instrument.symbol: row for row in SymbolPersistence.objects.select_related('instrument')}
+        self.assertEqual(
+            (persistence['A'].current_streak, persistence['A'].longest_streak, persistence['A'].appearances), (3, 3, 3),
+        )
+        self.assertEqual(
+            (persistence['B'].current_streak, persistence['B'].longest_streak, persistence['B'].appearances), (1, 1, 2),
+        )
+        self.assertEqual(persistence['B'].first_seen_job_id, self.jobs[0].id)
+
+    def test_summary_reads_as_of_each_job(self):
+        streaks = dict(JobSymbolSummary.objects.filter(symbol='A').order_by('job_id').values_list('job_id', 'streak'))
+        self.assertEqual(list(streaks.values()), [1, 2, 3])
+        # Rebuilding a summary (e.g. when re-ranking) keeps its streaks
+        build_symbol_summary(self.jobs[1].id)
+        self.assertEqual(JobSymbolSummary.objects.get(job=self.jobs[1], symbol='A').streak, 2)
+
+    def test_update_is_idempotent(self):
+        update_symbol_persistence(self.jobs[-1].id)
+        self.assertEqual(SymbolPersistence.objects.get(instrument__symbol='A').appearances, 3)
+
+
+class ResultPaginationTests(AnalyzerTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.job = make_job(cls.screeners, [f'SYM{i:02}' for i in range(25)], timezone.now())
+
+    def pages(self, **params):
+        symbols, after = [], None
+        while True:
+            response = self.client.get(reverse('result_stocks', args=[self.job.id]), {**params, 'limit': 4, **({'after': after} if after else {})})
+            self.assertEqual(response.status_code, 200)
+            data = response.json()
+            symbols += [row['symbol'] for row in data['rows']]
+            after = data['next']
+            if not after:
+                return symbols
+
+    def test_pages_match_a_full_ordering(self):
+        summaries = JobSymbolSummary.objects.filter(job=self.job)
+        self.assertEqual(self.pages(), list(summaries.order_by('rank', 'symbol').values_list('symbol', flat=True)))
+        self.assertEqual(self.pages(sort='-symbol'), list(summaries.order_by('-symbol').values_list('symbol', flat=True)))
+        self.assertEqual(
+            self.pages(sort='-count'), list(summaries.order_by('screener_count', 'symbol').values_list('symbol', flat=True)),
+        )
+
+    def test_screener_tab(self):
+        returned = StockResult.objects.filter(job=self.job, screener=self.screeners[2]).values_list('instrument__symbol', flat=True)
+        self.assertEqual(sorted(self.pages(screener=self.screeners[2].id, sort='symbol')), sorted(returned))
+
+    def test_bad_parameters(self):
+        url = reverse('result_stocks', args=[self.job.id])
+        for params in [{'sort': 'nope'}, {'after': 'garbage'}, {'limit': 'x'}, {'screener': 'x'}]:
+            with self.subTest(params=params):
+                self.assertEqual(self.client.get(url, params).status_code, 400)
+
+
+class CompletedJobCacheTests(AnalyzerTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.job = make_job(cls.screeners, ['A', 'B', 'C'], timezone.now())
+
+    def urls(self):
+        return [reverse('dashboard'), reverse('result_detail', args=[self.job.id])]
+
+    def test_repeat_views_run_no_sql(self):
+        for url in self.urls():
+            with self.subTest(url=url):
+                self.client.get(url)
+                with self.assertNumQueries(0):
+                    self.assertEqual(self.client.get(url).status_code, 200)
+
+    def test_conditional_get(self):
+        for url in self.urls():
+            with self.subTest(url=url):
+                etag = self.client.get(url)['ETag']
+                self.assertEqual(self.client.get(url, headers={'if-none-match': etag}).status_code, 304)
+                rerank_jobs()
+                response = self.client.get(url, headers={'if-none-match': etag})
+                self.assertEqual(response.status_code, 200)
+                self.assertNotEqual(response['ETag'], etag)
+
+    def test_unshared_cache_is_flagged(self):
+        # Workers clear cached settings and pages in the cache the web server reads
+        self.assertEqual([warning.id for warning in check_shared_cache(None)], ['analyzer.W001'])
+        shared = {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': tempfile.gettempdir()}
+        with override_settings(CACHES={'default': shared}, ANALYZER_JOB_STATE_CACHE='default'):
+            self.assertEqual(check_shared_cache(None), [])
+
+    def test_running_jobs_are_not_cached(self):
+        job = ScanJob.objects.create(status='RUNNING')
+        response = self.client.get(reverse('result_detail', args=[job.id]))
+        self.assertFalse(response.has_header('ETag'))
+
+
+class ExportTests(AnalyzerTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.job = make_job(cls.screeners, [f'SYM{i:02}' for i in range(30)], timezone.now())
+
+    def export(self, url, **params):
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return response, b''.join(response.streaming_content)
+
+    def test_csv_matches_summary(self):
+        response, content = self.export(reverse('export_job', args=[self.job.id]))
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        rows = list(csv.reader(io.StringIO(content.decode())))
+        self.assertEqual(rows[0], [EXPORT_COLUMNS[column][1] for column in DEFAULT_COLUMNS])
+        symbols = JobSymbolSummary.objects.filter(job=self.job).order_by('rank', 'symbol').values_list('symbol', flat=True)
+        self.assertEqual([row[0] for row in rows[1:]], list(symbols))
+
+    def test_ndjson_columns_and_gzip(self):
+        response, content = self.export(reverse('export_job', args=[self.job.id]), format='ndjson', columns='symbol,rank', gzip='1')
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        self.assertIn('.ndjson.gz', response['Content-Disposition'])
+        rows = [json.loads(line) for line in gzip.decompress(content).decode().splitlines()]
+        self.assertEqual(len(rows), 30)
+        self.assertEqual(set(rows[0]), {'symbol', 'rank'})
+        self.assertEqual(rows[0]['rank'], 1)
+
+    def test_bad_parameters(self):
+        url = reverse('export_job', args=[self.job.id])
+        for params in [{'format': 'xlsx'}, {'columns': 'symbol,nope'}]:
+            with self.subTest(params=params):
+                self.assertEqual(self.client.get(url, params).status_code, 400)
+
+    @skipUnless(importlib.util.find_spec('pyarrow') is None, 'pyarrow is installed')
+    def test_parquet_needs_pyarrow(self):
+        self.assertEqual(self.client.get(reverse('export_job', args=[self.job.id]), {'format': 'parquet'}).status_code, 501)
+
+    def test_default_csv_columns_are_the_report_columns(self):
+        content = self.export(reverse('export_job', args=[self.job.id]))[1]
+        self.assertEqual(content.decode().splitlines()[0], 'Symbol,Name,NSE Code,BSE Code,Close Price,Volume,Screener Count,High Conviction')
+
+    @skipUnless(importlib.util.find_spec('pyarrow'), 'Parquet export needs pyarrow')
+    def test_parquet(self):
+        import pyarrow.parquet as pq
+
+        url = reverse('export_job', args=[self.job.id])
+        for gzipped in [False, True]:
+            with self.subTest(gzip=gzipped):
+                response, content = self.export(url, format='parquet', columns='symbol,rank,first_seen_at', gzip='1' if gzipped else '0')
+                table = pq.read_table(io.BytesIO(gzip.decompress(content) if gzipped else content))
+                self.assertEqual(table.column_names, ['symbol', 'rank', 'first_seen_at'])
+                summaries = JobSymbolSummary.objects.filter(job=self.job).order_by('rank', 'symbol')
+                self.assertEqual(table.column('symbol').to_pylist(), [s.symbol for s in summaries])
+                self.assertEqual(table.column('rank').to_pylist(), [s.rank for s in summaries])
+
+    def test_download_csv_streams_without_a_file(self):
+        # make_job records its report without writing a file
+        response, content = self.export(reverse('download_csv', args=[self.job.id]))
+        self.assertIn(f'scan_report_job_{self.job.id}.csv', response['Content-Disposition'])
+        self.assertEqual(len(content.decode().splitlines()), 31)
+
+
+class ApiTests(AnalyzerTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        now = timezone.now()
+        cls.old_job = make_job(cls.screeners, [f'SYM{i:02}' for i in range(20)], now - timedelta(days=7))
+        cls.job = make_job(cls.screeners, [f'SYM{i:02}' for i in range(10, 40)], now)
+        cls.running_job = ScanJob.objects.create(status='RUNNING')
+
+    def get(self, name, *args, expect=200, **params):
+        response = self.client.get(reverse(name, args=args), params)
+        self.assertEqual(response.status_code, expect)
+        return response
+
+    def pages(self, name, *args, **params):
+        rows, after = [], None
+        while True:
+            data = self.get(name, *args, limit=7, **params, **({'after': after} if after else {})).json()
+            rows += data['rows']
+            after = data['next']
+            if not after:
+                return rows
+
+    def test_jobs(self):
+        self.assertEqual([row['id'] for row in self.pages('api_v1_jobs')], [self.running_job.id, self.job.id, self.old_job.id])
+        rows = self.get('api_v1_jobs', status='COMPLETED', fields='id,completed_at').json()['rows']
+        self.assertEqual([set(row) for row in rows], [{'id', 'completed_at'}] * 2)
+        response = self.get('api_v1_jobs')
+        self.assertEqual(self.client.get(reverse('api_v1_jobs'), headers={'if-none-match': response['ETag']}).status_code, 304)
+
+    def test_job_detail(self):
+        data = self.get('api_v1_job', self.job.id).json()
+        self.assertEqual(data['total_symbols'], 30)
+        self.assertEqual([screener['count'] for screener in data['screeners']], [30, 15, 10])
+
+    def test_rankings(self):
+        summaries = JobSymbolSummary.objects.filter(job=self.job).order_by('rank', 'symbol')
+        self.assertEqual([row['symbol'] for row in self.pages('api_v1_rankings', self.job.id)], [s.symbol for s in summaries])
+        rows = self.pages('api_v1_rankings', self.job.id, fields='symbol,screener_count', min_count=2)
+        self.assertEqual(rows, [
+            {'symbol': s.symbol, 'screener_count': s.screener_count} for s in summaries if s.screener_count >= 2
+        ])
+
+    def test_rankings_conditional_get(self):
+        etag = self.get('api_v1_rankings', self.job.id, fields='symbol')['ETag']
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('api_v1_rankings', args=[self.job.id]), {'fields': 'symbol'}, headers={'if-none-match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertNotEqual(self.get('api_v1_rankings', self.job.id, fields='rank')['ETag'], etag)
+        self.assertFalse(self.get('api_v1_rankings', self.running_job.id).has_header('ETag'))
+
+    @skipUnless(connection.vendor == 'sqlite', 'EXPLAIN QUERY PLAN is SQLite syntax')
+    def test_rankings_are_index_only(self):
+        with CaptureQueriesContext(connection) as context:
+            self.get('api_v1_rankings', self.job.id, fields='symbol,rank,screener_count', min_count=2, after='WzEsIlNZTTEwIl0')
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + context.captured_queries[-1]['sql'])
+            plan = ' '.join(row[-1] for row in cursor.fetchall())
+        self.assertIn('USING COVERING INDEX summary_job_rank_cover_idx', plan)
+
+    def test_screener_results(self):
+        rows = self.pages('api_v1_screener_results', self.job.id, self.screeners[1].id, fields='symbol')
+        returned = StockResult.objects.filter(job=self.job, screener=self.screeners[1]).order_by('id')
+        self.assertEqual([row['symbol'] for row in rows], [result.symbol for result in returned])
+        rows = self.get('api_v1_screener_results', self.job.id, self.screeners[1].id, min_count=3).json()['rows']
+        self.assertEqual(len(rows), 5) # Every 6th symbol
+
+    def test_diffs(self):
+        params = {'new': self.job.id, 'old': self.old_job.id}
+        expected = diff_jobs(self.job, self.old_job)
+        for section in ['added', 'dropped', 'retained']:
+            with self.subTest(section=section):
+                rows = self.pages('api_v1_diffs', section=section, fields='symbol', **params)
+                self.assertEqual(rows, [{'symbol': entry['symbol']} for entry in expected[section]])
+        etag = self.get('api_v1_diffs', **params)['ETag']
+        self.assertEqual(self.client.get(reverse('api_v1_diffs'), params, headers={'if-none-match': etag}).status_code, 304)
+
+    def test_bad_parameters(self):
+        for name, args, params in [
+            ('api_v1_jobs', [], {'status': 'NOPE'}),
+            ('api_v1_jobs', [], {'fields': 'id,nope'}),
+            ('api_v1_rankings', [self.job.id], {'min_count': 'x'}),
+            ('api_v1_rankings', [self.job.id], {'after': 'garbage'}),
+            ('api_v1_diffs', [], {'section': 'nope'}),
+        ]:
+            with self.subTest(name=name, params=params):
+                self.get(name, *args, expect=400, **params)
+
+    def test_error_messages(self):
+        diff = {'new': self.job.id, 'old': self.old_job.id}
+        for name, args, params, message in [
+            ('api_v1_rankings', [self.job.id], {'min_count': 'x'}, 'min_count must be an integer.'),
+            ('api_v1_rankings', [self.job.id], {'limit': 'x'}, 'limit must be an integer.'),
+            # Hand-made cursors: values that aren't scalars, or don't fit the column
+            ('api_v1_rankings', [self.job.id], {'after': encode_cursor([{'a': 1}, 'A'])}, 'Invalid cursor.'),
+            ('api_v1_rankings', [self.job.id], {'after': encode_cursor(['x', 'A'])}, 'Invalid cursor.'),
+            ('api_v1_jobs', [], {'after': encode_cursor([[1]])}, 'Invalid cursor.'),
+            ('api_v1_diffs', [], {**diff, 'after': encode_cursor([])}, 'Invalid cursor.'),
+            ('api_v1_diffs', [], {**diff, 'after': encode_cursor([1.5])}, 'Invalid cursor.'),
+            ('api_v1_diffs', [], {'days': 'abc'}, 'days must be an integer.'),
+            ('api_v1_diffs', [], {'days': '0'}, 'days must be 1 or more.'),
+        ]:
+            with self.subTest(name=name, params=params):
+                self.assertEqual(self.get(name, *args, expect=400, **params).json()['message'], message)
+        self.get('api_v1_rankings', 999999, expect=404)
+        self.get('api_v1_diffs', expect=404, new=999999, old=self.job.id)
+
+
+class JobQueueTests(AnalyzerTestCase):
+    def test_enqueue_deduplicates_active_scans(self):
+        job, created = enqueue_scan()
+        self.assertTrue(created)
+        self.assertEqual(enqueue_scan(), (job, False))
+        claim_job('w1')
+        self.assertEqual(enqueue_scan(), (job, False))
+        ScanJob.objects.filter(id=job.id).update(status='COMPLETED')
+        self.assertTrue(enqueue_scan()[1])
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            ScanJob.objects.create() # Racing a request past the check still can't add a second one
+
+    def test_claims_are_exclusive(self):
+        job, _ = enqueue_scan()
+        claimed = claim_job('w1')
+        self.assertEqual((claimed.id, claimed.status, claimed.worker, claimed.attempts), (job.id, 'RUNNING', 'w1', 1))
+        self.assertIsNone(claim_job('w2'))
+        self.assertTrue(heartbeat(job.id, 'w1'))
+        self.assertFalse(heartbeat(job.id, 'w2'))
+
+    def test_orphans_are_requeued_then_failed(self):
+        job, _ = enqueue_scan()
+        claim_job('w1')
+        self.assertEqual(requeue_orphans(), (0, 0)) # Lease still valid
+        ScanJob.objects.filter(id=job.id).update(lease_expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(requeue_orphans(), (1, 0))
+        self.assertFalse(heartbeat(job.id, 'w1'))
+        for attempt in range(2, MAX_ATTEMPTS + 1):
+            self.assertEqual(claim_job('w2').attempts, attempt)
+            ScanJob.objects.filter(id=job.id).update(lease_expires_at=timezone.now() - timedelta(seconds=1))
+            requeue_orphans()
+        self.assertEqual(ScanJob.objects.get(id=job.id).status, 'FAILED')
+
+    def test_sweeps_are_rare_and_read_only_when_idle(self):
+        with CaptureQueriesContext(connection) as context:
+            self.assertEqual(requeue_orphans(), (0, 0))
+        self.assertEqual([query['sql'].split()[0] for query in context.captured_queries], ['SELECT'] * 3)
+
+        worker = Worker(concurrency=2, once=True, sweep_interval=60, log=lambda message: None)
+        with patch('analyzer.job_queue.requeue_orphans', return_value=(0, 0)) as sweep:
+            for slot in range(2):
+                worker.work(slot)
+            self.assertEqual(sweep.call_count, 1) # Once per interval for the whole process
+            worker._next_sweep = 0.0
+            worker.work()
+            self.assertEqual(sweep.call_count, 2)
+
+    def test_worker_survives_errors(self):
+        messages = []
+        worker = Worker(once=True, poll_interval=0, log=messages.append)
+        with patch.object(Worker, 'step', side_effect=[OperationalError('database is locked'), False]) as step:
+            worker.work()
+        self.assertEqual(step.call_count, 2) # Polled again after the error
+        self.assertIn('database is locked', messages[0])
+        self.assertTrue(messages[0].startswith(f'{worker_name(0)}: error'))
+
+    def test_worker_plans_scans_and_finalizes_once(self):
+        instrument = Instrument.objects.create(symbol='ABC', name='ABC Ltd', nse_code='ABC')
+        claims = []
+
+        def task_runner(tasks, worker, **kwargs):
+            # Stands in for scanning: one row per screener, saved with the task's DONE mark
+            claims.append([task.screener_id for task in tasks])
+            for task in tasks:
+                StockResult.objects.create(job_id=task.job_id, screener_id=task.screener_id, instrument=instrument)
+            ScanTask.objects.filter(id__in=[task.id for task in tasks]).update(status='DONE', result_count=1)
+
+        GlobalSettings.objects.update_or_create(id=1, defaults={'write_csv_reports': False})
+        job, _ = enqueue_scan()
+        worker = Worker(scan_concurrency=2, once=True, task_runner=task_runner, log=lambda message: None)
+        worker.work()
+        self.assertEqual(claims, [[self.screeners[0].id, self.screeners[1].id], [self.screeners[2].id]])
+        self.assertEqual((worker.tasks_run, worker.jobs_finalized), (3, 1))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.progress), ('COMPLETED', 100))
+        summary = JobSymbolSummary.objects.get(job=job)
+        self.assertEqual((summary.symbol, summary.screener_count), ('ABC', 3))
+        self.assertIsNone(claim_finalization('w2')) # Finalized once
+
+    def test_finalizer_that_lost_its_lease_leaves_the_job(self):
+        GlobalSettings.objects.update_or_create(id=1, defaults={'write_csv_reports': False})
+        job, _ = enqueue_scan()
+        plan_job(claim_job('planner'), 'planner')
+        ScanTask.objects.filter(job=job).update(status='DONE')
+        job = claim_finalization('w1')
+
+        def stall(scanner, write_file=True):
+            # w1 stalls past its lease and w2 takes the finalizing over
+            ScanJob.objects.filter(id=job.id).update(lease_expires_at=timezone.now() - timedelta(seconds=1))
+            requeue_orphans()
+            self.assertEqual(claim_finalization('w2').id, job.id)
+
+        with patch.object(ChartinkScanner, 'export_to_csv', stall):
+            finalize_job(job, 'w1', heartbeat_interval=60)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.worker), ('RUNNING', 'w2'))
+        self.assertIsNotNone(job.lease_expires_at)
+        self.assertFalse(heartbeat(job.id, 'w1'))
+        self.assertTrue(ScanLogEntry.objects.filter(job=job, message__contains='leaves the job').exists())
+
+        finalize_job(job, 'w2', heartbeat_interval=60)
+        self.assertEqual(ScanJob.objects.get(id=job.id).status, 'COMPLETED')
+
+    def test_finalizing_is_given_up_after_max_attempts(self):
+        job, _ = enqueue_scan()
+        plan_job(claim_job('planner'), 'planner')
+        ScanTask.objects.filter(job=job).update(status='DONE')
+        for attempt in range(1, MAX_ATTEMPTS + 1):
+            self.assertEqual(claim_finalization(f'w{attempt}').finalize_attempts, attempt)
+            # The finalizer dies every time
+            ScanJob.objects.filter(id=job.id).update(lease_expires_at=timezone.now() - timedelta(seconds=1))
+            self.assertEqual(requeue_orphans(), (0, 1) if attempt == MAX_ATTEMPTS else (1, 0))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.lease_expires_at), ('FAILED', None))
+        self.assertIsNone(claim_finalization('w9'))
+
+    def test_task_claims_are_exclusive(self):
+        job, _ = enqueue_scan()
+        plan_job(claim_job('planner'), 'planner')
+        self.assertIsNone(claim_finalization('w1')) # Tasks still pending
+        first, second = claim_tasks('w1', limit=2), claim_tasks('w2', limit=2)
+        self.assertEqual((len(first), len(second), claim_tasks('w3')), (2, 1, []))
+        self.assertEqual(heartbeat_tasks([task.id for task in first + second], 'w1'), 2)
+
+        # w2 dies: its task is requeued and claimed again
+        ScanTask.objects.filter(worker='w2').update(lease_expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(requeue_orphans(), (1, 0))
+        retried = claim_tasks('w3')
+        self.assertEqual((retried[0].id, retried[0].attempts), (second[0].id, 2))
+
+        ScanTask.objects.filter(job=job).update(status='DONE')
+        self.assertEqual(claim_finalization('w1').id, job.id)
+        self.assertIsNone(claim_finalization('w2'))
+
+    def test_shared_log_numbering(self):
+        job, _ = enqueue_scan()
+        states = [LiveJobState(job, flush_interval=0, shared=True) for _ in range(2)]
+        for i in range(3):
+            for state in states:
+                state.log(f'line {i}')
+                state.flush()
+        self.assertEqual(list(ScanLogEntry.objects.filter(job=job).values_list('seq', flat=True)), list(range(1, 7)))
+        self.assertEqual(ScanJob.objects.get(id=job.id).log_seq, 6)
+
+    def test_start_scan_only_enqueues(self):
+        first = self.client.post(reverse('start_scan')).json()
+        second = self.client.post(reverse('start_scan')).json()
+        self.assertEqual((first['created'], second['created']), (True, False))
+        self.assertEqual(first['job_id'], second['job_id'])
+        self.assertEqual(ScanJob.objects.get(id=first['job_id']).status, 'PENDING')
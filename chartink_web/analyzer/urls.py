@@ -1,11 +1,14 @@
 from django.urls import path
-from . import views
+from . import api, views
 
 urlpatterns = [
     path('', views.dashboard, name='dashboard'),
     path('api/scan/start/', views.start_scan, name='start_scan'),
     path('api/status/<int:job_id>/', views.scan_status, name='scan_status'),
+    path('api/events/<int:job_id>/', views.scan_events, name='scan_events'),
+    path('api/rerank/', views.rerank, name='rerank'),
     path('results/<int:job_id>/', views.result_detail, name='result_detail'),
+    path('api/results/<int:job_id>/stocks/', views.result_stocks, name='result_stocks'),
     
     path('config/', views.screener_list, name='screener_list'),
     path('config/add/', views.screener_add, name='screener_add'),
@@ -15,5 +18,19 @@ urlpatterns = [
     path('settings/update/', views.update_settings, name='update_settings'),
     
     path('new-stocks/', views.new_stocks_view, name='new_stocks'),
+    path('diff/', views.scan_diff, name='scan_diff'),
+    path('api/diff/', views.api_diff, name='api_diff'),
+    path('query/', views.screener_query, name='screener_query'),
+    path('api/query/', views.api_query, name='api_query'),
+    path('config/overlap/', views.overlap_view, name='screener_overlap'),
+    path('api/overlap/', views.api_overlap, name='api_overlap'),
     path('download-csv/<int:job_id>/', views.download_csv, name='download_csv'),
+    path('export/<int:job_id>/', views.export_job, name='export_job'),
+
+    # Versioned read-only API (see analyzer.api)
+    path('api/v1/jobs/', api.jobs, name='api_v1_jobs'),
+    path('api/v1/jobs/<int:job_id>/', api.job_detail, name='api_v1_job'),
+    path('api/v1/jobs/<int:job_id>/rankings/', api.rankings, name='api_v1_rankings'),
+    path('api/v1/jobs/<int:job_id>/screeners/<int:screener_id>/', api.screener_results, name='api_v1_screener_results'),
+    path('api/v1/diffs/', api.diffs, name='api_v1_diffs'),
 ]
@@ -1,20 +1,31 @@
 from django.shortcuts import render, redirect, get_object_or_404
-from django.http import JsonResponse, HttpResponse, FileResponse
-from django.views.decorators.http import require_POST
+from django.http import JsonResponse, HttpResponse, FileResponse, StreamingHttpResponse, Http404
+from django.views.decorators.http import condition, require_POST
 from django.contrib import messages
 from django.urls import reverse
 from django.db import models
-from django.db.models import Count
-from .models import Screener, ScanJob, StockResult, GlobalSettings, ScanReport
-from .services import ChartinkScanner, find_new_stocks
-import threading
+from django.db.models import Count, Value
+from django.db.models.functions import Coalesce
+from .models import Screener, ScanJob, StockResult, GlobalSettings, ScanReport, ScreenerClauseCache, JobSymbolSummary
+from .services import find_new_stocks
+from .job_queue import enqueue_scan
+from .joblog import read_job_status, job_event_stream
+from .rerank import request_rerank, rerank_jobs
+from .diff import diff_jobs, jobs_to_compare
+from .bitmaps import MODES, run_query
+from .overlap import screener_overlap
+from .pagination import keyset_page, page_size
+from .exports import DEFAULT_COLUMNS, EXPORT_FORMATS, ExportUnavailable, export_chunks, parse_columns
+from .caching import completed_job, job_context, job_etag, job_last_modified, latest_completed_job, query_variant, settings_version
 import json
+import math
 import os
 
-def dashboard(request):
-    # Get the most recent completed job for stats
-    recent_job = ScanJob.objects.filter(status='COMPLETED').order_by('-completed_at').first()
-    
+def _dashboard_etag(request):
+    recent_job = latest_completed_job()
+    return f'"dashboard-{recent_job.id}-{settings_version()}"' if recent_job else None
+
+def _dashboard_context(recent_job):
     settings = GlobalSettings.get_setting()
     threshold = settings.min_ranking_threshold
     
@@ -22,15 +33,11 @@ def dashboard(request):
     high_conviction_count = 0
     
     if recent_job:
-        # Group by symbol for high conviction stocks (matching detail page logic)
-        high_conviction_stocks = StockResult.objects.filter(
+        # One precomputed row per symbol, already ranked
+        high_conviction_stocks = list(JobSymbolSummary.objects.filter(
             job=recent_job,
-            is_high_conviction=True
-        ).values('symbol').annotate(
-            screener_count=Count('screener'),
-            close_price=models.Max('close_price'), 
-            volume=models.Max('volume')
-        ).filter(screener_count__gte=threshold).order_by('-screener_count', 'symbol')
+            is_high_conviction=True # Kept in line with the current threshold by re-ranking
+        ).order_by('rank', 'symbol'))
         
         high_conviction_count = len(high_conviction_stocks)
 
@@ -39,53 +46,117 @@ def dashboard(request):
     if recent_job:
         csv_report = ScanReport.objects.filter(job=recent_job).first()
     
-    context = {
+    return {
         'recent_job': recent_job,
         'high_conviction_stocks': high_conviction_stocks, # Show all unique ranked stocks meeting threshold
         'high_conviction_count': high_conviction_count,
         'threshold': threshold,
         'csv_report': csv_report
     }
+
+@condition(etag_func=_dashboard_etag)
+def dashboard(request):
+    # Get the most recent completed job for stats
+    recent_job = latest_completed_job()
+    context = job_context('dashboard', recent_job, lambda: _dashboard_context(recent_job))
     return render(request, 'analyzer/dashboard.html', context)
 
 @require_POST
 def start_scan(request):
+    """
+    Queue a scan for the run_worker processes. If one is already pending
+    or running, that job is returned instead of starting another.
+    """
     if not Screener.objects.filter(is_active=True).exists():
         return JsonResponse({'status': 'error', 'message': 'No active screeners found.'})
 
-    # Create Job
-    job = ScanJob.objects.create()
-    
-    # Start Background Thread
-    scanner = ChartinkScanner(job.id)
-    thread = threading.Thread(target=scanner.run)
-    thread.daemon = True # Daemon thread so it doesn't block server shutdown
-    thread.start()
-    
-    return JsonResponse({'status': 'success', 'job_id': job.id})
+    job, created = enqueue_scan()
+    return JsonResponse({'status': 'success', 'job_id': job.id, 'created': created})
+
+def _log_seq(value):
+    """
+    A log sequence number from ?after= or Last-Event-ID (0 if empty). Raises ValueError.
+    """
+    seq = int(value or 0)
+    if seq < 0:
+        raise ValueError(value)
+    return seq
 
 def scan_status(request, job_id):
-    job = get_object_or_404(ScanJob, id=job_id)
+    """
+    Job status plus the log lines after ?after=<seq> (all lines if omitted).
+    Poll again with the returned last_seq to receive only new lines.
+    """
+    try:
+        after_seq = _log_seq(request.GET.get('after'))
+    except ValueError:
+        return JsonResponse({'status': 'error', 'message': 'after must be a non-negative integer.'}, status=400)
+    try:
+        # Served from the live job registry (no SQL) while the job runs
+        status, progress, entries = read_job_status(job_id, after_seq)
+    except ScanJob.DoesNotExist:
+        raise Http404("No ScanJob matches the given query.")
+    if entries or after_seq:
+        log = ''.join(f"{entry.line}\n" for entry in entries)
+    else:
+        log = ScanJob.objects.filter(id=job_id).values_list('log', flat=True).get() # Jobs logged before ScanLogEntry existed
     return JsonResponse({
-        'status': job.status,
-        'progress': job.progress,
-        'log': job.log
+        'status': status,
+        'progress': progress,
+        'log': log,
+        'last_seq': entries[-1].seq if entries else after_seq
     })
 
+def scan_events(request, job_id):
+    """
+    Server-sent event stream of a job's new log lines, progress and
+    per-screener completions. Resumes after Last-Event-ID (or ?after=<seq>).
+    """
+    job = get_object_or_404(ScanJob, id=job_id)
+    try:
+        after_seq = _log_seq(request.headers.get('Last-Event-ID') or request.GET.get('after'))
+    except ValueError:
+        after_seq = 0 # Not an id this stream sent; replay from the start
+    response = StreamingHttpResponse(job_event_stream(job.id, after_seq), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no' # Don't let a proxy buffer the stream
+    return response
+
 def screener_list(request):
     screeners = Screener.objects.all().order_by('-is_active', 'name')
-    threshold = GlobalSettings.get_setting().min_ranking_threshold
+    settings = GlobalSettings.get_setting()
     return render(request, 'analyzer/screener_list.html', {
         'screeners': screeners,
-        'threshold': threshold
+        'threshold': settings.min_ranking_threshold,
+        'scan_concurrency': settings.scan_concurrency,
+        'http_max_in_flight': settings.http_max_in_flight,
+        'scoring_mode': settings.scoring_mode,
+        'scoring_choices': GlobalSettings.SCORING_CHOICES,
+        'score_decay': settings.score_decay,
+        'write_csv_reports': settings.write_csv_reports
     })
 
+def _screener_weight(value):
+    """
+    A screener weight from the form: 1.0 if empty, negatives raised to 0.
+    Raises ValueError for anything that isn't a finite number.
+    """
+    weight = float(value or 1.0)
+    if not math.isfinite(weight):
+        raise ValueError(value)
+    return max(0.0, weight)
+
 def screener_add(request):
     if request.method == 'POST':
         url = request.POST.get('url')
         name = request.POST.get('name')
+        try:
+            weight = _screener_weight(request.POST.get('weight'))
+        except ValueError:
+            messages.error(request, 'Weight must be a number of 0 or more.')
+            return redirect('screener_add')
         if url:
-            Screener.objects.create(url=url, name=name)
+            Screener.objects.create(url=url, name=name, weight=weight)
             messages.success(request, 'Screener added successfully.')
             return redirect('screener_list')
     return render(request, 'analyzer/screener_form.html') # Need to create this simple form
@@ -93,11 +164,24 @@ def screener_add(request):
 def screener_edit(request, id):
     screener = get_object_or_404(Screener, id=id)
     if request.method == 'POST':
-        screener.url = request.POST.get('url')
+        try:
+            weight = _screener_weight(request.POST.get('weight'))
+        except ValueError:
+            messages.error(request, 'Weight must be a number of 0 or more.')
+            return redirect('screener_edit', id=screener.id)
+        url = request.POST.get('url')
+        if url != screener.url:
+            # A different page means a different scan_clause
+            ScreenerClauseCache.objects.filter(screener=screener).delete()
+        screener.url = url
         screener.name = request.POST.get('name')
         screener.is_active = 'is_active' in request.POST
+        weight_changed = weight != screener.weight
+        screener.weight = weight
         screener.save()
         messages.success(request, 'Screener updated successfully.')
+        if weight_changed and GlobalSettings.get_setting().scoring_mode != 'count':
+            _rerank_latest(request)
         return redirect('screener_list')
     return render(request, 'analyzer/screener_form.html', {'screener': screener})
 
@@ -114,13 +198,16 @@ def screener_import(request):
         with open(config_path, 'r') as f:
             data = json.load(f)
             urls = data.get('screeners', [])
-            count = 0
-            for url in urls:
-                if not Screener.objects.filter(url=url).exists():
+            # One lookup for all URLs instead of one per URL
+            existing = set(Screener.objects.filter(url__in=urls).values_list('url', flat=True))
+            new_screeners = []
+            for url in dict.fromkeys(urls): # Keep config order, drop duplicates
+                if url not in existing:
                     # Try to extract a name from URL
                     name = url.split('/')[-1].replace('-', ' ').title()
-                    Screener.objects.create(url=url, name=name)
-                    count += 1
+                    new_screeners.append(Screener(url=url, name=name))
+            Screener.objects.bulk_create(new_screeners)
+            count = len(new_screeners)
             if count > 0:
                 messages.success(request, f'Successfully imported {count} screeners.')
             else:
@@ -130,76 +217,193 @@ def screener_import(request):
     
     return redirect('screener_list')
 
-def result_detail(request, job_id):
-    job = get_object_or_404(ScanJob, id=job_id)
+# ?sort= keys of result_stocks: (JobSymbolSummary field, descending by default, value standing in for NULL)
+RESULT_SORTS = {
+    'rank': ('rank', False, None),
+    'symbol': ('symbol', False, None),
+    'score': ('conviction_score', True, None),
+    'count': ('screener_count', True, None),
+    'streak': ('streak', True, None),
+    'price': ('close_price', True, 0.0),
+    'volume': ('volume', True, 0),
+}
+
+RESULT_FIELDS = [
+    'symbol', 'name', 'nse_code', 'bse_code', 'close_price', 'volume', 'screener_count', 'conviction_score', 'rank',
+    'is_high_conviction', 'streak', 'longest_streak', 'first_seen_at',
+]
+
+def _result_detail_context(job):
+    summaries = JobSymbolSummary.objects.filter(job=job)
     
-    # Calculate screener_count for each symbol
-    symbol_counts = StockResult.objects.filter(job=job).values('symbol').annotate(
-        screener_count=Count('screener')
+    # High Conviction (Unique symbols, sorted by conviction score)
+    high_conviction = summaries.filter(is_high_conviction=True)
+    high_conviction_stocks, high_conviction_next = keyset_page(
+        high_conviction.values(*RESULT_FIELDS), [('rank', False), ('symbol', False)],
     )
-    
-    # Create a dictionary for quick lookup
-    count_map = {item['symbol']: item['screener_count'] for item in symbol_counts}
-    
-    # Get all stocks and annotate with screener_count
-    all_stocks = list(StockResult.objects.filter(job=job).select_related('screener'))
-    for stock in all_stocks:
-        stock.screener_count = count_map.get(stock.symbol, 1)
-    
-    # Sort all stocks by screener_count descending
-    all_stocks.sort(key=lambda x: x.screener_count, reverse=True)
-    
-    # High Conviction (Unique symbols, sorted by screener_count)
-    settings = GlobalSettings.get_setting()
-    threshold = settings.min_ranking_threshold
-    
-    high_conviction_qs = [s for s in all_stocks if s.screener_count >= threshold]
-    seen = set()
-    high_conviction_stocks = []
-    for s in high_conviction_qs:
-        if s.symbol not in seen:
-            high_conviction_stocks.append(s)
-            seen.add(s.symbol)
-    
-    # Sort high conviction by screener_count (desc) then symbol (asc)
-    high_conviction_stocks.sort(key=lambda x: (-x.screener_count, x.symbol))
             
-    # Group by Screener for tabs
-    screener_groups = {}
-    for stock in all_stocks:
-        sid = stock.screener.id
-        if sid not in screener_groups:
-            screener_groups[sid] = {
-                'name': stock.screener.name, 
-                'stocks': [],
-                'count': 0
-            }
-        screener_groups[sid]['stocks'].append(stock)
-        screener_groups[sid]['count'] += 1
-    
-    # Sort stocks within each screener group by screener_count
-    for sid in screener_groups:
-        screener_groups[sid]['stocks'].sort(key=lambda x: x.screener_count, reverse=True)
+    # One tab per screener, with the number of symbols it returned
+    screener_groups = list(StockResult.objects.filter(job=job).values('screener_id', 'screener__name').annotate(
+        count=Count('instrument', distinct=True),
+    ).order_by('screener__name'))
         
-    context = {
+    return {
         'job': job,
-        'all_stocks': all_stocks,
         'high_conviction_stocks': high_conviction_stocks,
-        'high_conviction_count': len(high_conviction_stocks),
+        'high_conviction_next': high_conviction_next,
+        'high_conviction_count': high_conviction.count() if high_conviction_next else len(high_conviction_stocks),
         'screener_groups': screener_groups,
-        'total_count': len(all_stocks)
+        'total_count': summaries.count()
     }
+
+def _result_detail_etag(request, job_id):
+    return job_etag('result_detail', job_id)
+
+def _result_detail_last_modified(request, job_id):
+    return job_last_modified(job_id)
+
+@condition(etag_func=_result_detail_etag, last_modified_func=_result_detail_last_modified)
+def result_detail(request, job_id):
+    """
+    Job summary and the first page of its high conviction stocks. The
+    other tabs and further pages load from result_stocks.
+    """
+    job = completed_job(job_id) or get_object_or_404(ScanJob, id=job_id)
+    context = job_context('result_detail', job, lambda: _result_detail_context(job))
     return render(request, 'analyzer/result_detail.html', context)
+
+def result_stocks(request, job_id):
+    """
+    One page of a job's symbols as JSON, ordered in the database and
+    paginated by cursor: ?sort=<key> (prefix '-' to reverse), ?after=<next
+    cursor of the previous page>, ?limit=, and ?screener=<id> to keep the
+    symbols one screener returned or ?high_conviction=1 for the high
+    conviction ones.
+    """
+    job = get_object_or_404(ScanJob, id=job_id)
+    sort = request.GET.get('sort', 'rank')
+    key = sort.lstrip('-')
+    if key not in RESULT_SORTS:
+        return JsonResponse({'status': 'error', 'message': f"Unknown sort '{sort}'."}, status=400)
+    field, descending, null_value = RESULT_SORTS[key]
+    if sort.startswith('-'):
+        descending = not descending
+
+    rows = JobSymbolSummary.objects.filter(job=job)
+    screener_id = request.GET.get('screener')
+    if screener_id:
+        if not screener_id.isdigit():
+            return JsonResponse({'status': 'error', 'message': 'Invalid screener.'}, status=400)
+        returned = StockResult.objects.filter(job=job, screener_id=screener_id).values('instrument__symbol')
+        rows = rows.filter(symbol__in=returned)
+    if request.GET.get('high_conviction'):
+        rows = rows.filter(is_high_conviction=True)
+    rows = rows.values(*RESULT_FIELDS)
+    if null_value is not None:
+        sort_value = Coalesce(field, Value(null_value), output_field=JobSymbolSummary._meta.get_field(field))
+        rows = rows.annotate(sort_value=sort_value).values(*RESULT_FIELDS, 'sort_value')
+        field = 'sort_value'
+
+    # symbol is unique within a job, so it settles ties
+    order = [(field, descending), ('symbol', False)] if field != 'symbol' else [(field, descending)]
+    try:
+        page, next_cursor = keyset_page(rows, order, after=request.GET.get('after'), limit=page_size(request.GET.get('limit')))
+    except ValueError as e:
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
+    for row in page:
+        row.pop('sort_value', None)
+    return JsonResponse({'status': 'success', 'job_id': job.id, 'sort': sort, 'rows': page, 'next': next_cursor})
+
+def _rerank_latest(request):
+    """
+    After a ranking setting changed: re-rank the latest scan, the one the
+    pages show, right away and leave the older ones to a worker.
+    """
+    latest = ScanJob.objects.filter(status='COMPLETED').order_by('-completed_at').values_list('id', flat=True).first()
+    if latest:
+        rerank_jobs([latest])
+    request_rerank()
+    messages.success(request, "Re-ranked the latest scan. Older scans are queued for re-ranking by the worker (or run manage.py rerank_jobs).")
+
+def _setting_number(value, cast=int):
+    """
+    A settings form value as a number, None when empty. Raises ValueError.
+    """
+    if not value:
+        return None
+    number = cast(value)
+    if not math.isfinite(number):
+        raise ValueError(value)
+    return number
+
 @require_POST
 def update_settings(request):
-    threshold = request.POST.get('min_ranking_threshold')
-    if threshold:
+    try:
+        threshold = _setting_number(request.POST.get('min_ranking_threshold'))
+        concurrency = _setting_number(request.POST.get('scan_concurrency'))
+        max_in_flight = _setting_number(request.POST.get('http_max_in_flight'))
+        score_decay = _setting_number(request.POST.get('score_decay'), float)
+    except ValueError:
+        messages.error(request, 'Threshold, concurrency and in-flight requests must be whole numbers, score decay a number.')
+        return redirect('screener_list')
+
+    ranking_changed = False
+    if threshold is not None:
         settings = GlobalSettings.get_setting()
-        settings.min_ranking_threshold = int(threshold)
+        ranking_changed |= settings.min_ranking_threshold != threshold
+        settings.min_ranking_threshold = threshold
         settings.save()
         messages.success(request, f'Threshold updated to {threshold}.')
+    if concurrency is not None:
+        settings = GlobalSettings.get_setting()
+        settings.scan_concurrency = max(1, concurrency)
+        settings.save()
+        messages.success(request, f'Scan concurrency updated to {settings.scan_concurrency}.')
+    if max_in_flight is not None:
+        settings = GlobalSettings.get_setting()
+        settings.http_max_in_flight = max(1, max_in_flight)
+        settings.save()
+        messages.success(request, f'Max in-flight requests updated to {settings.http_max_in_flight}.')
+    write_csv_reports = request.POST.get('write_csv_reports')
+    if write_csv_reports in ('0', '1'):
+        settings = GlobalSettings.get_setting()
+        if settings.write_csv_reports != (write_csv_reports == '1'):
+            settings.write_csv_reports = write_csv_reports == '1'
+            settings.save()
+            messages.success(request, 'CSV files will be written at scan time.' if settings.write_csv_reports else 'CSV files will no longer be written at scan time; downloads stream from the database.')
+    scoring_mode = request.POST.get('scoring_mode')
+    if scoring_mode in dict(GlobalSettings.SCORING_CHOICES):
+        settings = GlobalSettings.get_setting()
+        ranking_changed |= settings.scoring_mode != scoring_mode
+        settings.scoring_mode = scoring_mode
+        settings.save()
+        messages.success(request, f'Scoring mode updated to {settings.get_scoring_mode_display()}.')
+    if score_decay is not None:
+        settings = GlobalSettings.get_setting()
+        score_decay = min(1.0, max(0.0, score_decay))
+        ranking_changed |= settings.score_decay != score_decay and settings.scoring_mode == 'decay'
+        settings.score_decay = score_decay
+        settings.save()
+        messages.success(request, f'Score decay updated to {settings.score_decay}.')
+    if ranking_changed:
+        # Past scans were flagged under the old settings
+        _rerank_latest(request)
     return redirect('screener_list')
 
+@require_POST
+def rerank(request):
+    """
+    Re-rank completed jobs under the current settings; all of them, or
+    those listed in job_ids (comma separated).
+    """
+    job_ids = request.POST.get('job_ids')
+    try:
+        job_ids = [int(job_id) for job_id in job_ids.split(',') if job_id.strip()] if job_ids else None
+    except ValueError:
+        return JsonResponse({'status': 'error', 'message': 'job_ids must be comma separated integers.'}, status=400)
+    summary = rerank_jobs(job_ids)
+    return JsonResponse({'status': 'success', **summary})
+
 def new_stocks_view(request):
     """
     Display stocks that are new in the latest scan compared to a week-old scan.
@@ -234,18 +438,157 @@ def new_stocks_view(request):
     }
     return render(request, 'analyzer/new_stocks.html', context)
 
+def scan_diff(request):
+    """
+    Symbols added, dropped and retained between two scans.
+    """
+    new_job, old_job, error = jobs_to_compare(request.GET)
+    context = {
+        'new_job': new_job,
+        'old_job': old_job,
+        'error_message': error,
+        'days': request.GET.get('days', 6),
+        'recent_jobs': ScanJob.objects.filter(status='COMPLETED').order_by('-completed_at')[:50],
+    }
+    if not error:
+        context['diff'] = diff_jobs(new_job, old_job)
+    return render(request, 'analyzer/diff.html', context)
+
+def api_diff(request):
+    """
+    JSON form of scan_diff.
+    """
+    new_job, old_job, error = jobs_to_compare(request.GET)
+    if error:
+        return JsonResponse({'status': 'error', 'message': error}, status=404)
+    diff = diff_jobs(new_job, old_job)
+    return JsonResponse({
+        'status': 'success',
+        'new_job': {'id': new_job.id, 'completed_at': new_job.completed_at},
+        'old_job': {'id': old_job.id, 'completed_at': old_job.completed_at},
+        **diff
+    })
+
+def _bitmap_query_from_request(request):
+    """
+    Run the screener expression in ?q= over ?last= jobs (or ?jobs=1,2,3)
+    with ?mode=any|all. Returns (result, error message).
+    """
+    expression = request.GET.get('q', '').strip()
+    if not expression:
+        return None, None
+    try:
+        last = max(1, int(request.GET.get('last', 10)))
+        job_ids = [int(job_id) for job_id in request.GET.get('jobs', '').split(',') if job_id.strip()]
+        return run_query(expression, last=last, job_ids=job_ids or None, mode=request.GET.get('mode', 'any')), None
+    except ValueError as e:
+        return None, str(e)
+
+def screener_query(request):
+    """
+    Boolean screener queries (AND/OR/NOT) across recent scans.
+    """
+    result, error = _bitmap_query_from_request(request)
+    context = {
+        'expression': request.GET.get('q', ''),
+        'last': request.GET.get('last', 10),
+        'mode': request.GET.get('mode', 'any'),
+        'modes': MODES,
+        'result': result,
+        'error_message': error,
+        'screeners': Screener.objects.order_by('name'),
+    }
+    return render(request, 'analyzer/query.html', context)
+
+def api_query(request):
+    """
+    JSON form of screener_query.
+    """
+    result, error = _bitmap_query_from_request(request)
+    if result is None:
+        return JsonResponse({'status': 'error', 'message': error or 'Missing expression (q).'}, status=400)
+    return JsonResponse({'status': 'success', **result})
+
+def _overlap_window(request):
+    try:
+        return max(1, int(request.GET.get('last', 20)))
+    except ValueError:
+        return 20
+
+def overlap_view(request):
+    """
+    Pairwise overlap between screeners over the last N scans, to spot
+    redundant ones.
+    """
+    last = _overlap_window(request)
+    overlap = screener_overlap(last)
+    # Row by row for the template: (screener, [(other screener, jaccard, inclusion), ...])
+    matrix = [
+        (screener, list(zip(overlap['screeners'], overlap['jaccard'][row], overlap['inclusion'][row])))
+        for row, screener in enumerate(overlap['screeners'])
+    ]
+    return render(request, 'analyzer/overlap.html', {'last': last, 'overlap': overlap, 'matrix': matrix})
+
+def api_overlap(request):
+    """
+    JSON form of overlap_view.
+    """
+    return JsonResponse({'status': 'success', **screener_overlap(_overlap_window(request))})
+
+def _export_response(job, export_format, columns, gzip, name):
+    content_type, extension = EXPORT_FORMATS[export_format]
+    filename = f'{name}.{extension}'
+    if gzip:
+        content_type, filename = 'application/gzip', filename + '.gz'
+    response = StreamingHttpResponse(export_chunks(job.id, export_format, columns, gzip), content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+def _export_etag(request, job_id):
+    # One ETag per combination of format, columns and compression
+    return job_etag(f'export-{query_variant(request)}', job_id)
+
+@condition(etag_func=_export_etag)
+def export_job(request, job_id):
+    """
+    Stream a job's symbols from the database in rank order:
+    ?format=csv|ndjson|parquet, ?columns=symbol,name,... and ?gzip=1.
+    """
+    job = completed_job(job_id) or get_object_or_404(ScanJob, id=job_id)
+    export_format = request.GET.get('format', 'csv')
+    if export_format not in EXPORT_FORMATS:
+        return HttpResponse(f"Unknown format '{export_format}'. Choose from: {', '.join(EXPORT_FORMATS)}.", status=400)
+    try:
+        columns = parse_columns(request.GET.get('columns'))
+    except ValueError as e:
+        return HttpResponse(str(e), status=400)
+    try:
+        return _export_response(job, export_format, columns, request.GET.get('gzip') == '1', f'scan_{job.id}')
+    except ExportUnavailable as e:
+        return HttpResponse(str(e), status=501)
+
+def _download_csv_etag(request, job_id):
+    return job_etag('download_csv', job_id)
+
+def _download_csv_last_modified(request, job_id):
+    return job_last_modified(job_id)
+
+@condition(etag_func=_download_csv_etag, last_modified_func=_download_csv_last_modified)
 def download_csv(request, job_id):
     """
-    Download the CSV report for a specific job.
+    Download the CSV report for a specific job: the file written at scan
+    time if there is one, otherwise the same CSV streamed from the database.
     """
-    job = get_object_or_404(ScanJob, id=job_id)
-    report = get_object_or_404(ScanReport, job=job)
+    job = completed_job(job_id) or get_object_or_404(ScanJob, id=job_id)
+    csv_file_path = job_context(
+        'download_csv', job, lambda: ScanReport.objects.filter(job=job).values_list('csv_file_path', flat=True).first() or '',
+    )
     
-    if not os.path.exists(report.csv_file_path):
-        return HttpResponse('CSV file not found.', status=404)
+    if not csv_file_path or not os.path.exists(csv_file_path):
+        return _export_response(job, 'csv', DEFAULT_COLUMNS, False, f'scan_report_job_{job.id}')
     
     # Serve the file
-    response = FileResponse(open(report.csv_file_path, 'rb'), content_type='text/csv')
-    filename = os.path.basename(report.csv_file_path)
+    response = FileResponse(open(csv_file_path, 'rb'), content_type='text/csv')
+    filename = os.path.basename(csv_file_path)
     response['Content-Disposition'] = f'attachment; filename="{filename}"'
     return response
@@ -77,10 +77,36 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # Several run_worker processes write at once: take the write lock when a transaction starts
+        # (no lock upgrade that fails straight away) and wait up to 20s for it
+        'OPTIONS': {
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 20,
+        },
     }
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# Pages and diffs of finished scans are cached here (see analyzer.caching). Scans run in separate
+# run_worker processes, so the cache has to be shared for a finished scan or a re-rank to reach
+# the web server: the file backend needs no extra service. Local memory only suits a single process.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / 'cache',
+    },
+    # 'default': {
+    #     'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    # },
+}
+
+# Workers publish live job state (status, progress, log lines) here for the web server to read
+ANALYZER_JOB_STATE_CACHE = 'default'
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 